@@ -0,0 +1,48 @@
+"""
+Benchmark of the density estimators of the repulsion effect for large crowds.
+Pedestrians are placed uniformly at random in a square scene with a few dense clusters.
+Reports the time of the kernel estimator (micro_macro.f90) and of the grid estimator (deposit and convolve),
+and the relative difference of the densities, and the mass (sum of the density times the cell area) of both estimators
+relative to the number of pedestrians.
+The grid estimator needs a kernel support (2h) of at least two cells, i.e. a smoothing length of at least 2 here.
+
+Run from the root of the repository: python3 benchmarks/density.py [smoothing length] [numbers of pedestrians...]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import numpy as np
+
+from lib.micro_macro import comp_dens_velo
+from macro.density import comp_dens_velo_grid
+
+smoothing_length = float(sys.argv[1]) if len(sys.argv) > 1 else 2
+numbers = [int(number) for number in sys.argv[2:]] or [10 ** 4, 10 ** 5, 10 ** 6]
+size = 500
+n_x = n_y = 250
+dx = dy = size / n_x
+
+print("%-10s %-8s %12s %12s %8s %16s %12s %12s" % ("agents", "h", "kernel (s)", "grid (s)", "speedup",
+                                                   "rel. difference", "kernel mass", "grid mass"))
+for number in numbers:
+    generator = np.random.default_rng(0)
+    uniform = generator.uniform(0, size, (number // 2, 2))
+    centers = generator.uniform(100, 400, (10, 2))
+    clusters = centers[generator.integers(10, size=number - number // 2)] + \
+        generator.normal(0, 20, (number - number // 2, 2))
+    positions = np.clip(np.vstack((uniform, clusters)), 0, size - 1e-6)
+    velocities = generator.normal(0, 1, (number, 2))
+    active = np.ones(number, dtype=int)
+    durations, densities = [], []
+    for estimator in (comp_dens_velo, comp_dens_velo_grid):
+        start = time.perf_counter()
+        density, _, _ = estimator(positions, velocities, active, n_x, n_y, dx, dy, smoothing_length)
+        durations.append(time.perf_counter() - start)
+        densities.append(density)
+    difference = np.linalg.norm(densities[1] - densities[0]) / np.linalg.norm(densities[0])
+    masses = [np.sum(density) * dx * dy / number for density in densities]
+    print("%-10d %-8.2f %12.3f %12.3f %8.1f %16.4f %12.4f %12.4f" % (
+        number, smoothing_length, durations[0], durations[1], durations[0] / durations[1], difference, *masses))
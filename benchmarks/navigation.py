@@ -0,0 +1,46 @@
+"""
+Benchmark of the navigation methods of knowing pedestrians.
+Reports the number of agents per second for which Knowing.assign_velocities computes the velocities,
+and the mean deviation in angle from the (most accurate) spline method.
+
+Run from the root of the repository: python3 benchmarks/navigation.py [scene file] [number of pedestrians]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import numpy as np
+
+from src.mercurial import Simulation
+from src.params import Parameters
+from populations.navigation import Navigator
+
+scene_file = sys.argv[1] if len(sys.argv) > 1 else 'scenes/cave.png'
+number = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+repetitions = 20
+
+params = Parameters()
+params.seed = 0
+simulation = Simulation(scene_file, params)
+simulation.add_pedestrians(number, 'knowing')
+simulation.set_visualisation(False)
+simulation.prepare()
+population = simulation.populations[0]
+positions = simulation.scene.position_array[population.indices]
+
+reference = None
+print("%-10s %16s %20s" % ("method", "agents/second", "mean deviation (deg)"))
+for method in Navigator.methods:
+    population.navigator = Navigator(population.pot_grad_x, population.pot_grad_y, method)
+    population.assign_velocities()
+    start = time.perf_counter()
+    for _ in range(repetitions):
+        population.assign_velocities()
+    duration = time.perf_counter() - start
+    directions = population.navigator.get_directions(positions)
+    if reference is None:
+        reference = directions
+    angle = np.arctan2(directions[:, 0] * reference[:, 1] - directions[:, 1] * reference[:, 0],
+                       np.sum(directions * reference, axis=1))
+    print("%-10s %16.0f %20.3f" % (method, number * repetitions / duration, np.degrees(np.mean(np.abs(angle)))))
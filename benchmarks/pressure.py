@@ -0,0 +1,49 @@
+"""
+Benchmark of the pressure solvers of the repulsion effect on fine grids.
+A synthetic crowd (dense clusters that exceed the maximum density, walking towards the center of the grid) is
+discretized on square grids of several sizes. Each solver solves the pressure from scratch (no warm start).
+Reports the number of iterations (sweeps or cycles), the residual and the wall time per solver.
+
+Run from the root of the repository: python3 benchmarks/pressure.py [grid sizes...]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import numpy as np
+
+from macro.pressure_solver import PressureSolver
+
+sizes = [int(size) for size in sys.argv[1:]] or [32, 64, 128, 256]
+max_density = 8
+dt = 0.05
+max_iterations = 20000
+
+
+def get_crowd(n):
+    """
+    Density and velocity fields of a synthetic crowd on an n x n grid of unit cells.
+    :param n: Number of cells in both directions
+    :return: density, velocity in x direction, velocity in y direction
+    """
+    x, y = np.meshgrid(np.linspace(0, 1, n), np.linspace(0, 1, n), indexing='ij')
+    density = np.zeros((n, n))
+    for center_x, center_y in ((0.3, 0.3), (0.7, 0.4), (0.5, 0.75)):
+        density += 1.5 * max_density * np.exp(-((x - center_x) ** 2 + (y - center_y) ** 2) / 0.02)
+    distance = np.maximum(np.hypot(0.5 - x, 0.5 - y), 1e-3)
+    return density, (0.5 - x) / distance, (0.5 - y) / distance
+
+
+print("%-10s %-10s %10s %12s %10s %8s" % ("grid", "solver", "iterations", "residual", "time (s)", "speedup"))
+for n in sizes:
+    density, velo_x, velo_y = get_crowd(n)
+    reference_duration = None
+    for method in PressureSolver.methods:
+        solver = PressureSolver(n, n, max_iterations=max_iterations, method=method)
+        start = time.perf_counter()
+        pressure, iterations, residual = solver.solve(density + 0.1, velo_x, velo_y, 1, 1, dt, max_density)
+        duration = time.perf_counter() - start
+        reference_duration = reference_duration or duration
+        print("%-10s %-10s %10d %12.2e %10.2f %8.1f" % ("%d x %d" % (n, n), method, iterations, residual, duration,
+                                                        reference_duration / duration))
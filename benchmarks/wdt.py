@@ -0,0 +1,112 @@
+"""
+Benchmark of the multi-resolution weighted distance transform for large scenes.
+The cost field of the scene image is upscaled (each pixel becomes a block of pixels) to emulate a high resolution scene.
+Reports the time of the full solve and of the multi-resolution approximation for several coarsening factors,
+the error of the approximation relative to the full solve, the mean deviation of the walking directions
+(steepest descent of the potential) and the number of local minima of the potential, in which pedestrians get stuck.
+Then, the same crowd of knowing pedestrians evacuates the (original) scene with each coarsening factor,
+and the number of pedestrians that reached an exit is reported.
+
+Run from the root of the repository: python3 benchmarks/wdt.py [scene file] [upscaling factor]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import numpy as np
+
+from lib.wdt import map_image_to_costs, get_weighted_distance_transform, get_multiresolution_wdt
+from src.mercurial import Simulation
+from src.params import Parameters
+
+scene_file = sys.argv[1] if len(sys.argv) > 1 else 'scenes/cave.png'
+upscaling = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+settings = [(2, 8), (4, 8), (8, 8), (8, 16)]
+number = 300
+steps = 400
+
+
+def get_directions(wdt_field):
+    """
+    Walking directions on the cell centers: the steepest descent of the potential, like Navigator.
+    :param wdt_field: weighted distance transform
+    :return: nx x ny x 2 array with unit directions, NaN where the potential is not finite
+    """
+    potential = np.where(np.isfinite(wdt_field), wdt_field, np.nan)
+    grad_x = np.pad(np.diff(potential, axis=0), ((1, 1), (0, 0)), 'edge')
+    grad_y = np.pad(np.diff(potential, axis=1), ((0, 0), (1, 1)), 'edge')
+    gradient = np.stack(((grad_x[:-1] + grad_x[1:]) / 2, (grad_y[:, :-1] + grad_y[:, 1:]) / 2), axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return -gradient / np.linalg.norm(gradient, axis=-1, keepdims=True)
+
+
+def count_local_minima(wdt_field, cost_field):
+    """
+    Number of cells (not exits) of which the potential is lower than that of all neighbours.
+    :param wdt_field: weighted distance transform
+    :param cost_field: cost field
+    :return: int
+    """
+    padded = np.pad(np.where(np.isfinite(wdt_field), wdt_field, np.inf), 1, 'constant', constant_values=np.inf)
+    center = padded[1:-1, 1:-1]
+    minima = (center < padded[:-2, 1:-1]) & (center < padded[2:, 1:-1]) & \
+        (center < padded[1:-1, :-2]) & (center < padded[1:-1, 2:])
+    return np.sum(minima & np.isfinite(center) & (cost_field > 0))
+
+
+def evacuate(coarsening, band_width, positions=None):
+    """
+    Simulate the evacuation of knowing pedestrians from the scene.
+    :param coarsening: params.wdt_coarsening
+    :param band_width: params.wdt_band_width
+    :param positions: Initial positions, or None to place the pedestrians with the seed
+    :return: number of pedestrians that reached an exit, initial positions
+    """
+    params = Parameters()
+    params.seed = 0
+    params.wdt_coarsening = coarsening
+    params.wdt_band_width = band_width
+    simulation = Simulation(scene_file, params)
+    simulation.add_pedestrians(number, 'knowing')
+    simulation.set_visualisation(False)
+    simulation.prepare()
+    # The accessible cells may differ slightly, which changes the placement: start from the same positions
+    if positions is not None:
+        simulation.scene.position_array[:] = positions
+    initial_positions = simulation.scene.position_array.copy()
+    for _ in range(steps):
+        simulation.step()
+    return number - np.sum(simulation.scene.active_entries), initial_positions
+
+
+cost_field = np.kron(map_image_to_costs(scene_file), np.ones((upscaling, upscaling)))
+print("Cost field of %d x %d cells" % cost_field.shape)
+start = time.perf_counter()
+reference = get_weighted_distance_transform(cost_field)
+full_duration = time.perf_counter() - start
+reachable = np.isfinite(reference) & (reference > 0)
+reference_directions = get_directions(reference)
+
+print("%-12s %6s %10s %8s %16s %16s %12s %16s %8s" % ("coarsening", "band", "time (s)", "speedup", "mean rel. error",
+                                                      "99% rel. error", "unreached", "direction (deg)", "minima"))
+print("%-12s %6s %10.2f %8.1f %16s %16s %12s %16s %8d" % ("full", "-", full_duration, 1, "-", "-", "-", "-",
+                                                          count_local_minima(reference, cost_field)))
+for coarsening, band_width in settings:
+    start = time.perf_counter()
+    wdt_field = get_multiresolution_wdt(cost_field, coarsening, band_width)
+    duration = time.perf_counter() - start
+    compared = reachable & np.isfinite(wdt_field)
+    error = np.abs(wdt_field[compared] - reference[compared]) / reference[compared]
+    cosine = np.sum(get_directions(wdt_field) * reference_directions, axis=-1)[compared]
+    deviation = np.degrees(np.arccos(np.clip(cosine[np.isfinite(cosine)], -1, 1)))
+    print("%-12d %6d %10.2f %8.1f %16.4f %16.4f %12d %16.2f %8d" % (
+        coarsening, band_width, duration, full_duration / duration, np.mean(error), np.percentile(error, 99),
+        np.sum(reachable & ~np.isfinite(wdt_field)), np.mean(deviation), count_local_minima(wdt_field, cost_field)))
+
+print("\nEvacuation of %d knowing pedestrians in %d steps (scene at its own resolution)" % (number, steps))
+print("%-12s %6s %10s" % ("coarsening", "band", "evacuated"))
+evacuated, initial_positions = evacuate(1, 8)
+print("%-12s %6s %10d" % ("full", "-", evacuated))
+for coarsening, band_width in settings:
+    print("%-12d %6d %10d" % (coarsening, band_width, evacuate(coarsening, band_width, initial_positions)[0]))
@@ -0,0 +1,36 @@
+"""
+Benchmark of the implementations of the weighted distance transform.
+Reports the time of each method on the cost field of a scene, and the difference with the Fortran module.
+The Python fast marching method is very slow and only included when requested.
+
+Run from the root of the repository: python3 benchmarks/wdt_methods.py [scene file] [methods...]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import numpy as np
+
+from lib.wdt import map_image_to_costs, get_weighted_distance_transform, fortran_lib
+
+scene_file = sys.argv[1] if len(sys.argv) > 1 else 'scenes/cave.png'
+methods = sys.argv[2:] or ['fortran', 'sweeping']
+if not fortran_lib and 'fortran' in methods:
+    methods.remove('fortran')
+
+cost_field = map_image_to_costs(scene_file)
+print("Cost field of %d x %d cells" % cost_field.shape)
+reference = get_weighted_distance_transform(cost_field, 'fortran') if fortran_lib else None
+print("%-10s %10s %18s %18s %12s" % ("method", "time (s)", "mean abs. diff.", "max abs. diff.", "unreached"))
+for method in methods:
+    start = time.perf_counter()
+    wdt_field = get_weighted_distance_transform(cost_field, method)
+    duration = time.perf_counter() - start
+    if reference is None:
+        print("%-10s %10.2f %18s %18s %12s" % (method, duration, "-", "-", "-"))
+        continue
+    compared = np.isfinite(reference) & np.isfinite(wdt_field)
+    difference = np.abs(wdt_field[compared] - reference[compared])
+    print("%-10s %10.2f %18.2e %18.2e %12d" % (method, duration, np.mean(difference), np.max(difference),
+                                               np.sum(np.isfinite(reference) & ~np.isfinite(wdt_field))))
@@ -5,7 +5,8 @@ try:
 
     fortran_lib = True
 except ImportError:
-    print("No Fortran modules found, falling back on Python implementation.\nDid you run `python3 setup.py install`?")
+    print("No Fortran modules found, falling back on the NumPy implementation (fast sweeping).\n"
+          "Did you run `python3 setup.py install`?")
     fortran_lib = False
 import math
 import heapq
@@ -14,7 +15,12 @@ import matplotlib
 matplotlib.use('TkAgg')
 import matplotlib.pyplot as plt
 from scipy.misc import imread
+from scipy.ndimage import binary_dilation, label
 
+WDT_METHODS = ('fortran', 'sweeping', 'marching')
+DEFAULT_WDT_METHOD = 'fortran' if fortran_lib else 'sweeping'
+# Changes with the multi-resolution approximation, so that cached fields of an older version are not used
+MULTIRESOLUTION_VERSION = 2
 DIR_STRINGS = ["left", "down", "right", "up"]
 DIRS = ((-1, 0), (0, -1), (1, 0), (0, 1))
 
@@ -51,7 +57,17 @@ def map_image_to_costs(image):
     return cost_field
 
 
-def get_weighted_distance_transform(cost_field):
+def get_exit_labels(cost_field):
+    """
+    Number the exits of a cost field: every connected group of exit cells (cost zero) is one exit.
+    :param cost_field: 2D array, see `map_image_to_costs`
+    :return: integer array with the exit number (starting from 1) of each cell, 0 for cells that are not exits;
+    number of exits
+    """
+    return label(cost_field == 0)
+
+
+def get_weighted_distance_transform(cost_field, method=None):
     """
     Compute the weighted distance transform from the cost field using a fast marching algorithm.
     We compute the distance transform with costs defined on a staggered grid for consistency.
@@ -59,23 +75,314 @@ def get_weighted_distance_transform(cost_field):
 
     Starting from the exit, we march over all the pixels with the lowest weighted distance iteratively,
     until we found values for all pixels in reach.
+    Three implementations are available:
+    'fortran': fast marching in the compiled Fortran module. Fastest.
+    'sweeping': fast sweeping with vectorized NumPy operations. Does not need compiled modules.
+    'marching': fast marching in Python. Very slow, mostly for educational purposes.
     :param cost_field: non-negative 2D array with cost in each cell/pixel, zero and infinity are allowed values.
+    :param method: One of WDT_METHODS. Leave empty for the Fortran module if it is compiled, and fast sweeping otherwise.
     :return: weighted distance transform field
     """
-    if fortran_lib:
+    method = method or DEFAULT_WDT_METHOD
+    if method == 'fortran':
+        if not fortran_lib:
+            raise ImportError("The Fortran module is not compiled. Run `python3 setup.py install` or use 'sweeping'")
         # Fortran does not allow for infinite float.
         nx, ny = cost_field.shape
         # Float that is (probably far) higher than the highest reachable potential
         obstacle_value = np.max(cost_field[cost_field < np.inf]) * (nx + ny) + 1
-        cost_field[cost_field == np.inf] = obstacle_value
+        # Leave the input untouched: it may be shared (or read-only, when memory-mapped from the field cache)
+        finite_cost_field = np.where(cost_field == np.inf, obstacle_value, cost_field)
         # Run the Fortran module
-        wdt_field = _wdt.weighted_distance_transform(cost_field, nx, ny, obstacle_value)
+        wdt_field = _wdt.weighted_distance_transform(finite_cost_field, nx, ny, obstacle_value)
         wdt_field[wdt_field >= obstacle_value] = np.inf
-        cost_field[cost_field >= obstacle_value] = np.inf
         return wdt_field
-    else:
+    elif method == 'sweeping':
+        return _wdt_sweeping(cost_field)
+    elif method == 'marching':
         # Run python implementation
         return _wdt_python(cost_field)
+    raise NotImplementedError("Distance transform method %s not implemented" % method)
+
+
+def get_multiresolution_wdt(cost_field, coarsening=4, band_width=8, max_iterations=1, tolerance=1e-6, method=None):
+    """
+    Approximate the weighted distance transform of large cost fields.
+    The distance transform is computed on a cost field that is coarser by a factor `coarsening`.
+    The coarse solution is interpolated bilinearly to the full resolution and raised by the cost of crossing
+    a coarse cell, so that it is an upper bound of the distance transform (coarse exits are larger than the exits,
+    so the coarse solution itself is too low). In a band around obstacles and exits, where the coarse solution is
+    least accurate, it is discarded. The whole field is then refined with a few iterations of fast sweeping, which only
+    decrease distances: the exact distances of the band spread over the field, and the potential has no local minima
+    where the band meets the coarse solution.
+    Coarse cells are exits if any of their cells is, and otherwise obstacles if any of their cells is
+    (narrow passages are then found by the sweeps).
+    :param cost_field: non-negative 2D array with cost in each cell/pixel, zero and infinity are allowed values.
+    :param coarsening: integer factor between the resolution of the cost field and the coarse field
+    :param band_width: width (in cells of the cost field) of the band around obstacles and exits that is solved again
+    :param max_iterations: number of iterations of the four sweeps over the full field
+    :param tolerance: sweeping stops when no distance decreases by more than this value
+    :param method: method of the distance transform on the coarse field, see get_weighted_distance_transform
+    :return: weighted distance transform field
+    """
+    nx, ny = cost_field.shape
+    factor = int(coarsening)
+    if factor <= 1:
+        return get_weighted_distance_transform(cost_field, method)
+    # Coarse cost field: highest cost in each block, so that thin walls are not lost
+    coarse_nx, coarse_ny = -(-nx // factor), -(-ny // factor)
+    blocks = np.ones([coarse_nx * factor, coarse_ny * factor]) * np.inf
+    blocks[:nx, :ny] = cost_field
+    blocks = blocks.reshape(coarse_nx, factor, coarse_ny, factor)
+    coarse_cost = np.max(blocks, axis=(1, 3))
+    coarse_cost[np.any(blocks == 0, axis=(1, 3))] = 0
+    coarse_wdt = get_weighted_distance_transform(coarse_cost, method)
+    # Distances are measured in cells, so they scale with the coarsening factor
+    wdt_field = _upsample(coarse_wdt * factor, factor, (nx, ny)) + factor * cost_field
+    # Band: close to obstacles and exits
+    special_cells = np.logical_or(cost_field == np.inf, cost_field == 0)
+    wdt_field[binary_dilation(special_cells, iterations=band_width)] = np.inf
+    wdt_field[cost_field == 0] = 0
+    padded, stride = _pad(wdt_field)
+    padded_costs, _ = _pad(cost_field)
+    cells = np.flatnonzero(np.logical_and(0 < padded_costs, padded_costs < np.inf))
+    _sweep(padded, padded_costs, stride, cells, max_iterations, tolerance)
+    return padded.reshape(nx + 2, stride)[1:-1, 1:-1].copy()
+
+
+def _upsample(coarse_field, factor, shape):
+    """
+    Bilinear interpolation of a field on cell centers to a grid that is finer by an integer factor.
+    Infinite values (obstacles) are left out of the interpolation; cells without any finite coarse neighbour are infinite.
+    :param coarse_field: 2D array
+    :param factor: integer factor between the resolutions
+    :param shape: shape of the fine field, at most factor times the shape of the coarse field
+    :return: fine field
+    """
+    axes = []
+    for size, coarse_size in zip(shape, coarse_field.shape):
+        # Position of the fine cell centers in coarse cells
+        coordinates = (np.arange(size) + 0.5) / factor - 0.5
+        lower = np.clip(np.floor(coordinates).astype(int), 0, max(coarse_size - 2, 0))
+        upper = np.minimum(lower + 1, coarse_size - 1)
+        axes.append((lower, upper, np.clip(coordinates - lower, 0, 1)))
+    (lower_x, upper_x, weight_x), (lower_y, upper_y, weight_y) = axes
+    total = np.zeros(shape)
+    weights = np.zeros(shape)
+    for cells_x, factors_x in ((lower_x, 1 - weight_x), (upper_x, weight_x)):
+        for cells_y, factors_y in ((lower_y, 1 - weight_y), (upper_y, weight_y)):
+            values = coarse_field[np.ix_(cells_x, cells_y)]
+            finite = np.isfinite(values)
+            corner_weights = np.where(finite, factors_x[:, None] * factors_y[None, :], 0)
+            total += corner_weights * np.where(finite, values, 0)
+            weights += corner_weights
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(weights > 0, total / weights, np.inf)
+
+
+def coarsen_cost_field(cost_field, shape):
+    """
+    Cost field on a coarser grid, like the pressure grid of the scene.
+    Each cell of the cost field belongs to the coarse cell that contains its center.
+    Coarse cells are exits if any of their cells is, and otherwise obstacles if more than half of their cells are.
+    Other coarse cells have the mean of the finite costs of their cells.
+    :param cost_field: 2D array, see `map_image_to_costs`
+    :param shape: shape of the coarse field, not larger than the shape of the cost field
+    :return: coarse cost field
+    """
+    nx, ny = cost_field.shape
+    rows = ((np.arange(nx) + 0.5) * shape[0] / nx).astype(int)
+    columns = ((np.arange(ny) + 0.5) * shape[1] / ny).astype(int)
+    cells = (rows[:, None] * shape[1] + columns[None, :]).ravel()
+    costs = cost_field.ravel()
+    finite = np.isfinite(costs)
+    size = shape[0] * shape[1]
+    counts = np.bincount(cells, minlength=size)
+    finite_counts = np.bincount(cells, weights=finite, minlength=size)
+    coarse_cost = np.bincount(cells, weights=np.where(finite, costs, 0), minlength=size) / np.maximum(finite_counts, 1)
+    coarse_cost[finite_counts < counts / 2] = np.inf
+    coarse_cost[np.bincount(cells, weights=costs == 0, minlength=size) > 0] = 0
+    return coarse_cost.reshape(shape)
+
+
+def update_weighted_distance_transform(wdt_field, cost_field, changed_cells, tolerance=1e-12):
+    """
+    Repair the weighted distance transform after the costs of some cells changed (blocked exits, closed doors, ...),
+    without computing it again on the whole field.
+    Cells whose distance may depend on the changed cells (their upwind descendants) are invalidated and computed
+    again with fast sweeping, restricted to these cells. Afterwards, decreases in distance (opened doors, new exits)
+    are propagated to the rest of the field by relaxing the neighbours of cells that changed.
+    :param wdt_field: weighted distance transform of the cost field before the change. Not modified.
+    :param cost_field: cost field after the change
+    :param changed_cells: boolean array with the cells of which the cost changed
+    :param tolerance: iterations stop when no distance changes by more than this value
+    :return: weighted distance transform field of the new cost field
+    """
+    nx, ny = cost_field.shape
+    padded, stride = _pad(wdt_field)
+    padded_costs, _ = _pad(cost_field)
+    accessible, _ = _pad(np.logical_and(0 < cost_field, cost_field < np.inf), False)
+    offsets = np.array([-stride, stride, -1, 1])[:, None]
+    # The neighbours of changed cells are invalid, because the costs of their faces changed
+    changed = np.flatnonzero(_pad(changed_cells, False)[0])
+    invalid = np.zeros(padded.size, dtype=bool)
+    invalid[changed] = True
+    invalid[(changed + offsets).ravel()] = True
+    invalid &= accessible
+    # Descendants: neighbours that were computed from an invalid cell, because it was their lowest neighbour
+    # along the axis of the face between them
+    frontier = np.flatnonzero(invalid)
+    while frontier.size:
+        neighbours = frontier + offsets
+        # Neighbours on the other side of the descendant candidates
+        opposites = neighbours + offsets
+        face_costs = (padded_costs[neighbours] + padded_costs[frontier]) / 2
+        opposite_costs = (padded_costs[neighbours] + padded_costs[np.clip(opposites, 0, padded.size - 1)]) / 2
+        opposite_values = padded[np.clip(opposites, 0, padded.size - 1)]
+        with np.errstate(invalid='ignore'):
+            depends = (padded[neighbours] > padded[frontier]) & \
+                      (padded[frontier] + face_costs <= opposite_values + opposite_costs)
+        depends &= accessible[neighbours] & ~invalid[neighbours]
+        frontier = np.unique(neighbours[depends])
+        invalid[frontier] = True
+    padded[invalid] = np.inf
+    padded[padded_costs == 0] = 0
+    padded[padded_costs == np.inf] = np.inf
+    _sweep(padded, padded_costs, stride, np.flatnonzero(invalid), nx + ny, tolerance)
+    # Propagate decreases from the repaired region and the changed cells to the rest of the field
+    active = (np.flatnonzero(invalid) + offsets).ravel()
+    active = np.unique(np.concatenate((active[accessible[active]], changed[accessible[changed]])))
+    _relax(padded, padded_costs, stride, active, accessible, nx * ny, tolerance, decrease_only=True)
+    return padded.reshape(nx + 2, stride)[1:-1, 1:-1].copy()
+
+
+def _wdt_sweeping(cost_field, max_iterations=None, tolerance=1e-12):
+    """
+    Fast sweeping: Gauss-Seidel iterations of the upwind discretization, in four orderings of the cells
+    (increasing/decreasing x combined with increasing/decreasing y).
+    See `_sweep`.
+    :param cost_field: 2D array, see `get_weighted_distance_transform`
+    :param max_iterations: maximum number of iterations of the four sweeps. Defaults to the number of rows plus columns
+    :param tolerance: iterations stop when no distance decreases by more than this value
+    :return: Weighted distance transform array with same shape as `cost_field`
+    """
+    nx, ny = cost_field.shape
+    if max_iterations is None:
+        max_iterations = nx + ny
+    wdt_field = np.ones_like(cost_field, dtype=float) * np.inf
+    wdt_field[cost_field == 0] = 0
+    padded, stride = _pad(wdt_field)
+    padded_costs, _ = _pad(cost_field)
+    cells = np.flatnonzero(np.logical_and(0 < padded_costs, padded_costs < np.inf))
+    _sweep(padded, padded_costs, stride, cells, max_iterations, tolerance)
+    return padded.reshape(nx + 2, stride)[1:-1, 1:-1].copy()
+
+
+def _pad(field, value=np.inf):
+    """
+    Pad a field with a layer of cells and flatten it, so that all cells have four neighbours.
+    In the flattened field, the neighbours of cell k are k - stride, k + stride, k - 1 and k + 1.
+    :param field: 2D array
+    :param value: value of the padding cells, impassable by default
+    :return: flattened padded array, stride
+    """
+    return np.pad(field, 1, 'constant', constant_values=value).ravel(), field.shape[1] + 2
+
+
+def _sweep(padded, padded_costs, stride, cells, max_iterations, tolerance):
+    """
+    Gauss-Seidel sweeps of the upwind discretization over a set of cells, in four orderings
+    (increasing/decreasing x combined with increasing/decreasing y).
+    In each ordering, a cell only depends on neighbours on the previous diagonal (like (i-1, j) and (i, j-1)),
+    so each diagonal of cells is updated at once with vectorized operations.
+    Distances only decrease; the other cells are boundary values.
+    The costs of the faces are the average of the costs of the two adjacent cells, like in the Fortran module.
+    :param padded: flattened distance field, see `_pad`. Updated in place.
+    :param padded_costs: flattened cost field, see `_pad`
+    :param stride: stride of the padded fields
+    :param cells: flat indices of the cells to update
+    :param max_iterations: maximum number of iterations of the four sweeps
+    :param tolerance: iterations stop when no distance decreases by more than this value
+    :return: None
+    """
+    cell_x, cell_y = np.divmod(cells, stride)
+    sweeps = []
+    for diagonal in (cell_x + cell_y, cell_x - cell_y):
+        # Sort the cells by diagonal, so that each diagonal is a slice
+        order = np.argsort(diagonal, kind='stable')
+        positions = cells[order]
+        neighbours = positions + np.array([-stride, stride, -1, 1])[:, None]
+        face_costs = (padded_costs[neighbours] + padded_costs[positions]) / 2
+        bounds = np.flatnonzero(np.diff(diagonal[order])) + 1
+        slices = [slice(start, end) for start, end in zip(np.r_[0, bounds], np.r_[bounds, len(order)])]
+        sweeps.append((positions, neighbours, face_costs, slices))
+        sweeps.append((positions, neighbours, face_costs, slices[::-1]))
+    for _ in range(max_iterations):
+        previous = padded[cells]
+        for positions, neighbours, face_costs, slices in sweeps:
+            for section in slices:
+                new_values = _eikonal_update(*padded[neighbours[:, section]], *face_costs[:, section])
+                padded[positions[section]] = np.minimum(padded[positions[section]], new_values)
+        if not np.any(padded[cells] < previous - tolerance):
+            break
+
+
+def _relax(padded, padded_costs, stride, active, updatable, max_iterations, tolerance, decrease_only=False):
+    """
+    Jacobi iterations of the upwind discretization on a changing set of active cells.
+    After each iteration, the updatable neighbours of the cells that changed are the new active cells.
+    :param padded: flattened distance field, see `_pad`. Updated in place.
+    :param padded_costs: flattened cost field, see `_pad`
+    :param stride: stride of the padded fields
+    :param active: flat indices of the cells to update first
+    :param updatable: flattened boolean array with the cells that may be updated
+    :param max_iterations: maximum number of iterations
+    :param tolerance: iterations stop when no distance changes by more than this value
+    :param decrease_only: only accept updates that decrease the distance
+    :return: None
+    """
+    offsets = np.array([-stride, stride, -1, 1])[:, None]
+    # Used to remove duplicate cells: only the last occurrence of a cell keeps its own index
+    last_occurrence = np.zeros(padded.size, dtype=np.intp)
+    for _ in range(max_iterations):
+        if not active.size:
+            break
+        neighbours = active + offsets
+        new_values = _eikonal_update(*padded[neighbours], *(padded_costs[neighbours] + padded_costs[active]) / 2)
+        if decrease_only:
+            new_values = np.minimum(new_values, padded[active])
+        with np.errstate(invalid='ignore'):
+            changed = np.abs(new_values - padded[active]) > tolerance
+        padded[active] = new_values
+        candidates = neighbours[:, changed].ravel()
+        candidates = candidates[updatable[candidates]]
+        order = np.arange(candidates.size)
+        last_occurrence[candidates] = order
+        active = candidates[last_occurrence[candidates] == order]
+
+
+def _eikonal_update(left, right, down, up, cost_left, cost_right, cost_down, cost_up):
+    """
+    Vectorized first order upwind update of cells from their neighbours, like propagate_dist in the Fortran module.
+    In each direction, the neighbour with the lowest potential plus cost is used.
+    If both directions give a valid solution of the quadratic equation, it is used; otherwise the one-sided update.
+    All arguments are arrays of the same shape, with the distances of the neighbours and the costs of the faces between.
+    :return: array with the updated distances
+    """
+    use_left = left + cost_left <= right + cost_right
+    hor_pot = np.where(use_left, left, right)
+    hor_cost = np.where(use_left, cost_left, cost_right)
+    use_down = down + cost_down <= up + cost_up
+    ver_pot = np.where(use_down, down, up)
+    ver_cost = np.where(use_down, cost_down, cost_up)
+    one_sided = np.minimum(hor_pot + hor_cost, ver_pot + ver_cost)
+    with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+        a = 1. / hor_cost ** 2 + 1. / ver_cost ** 2
+        b = -2. * (hor_pot / hor_cost ** 2 + ver_pot / ver_cost ** 2)
+        c = (hor_pot / hor_cost) ** 2 + (ver_pot / ver_cost) ** 2 - 1
+        two_sided = (-b + np.sqrt(b * b - 4 * a * c)) / (2 * a)
+        valid = np.isfinite(two_sided) & (two_sided >= np.maximum(hor_pot, ver_pot))
+    return np.where(valid, two_sided, one_sided)
 
 
 def plot(field):
@@ -0,0 +1,174 @@
+import sys
+
+sys.path.append('src')
+import copy
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from math_objects import functions as ft
+from mercurial import Simulation
+from params import Parameters
+
+
+class Ensemble:
+    """
+    Runs a number of independent replicas of the same scenario and collects their results.
+    Each replica is a headless simulation with its own seed. Replicas are distributed over a pool of processes,
+    so that all the cores of a machine can be used at once.
+    """
+
+    def __init__(self, scene_file, params=None, populations=None, replicas=1, effects=None, fires=None, seed=None,
+                 max_steps=0):
+        """
+        Create a new ensemble of simulations.
+
+        :param scene_file: Image file of the environment
+        :param params: Parameter object shared (as a copy) by all replicas
+        :param populations: list of (number, behaviour[, distribution[, goals]]) tuples,
+        added to each replica in this order
+        :param replicas: number of independent simulations
+        :param effects: list of effect names ('repulsion', 'separation') added to each replica
+        :param fires: list of (center, radius) tuples of fires added to each replica
+        :param seed: seed from which the seeds of the replicas are derived. Defaults to params.seed, random if both are empty.
+        :param max_steps: maximum number of time steps of each replica. 0 means no limit.
+        :return: Ensemble object
+        """
+        if type(replicas) != int or replicas < 1:
+            raise ValueError("Provide a positive integer as the number of replicas, not %s" % replicas)
+        self.scene_file = scene_file
+        if not params:
+            self.params = Parameters()
+        else:
+            self.params = params
+        self.populations = list(populations or [])
+        self.replicas = replicas
+        self.effects = list(effects or [])
+        self.fires = list(fires or [])
+        self.max_steps = max_steps
+        if seed is None:
+            seed = self.params.seed
+        # Well separated seeds, also for consecutive values of seed
+        self.seeds = np.random.SeedSequence(seed).generate_state(replicas)
+
+    def _get_configurations(self):
+        """
+        Collect everything a worker needs to reconstruct the simulation of each replica.
+        :return: list of dictionaries, one for each replica
+        """
+        return [{'scene_file': self.scene_file, 'params': self.params, 'populations': self.populations,
+                 'effects': self.effects, 'fires': self.fires, 'seed': int(seed),
+                 'max_steps': self.max_steps} for seed in self.seeds]
+
+    def run(self, workers=None):
+        """
+        Run all the replicas and merge their summaries.
+
+        :param workers: number of worker processes. Defaults to the number of cores, 1 runs all replicas in this process.
+        :return: EnsembleResult with the merged results
+        """
+        configurations = self._get_configurations()
+        ft.log("Running %d replicas of %s" % (self.replicas, self.scene_file))
+        if workers == 1:
+            summaries = [run_replica(configuration) for configuration in configurations]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                summaries = list(executor.map(run_replica, configurations))
+        return EnsembleResult(summaries)
+
+
+def run_replica(configuration):
+    """
+    Construct and run a single headless simulation. Module level function so that it can be sent to a worker process.
+
+    :param configuration: dictionary as created by Ensemble._get_configurations
+    :return: dictionary with the summary arrays of this replica
+    """
+    params = copy.deepcopy(configuration['params'])
+    params.seed = configuration['seed']
+    simulation = Simulation(configuration['scene_file'], params)
+    for population in configuration['populations']:
+        simulation.add_pedestrians(*population)
+    for effect in configuration['effects']:
+        if effect.lower() == 'separation':
+            simulation.add_local(effect)
+        else:
+            simulation.add_global(effect)
+    for center, radius in configuration['fires']:
+        simulation.add_fire(center, radius)
+    simulation.set_visualisation(False)
+    simulation.set_store_positions(False)
+    simulation.run(max_steps=configuration['max_steps'])
+    simulation.finish()
+
+    # Pedestrian arrays may be compacted or reused, so the summaries are indexed by the unique pedestrian counter
+    scene = simulation.scene
+    counters = scene.counter_array[scene.active_entries]
+    final_positions = np.ones([scene.spawned_pedestrians, 2]) * np.nan
+    final_positions[counters] = scene.position_array[scene.active_entries]
+    active = np.zeros(scene.spawned_pedestrians, dtype=bool)
+    active[counters] = True
+    return {'seed': configuration['seed'], 'counter': scene.counter, 'time': scene.time,
+            'exit_times': scene.get_exit_times(), 'final_positions': final_positions, 'active': active}
+
+
+class EnsembleResult:
+    """
+    Merged summaries of all replicas of an ensemble.
+    Per-pedestrian arrays have the replica as first dimension and are indexed by the unique pedestrian counter.
+    Replicas with fewer pedestrians are padded with NaN.
+    """
+
+    def __init__(self, summaries):
+        """
+        Merge the summaries of the replicas into arrays.
+
+        :param summaries: list of summary dictionaries as returned by run_replica
+        :return: EnsembleResult object
+        """
+        self.replicas = len(summaries)
+        self.seeds = np.array([summary['seed'] for summary in summaries])
+        self.counters = np.array([summary['counter'] for summary in summaries])
+        self.times = np.array([summary['time'] for summary in summaries])
+        max_pedestrians = max(len(summary['active']) for summary in summaries)
+        self.exit_times = np.ones([self.replicas, max_pedestrians]) * np.nan
+        self.final_positions = np.ones([self.replicas, max_pedestrians, 2]) * np.nan
+        self.active = np.zeros([self.replicas, max_pedestrians], dtype=bool)
+        for i, summary in enumerate(summaries):
+            num = len(summary['active'])
+            self.exit_times[i, :num] = summary['exit_times']
+            self.final_positions[i, :num] = summary['final_positions']
+            self.active[i, :num] = summary['active']
+
+    def get_evacuation_times(self):
+        """
+        Time at which the last pedestrian left the scene, for each replica.
+        Replicas that stopped before all pedestrians left the scene did not evacuate: their time is infinite.
+        See get_last_exit_times for the time of the last exit of those replicas.
+        :return: array with length the number of replicas
+        """
+        return np.where(self.get_evacuated_fraction() < 1, np.inf, self.get_last_exit_times())
+
+    def get_last_exit_times(self):
+        """
+        Time at which the last pedestrian that exited left the scene, for each replica.
+        NaN for replicas in which nobody exited.
+        :return: array with length the number of replicas
+        """
+        exited = np.isfinite(self.exit_times)
+        return np.where(np.any(exited, axis=1), np.max(np.where(exited, self.exit_times, -np.inf), axis=1), np.nan)
+
+    def get_evacuated_fraction(self):
+        """
+        Fraction of the pedestrians that exited the scene, for each replica.
+        :return: array with length the number of replicas
+        """
+        return np.sum(np.isfinite(self.exit_times), axis=1) / np.sum(
+            np.logical_or(np.isfinite(self.exit_times), self.active), axis=1)
+
+    def __repr__(self):
+        evacuation_times = self.get_evacuation_times()
+        evacuated = np.isfinite(evacuation_times)
+        return "EnsembleResult(%d replicas, mean evacuated fraction %.3f, %d replicas evacuated " \
+               "in a mean time of %.2f)" % (self.replicas, np.mean(self.get_evacuated_fraction()), np.sum(evacuated),
+                                            np.mean(evacuation_times[evacuated]) if np.any(evacuated) else np.nan)
@@ -28,10 +28,11 @@ class Fire:
         self.smoke_module = None
         self.on_step_functions = []
 
-    def prepare(self, params):
+    def prepare(self, params, state=None):
         """
         Called before the simulation starts. Fix all parameters and bootstrap functions.
 
+        :param state: Dictionary as returned by get_state to resume from
         :return: None
         """
         self.params = params
@@ -39,11 +40,20 @@ class Fire:
             raise ValueError("Fire coordinates %s do not lie within scene" % self.center)
         if self.cause_smoke:
             self.smoke_module = Smoke(self)
-            self.smoke_module.prepare(self.params)
+            self.smoke_module.prepare(self.params, state)
             self.on_step_functions.append(self.smoke_module.step)
         if self.repelling:
             self.on_step_functions.append(self._repel_pedestrians)
 
+    def get_state(self):
+        """
+        The state of the smoke caused by the fire, used for checkpoints.
+        :return: dictionary with arrays
+        """
+        if self.smoke_module:
+            return self.smoke_module.get_state()
+        return {}
+
     def step(self):
         [step() for step in self.on_step_functions]
 
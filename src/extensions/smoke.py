@@ -22,10 +22,11 @@ class Smoke:
         self.smoke_field = self.sparse_disc_matrix = None
         self.source = None
 
-    def prepare(self, params):
+    def prepare(self, params, state=None):
         """
         Called before the simulation starts. Fix all parameters and bootstrap functions.
 
+        :param state: Dictionary as returned by get_state to resume from, instead of computing the sparse matrix
         :return: None
         """
         self.params = params
@@ -34,20 +35,45 @@ class Smoke:
         nx, ny = (self.scene.size.array / (prop_dx, prop_dy)).astype(int)
         dx, dy = self.scene.size.array / (nx, ny)
 
-        self.obstacles = np.ones((nx + 2, ny + 2), dtype=int)
-        self.obstacles[1:-1, 1:-1] = self.scene.get_obstacles(nx, ny)
         self.speed_ref = self.scene.max_speed_array
         self.params.smoke = True
-        self.smoke = np.zeros(np.prod(self.obstacles.shape))
         self.smoke_field = Field((nx, ny), Field.Orientation.center, 'smoke', (dx, dy))
         # Note: This object is monkey patched in the params object.
         self.params.smoke_field = self.smoke_field
+        if state is not None:
+            self.set_state(state)
+            return
+        self.obstacles = np.ones((nx + 2, ny + 2), dtype=int)
+        self.obstacles[1:-1, 1:-1] = self.scene.get_obstacles(nx, ny)
+        self.smoke = np.zeros(np.prod(self.obstacles.shape))
         self.sparse_disc_matrix = get_sparse_matrix(
             self.params.diffusion, self.params.velocity_x, self.params.velocity_y,
             dx, dy, self.params.dt, self.obstacles)
         # Ready for use per time step
         self.source = self._get_source(self.fire, nx + 2, ny + 2).flatten() * self.params.dt
 
+    def get_state(self):
+        """
+        The smoke and the discretization of the smoke equation, used for checkpoints.
+        :return: dictionary with arrays
+        """
+        a_val, a_row, a_col, nnz = self.sparse_disc_matrix
+        return {'smoke': self.smoke, 'obstacles': self.obstacles, 'source': self.source,
+                'a_val': a_val, 'a_row': a_row, 'a_col': a_col, 'nnz': nnz}
+
+    def set_state(self, state):
+        """
+        Restores the smoke from a checkpoint. See get_state.
+        :param state: dictionary with arrays
+        :return: None
+        """
+        self.obstacles = np.array(state['obstacles'])
+        self.smoke = np.array(state['smoke'])
+        self.source = np.array(state['source'])
+        self.sparse_disc_matrix = (np.array(state['a_val']), np.array(state['a_row']), np.array(state['a_col']),
+                                   int(state['nnz']))
+        self.smoke_field.update(np.reshape(self.smoke, self.obstacles.shape)[1:-1, 1:-1])
+
     def _get_source(self, fire, nx, ny):
         """
         Compute the source function for the fire. Quite inefficient, but not a bottleneck at this stage.
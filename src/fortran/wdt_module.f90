@@ -184,7 +184,8 @@ cell_indicators = UNKNOWN
 
 heap_length = 0
 tree_length = 0
-heap_capacity = (n_x+n_y)*1000 ! Todo: This number is pretty arbitrary. I think it should be hc = a*(nx+ny) + b*(#exits)
+! Initial guess; the heap doubles in size when it is full (see ensure_heap_capacity)
+heap_capacity = max((n_x+n_y)*4, 1024)
 allocate(cand_heap(0:1,0:heap_capacity-1))
 allocate(indx(0:heap_capacity-1))
 call heap_init(indx,heap_capacity)
@@ -197,6 +198,7 @@ do j=0,n_y-1
             cell_indicators(i,j) = KNOWN
             new_cell(0) = i
             new_cell(1) = j
+            call ensure_heap_capacity()
             call heap_insert(cand_heap,indx,heap_capacity,heap_length,tree_length,new_cell,wdt_field,n_x,n_y)
 
         elseif (cost_field(i,j)>=obstacle_value) then
@@ -222,6 +224,7 @@ do while (.true.)
                 wdt_field(i,j) = dist
                 new_cell(0) = i
                 new_cell(1) = j
+                call ensure_heap_capacity()
                 call heap_insert(cand_heap,indx,heap_capacity,heap_length,tree_length,new_cell,wdt_field,n_x,n_y)
             end if
         end if
@@ -230,6 +233,27 @@ end do
 deallocate(cand_heap)
 deallocate(indx)
 
+contains
+    subroutine ensure_heap_capacity()
+        ! Doubles the capacity of the heap when it is full, instead of silently dropping candidates.
+        ! New slots are appended to the index permutation, so the heap order is preserved.
+        integer (kind=4), allocatable, dimension(:,:) :: new_heap
+        integer (kind=4), allocatable, dimension(:) :: new_indx
+        integer (kind=4) :: k
+        if (heap_length < heap_capacity) then
+            return
+        end if
+        allocate(new_heap(0:1,0:2*heap_capacity-1))
+        allocate(new_indx(0:2*heap_capacity-1))
+        new_heap(:,0:heap_capacity-1) = cand_heap
+        new_indx(0:heap_capacity-1) = indx
+        do k=heap_capacity,2*heap_capacity-1
+            new_indx(k) = k
+        end do
+        call move_alloc(new_heap, cand_heap)
+        call move_alloc(new_indx, indx)
+        heap_capacity = 2*heap_capacity
+    end subroutine
 end subroutine
 
 program test_wdt
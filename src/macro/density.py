@@ -0,0 +1,80 @@
+import numpy as np
+from scipy.signal import fftconvolve
+
+# Added to the density before dividing the momentum by it, like in micro_macro.f90
+EPS = 0.0001
+# Minimum number of cells the support of the kernel (2h) has to span for the grid estimator
+MIN_KERNEL_CELLS = 2
+
+
+def get_kernel_weights(distance, h):
+    """
+    Wendland kernel of micro_macro.f90 (support 2h).
+    :param distance: Array of distances
+    :param h: Smoothing length
+    :return: Array of weights
+    """
+    return 7 / (4 * np.pi * h * h) * np.maximum(1 - distance / (2 * h), 0) ** 4 * (1 + 2 * distance / h)
+
+
+def is_kernel_resolved(dx, dy, h):
+    """
+    Whether the grid is fine enough for comp_dens_velo_grid: the support of the kernel spans MIN_KERNEL_CELLS cells.
+    On coarser grids, the sampled kernel is a few spikes and depositing smooths more than the kernel itself.
+    :param dx: Cell width
+    :param dy: Cell height
+    :param h: Smoothing length
+    :return: bool
+    """
+    return 2 * h >= MIN_KERNEL_CELLS * max(dx, dy)
+
+
+def comp_dens_velo_grid(positions, velocities, active, n_x, n_y, dx, dy, h):
+    """
+    Computes the density and velocity fields of the crowd, like comp_dens_velo in micro_macro.f90,
+    but in O(N + G log G) instead of O(N r^2) for N pedestrians, G cells and a kernel of r x r cells.
+    The mass and momentum of the pedestrians are deposited on the cell centers (cloud in cell),
+    and then convolved with the kernel sampled on the grid (with an FFT).
+    Depositing smooths slightly more than evaluating the kernel at the exact positions.
+    The sampled kernel is normalized, so that the mass of the crowd is conserved (sum of density * dx * dy).
+    Raises a ValueError when the grid is too coarse for the smoothing length, see is_kernel_resolved.
+
+    :param positions: n x 2 array
+    :param velocities: n x 2 array
+    :param active: Array of length n, nonzero for pedestrians in the scene
+    :param n_x: Number of cells in x direction
+    :param n_y: Number of cells in y direction
+    :param dx: Cell width
+    :param dy: Cell height
+    :param h: Smoothing length
+    :return: density, velocity in x direction, velocity in y direction (n_x x n_y arrays)
+    """
+    if not is_kernel_resolved(dx, dy, h):
+        raise ValueError("Smoothing length %.2f is too small for the grid estimator on cells of %.2f x %.2f: "
+                         "2h should span at least %d cells" % (h, dx, dy, MIN_KERNEL_CELLS))
+    active = np.asarray(active).astype(bool)
+    positions, velocities = positions[active], velocities[active]
+    rel_x = positions[:, 0] / dx - 0.5
+    rel_y = positions[:, 1] / dy - 0.5
+    cell_x = np.clip(np.floor(rel_x).astype(int), 0, max(n_x - 2, 0))
+    cell_y = np.clip(np.floor(rel_y).astype(int), 0, max(n_y - 2, 0))
+    weight_x = np.clip(rel_x - cell_x, 0, 1)
+    weight_y = np.clip(rel_y - cell_y, 0, 1)
+    next_x = np.minimum(cell_x + 1, n_x - 1)
+    next_y = np.minimum(cell_y + 1, n_y - 1)
+    indices = np.concatenate((cell_x * n_y + cell_y, cell_x * n_y + next_y, next_x * n_y + cell_y,
+                              next_x * n_y + next_y))
+    weights = np.concatenate(((1 - weight_x) * (1 - weight_y), (1 - weight_x) * weight_y,
+                              weight_x * (1 - weight_y), weight_x * weight_y))
+    deposited = [np.bincount(indices, weights=weights * np.tile(values, 4), minlength=n_x * n_y).reshape(n_x, n_y)
+                 for values in (np.ones(len(positions)), velocities[:, 0], velocities[:, 1])]
+    # Same range as micro_macro.f90
+    range_ = int(2 * h / min(dx, dy) + 1)
+    offsets = np.arange(-range_, range_ + 1)
+    kernel = get_kernel_weights(np.hypot(offsets[:, None] * dx, offsets[None, :] * dy), h)
+    # The samples of the kernel do not sum to exactly 1 / (dx * dy)
+    kernel /= np.sum(kernel) * dx * dy
+    density, momentum_x, momentum_y = [fftconvolve(field, kernel, mode='same') for field in deposited]
+    # Round-off of the FFT can give tiny negative values in empty regions
+    density = np.maximum(density, 0)
+    return density, momentum_x / (density + EPS), momentum_y / (density + EPS)
@@ -0,0 +1,243 @@
+import numpy as np
+from scipy.sparse import csr_matrix, diags, kron
+from scipy.sparse.linalg import spsolve
+
+from math_objects import functions as ft
+
+
+class PressureSolver:
+    """
+    Solves the linear complementarity problem (LCP) for the pressure on a fixed grid, with the same discretization
+    as compute_pressure in pressure_modules.f90:
+    find p >= 0 with w = A p + q >= 0 and w . p = 0.
+    The sparsity pattern of the 5-point stencil (CSR) is built once; each solve only updates the values.
+    The system is solved with projected Gauss-Seidel, starting from the previous solution.
+    Cells are updated in red-black order: cells of one colour only depend on cells of the other colour,
+    so each half sweep is a vectorized (sparse) operation.
+    Flat indices are in Fortran order (x first), like in the Fortran module.
+
+    The convergence of projected Gauss-Seidel degrades on fine grids. With method 'multigrid', every iteration is a
+    projected multigrid cycle instead: Gauss-Seidel sweeps, followed by a coarse grid correction of the cells where
+    the pressure is not constrained to zero, and more sweeps. The correction is solved with a linear V-cycle of
+    Galerkin operators (bilinear interpolation), and directly on the coarsest grid.
+    Grids of at most coarsest_size cells have no coarser grids: there, 'multigrid' is projected Gauss-Seidel.
+    """
+    methods = ('pgs', 'multigrid')
+    # Grids with at most this many cells are solved directly in multigrid cycles
+    coarsest_size = 256
+
+    def __init__(self, nx, ny, tolerance=0.001, max_iterations=1000, boundary_pressure=1., method='pgs',
+                 smoothing_steps=2):
+        """
+        Create a solver for a grid.
+
+        :param nx: Number of cells in x direction
+        :param ny: Number of cells in y direction
+        :param tolerance: Allowed violation of the complementarity conditions
+        :param max_iterations: Maximum number of Gauss-Seidel sweeps (or multigrid cycles) per solve
+        :param boundary_pressure: Dirichlet boundary condition outside of the grid
+        :param method: 'pgs' or 'multigrid'
+        :param smoothing_steps: Number of sweeps before and after the coarse grid correction of multigrid cycles
+        :return: PressureSolver instance
+        """
+        if method not in self.methods:
+            raise NotImplementedError("Pressure solver %s not implemented" % method)
+        self.method = method
+        self.smoothing_steps = smoothing_steps
+        self.shape = (nx, ny)
+        self.tolerance = tolerance
+        self.max_iterations = max_iterations
+        self.boundary_pressure = boundary_pressure
+        # Previous solution, the initial guess of the next solve
+        self.pressure = np.zeros(nx * ny)
+        self.q = self.diagonal = None
+        # Statistics of the last solve
+        self.iterations = 0
+        self.residual = 0.
+        cells = np.arange(nx * ny).reshape(self.shape, order='F')
+        # Off-diagonal entries of each stencil direction: (dx, dy) offset, rows and columns
+        self.directions = []
+        rows, columns = [cells.ravel(order='F')], [cells.ravel(order='F')]
+        for offset in ((-1, 0), (1, 0), (0, -1), (0, 1)):
+            inside = self._get_inside(offset)
+            neighbours = np.roll(cells, (-offset[0], -offset[1]), axis=(0, 1))
+            self.directions.append((offset, inside))
+            rows.append(cells[inside])
+            columns.append(neighbours[inside])
+        rows, columns = np.concatenate(rows), np.concatenate(columns)
+        # Build the pattern with the entry numbers as values, to find where each entry is stored
+        pattern = csr_matrix((np.arange(1, len(rows) + 1, dtype=float), (rows, columns)), shape=(nx * ny, nx * ny))
+        self.matrix = pattern.copy()
+        self.matrix_order = pattern.data.astype(int) - 1
+        is_red = ((np.arange(nx)[:, None] + np.arange(ny)[None, :]) % 2 == 0).ravel(order='F')
+        self.colours = []
+        for colour_cells in (np.flatnonzero(is_red), np.flatnonzero(~is_red)):
+            colour_pattern = pattern[colour_cells]
+            self.colours.append((colour_cells, colour_pattern.copy(), colour_pattern.data.astype(int) - 1))
+        # Interpolation from each grid to the next finer grid, finest first
+        self.prolongations = []
+        if method == 'multigrid':
+            while nx * ny > self.coarsest_size and min(nx, ny) > 2:
+                self.prolongations.append(kron(self._get_prolongation(ny), self._get_prolongation(nx)).tocsr())
+                nx, ny = (nx + 1) // 2, (ny + 1) // 2
+            if not self.prolongations:
+                ft.log("Pressure grid of %d x %d cells is too small for multigrid cycles, "
+                       "using projected Gauss-Seidel" % self.shape)
+
+    @staticmethod
+    def _get_prolongation(n):
+        """
+        Linear interpolation in one dimension from a grid of ceil(n / 2) cells to a grid of n cells (cell centered).
+        :param n: Number of fine cells
+        :return: n x ceil(n / 2) sparse matrix
+        """
+        fine = np.arange(n)
+        coarse = fine // 2
+        # The other coarse cell next to the fine cell
+        neighbour = np.where(fine % 2 == 0, coarse - 1, coarse + 1)
+        has_neighbour = np.logical_and(neighbour >= 0, neighbour < (n + 1) // 2)
+        weights = np.concatenate((np.where(has_neighbour, 0.75, 1), 0.25 * np.ones(np.sum(has_neighbour))))
+        return csr_matrix((weights, (np.concatenate((fine, fine[has_neighbour])),
+                                     np.concatenate((coarse, neighbour[has_neighbour])))), shape=(n, (n + 1) // 2))
+
+    def _get_inside(self, offset):
+        """
+        Cells of which the neighbour in a direction lies inside the grid.
+        :param offset: (dx, dy) offset of the neighbour
+        :return: nx x ny boolean array
+        """
+        nx, ny = self.shape
+        inside = np.ones(self.shape, dtype=bool)
+        if offset[0] < 0:
+            inside[0, :] = False
+        elif offset[0] > 0:
+            inside[nx - 1, :] = False
+        if offset[1] < 0:
+            inside[:, 0] = False
+        elif offset[1] > 0:
+            inside[:, ny - 1] = False
+        return inside
+
+    def update(self, density, velo_x, velo_y, dx, dy, dt, max_density):
+        """
+        Fill the values of the matrix and the vector of the LCP, like create_sparse_stencil in the Fortran module.
+
+        :param density: nx x ny array
+        :param velo_x: nx x ny array
+        :param velo_y: nx x ny array
+        :param dx: Cell width
+        :param dy: Cell height
+        :param dt: Time step
+        :param max_density: Maximum density of the crowd
+        :return: None
+        """
+        rho = np.pad(density, 1, 'constant')
+        flux_x = rho * np.pad(velo_x, 1, 'constant')
+        flux_y = rho * np.pad(velo_y, 1, 'constant')
+        center = rho[1:-1, 1:-1]
+        rho_diff_x = (rho[:-2, 1:-1] - rho[2:, 1:-1]) / (4 * dx * dx)
+        rho_diff_y = (rho[1:-1, :-2] - rho[1:-1, 2:]) / (4 * dy * dy)
+        coefficients = {(-1, 0): -rho_diff_x + center / (dx * dx), (1, 0): rho_diff_x + center / (dx * dx),
+                        (0, -1): -rho_diff_y + center / (dy * dy), (0, 1): rho_diff_y + center / (dy * dy)}
+        b = -(flux_x[:-2, 1:-1] - flux_x[2:, 1:-1]) / (2 * dx) - (flux_y[1:-1, :-2] - flux_y[1:-1, 2:]) / (2 * dy)
+        values = [-(2 * center / (dx * dx) + 2 * center / (dy * dy))]
+        for offset, inside in self.directions:
+            coefficient = coefficients[offset]
+            values.append(coefficient[inside])
+            # Dirichlet boundary conditions
+            b[~inside] -= self.boundary_pressure * coefficient[~inside]
+        values[0] = values[0].ravel(order='F')
+        values = -np.concatenate(values) * dt
+        self.matrix.data[:] = values[self.matrix_order]
+        for _, matrix, order in self.colours:
+            matrix.data[:] = values[order]
+        self.diagonal = values[:density.size]
+        self.q = (max_density - density - b * dt).ravel(order='F')
+
+    def solve(self, density, velo_x, velo_y, dx, dy, dt, max_density):
+        """
+        Solve the pressure LCP for the macroscopic fields, starting from the previous solution.
+        See update for the parameters.
+
+        :return: nx x ny pressure array, number of sweeps,
+        residual (largest violation of the complementarity conditions)
+        """
+        self.update(density, velo_x, velo_y, dx, dy, dt, max_density)
+        pressure = self.pressure
+        self.iterations = 0
+        while True:
+            overshoot = self.matrix @ pressure + self.q
+            self.residual = max(-np.min(overshoot), abs(np.dot(overshoot, pressure)), 0)
+            if self.residual <= self.tolerance or self.iterations == self.max_iterations:
+                break
+            self.iterations += 1
+            if self.prolongations:
+                self._projected_cycle(pressure)
+            else:
+                self._sweep(pressure)
+        return pressure.reshape(self.shape, order='F').copy(), self.iterations, self.residual
+
+    def _sweep(self, pressure):
+        """
+        One projected Gauss-Seidel sweep in red-black order.
+        :param pressure: Flat pressure array, updated in place
+        :return: None
+        """
+        for cells, matrix, _ in self.colours:
+            diagonal = self.diagonal[cells]
+            remainder = -self.q[cells] - matrix @ pressure + diagonal * pressure[cells]
+            pressure[cells] = np.maximum(0, remainder / diagonal)
+
+    def _projected_cycle(self, pressure):
+        """
+        One projected multigrid cycle.
+        Cells where the pressure is zero and the density is below the maximum (the active constraints)
+        are left out of the coarse grid correction, so that it does not push them to negative pressures.
+        :param pressure: Flat pressure array, updated in place
+        :return: None
+        """
+        for _ in range(self.smoothing_steps):
+            self._sweep(pressure)
+        overshoot = self.matrix @ pressure + self.q
+        free = np.logical_or(pressure > 0, overshoot < 0)
+        prolongation = self.prolongations[0].multiply(free[:, None]).tocsr()
+        coarse_matrix = self._get_coarse_matrix(self.matrix, prolongation)
+        correction = self._linear_cycle(1, coarse_matrix, prolongation.T @ np.where(free, -overshoot, 0))
+        pressure += prolongation @ correction
+        np.maximum(pressure, 0, out=pressure)
+        for _ in range(self.smoothing_steps):
+            self._sweep(pressure)
+
+    def _linear_cycle(self, level, matrix, rhs):
+        """
+        Approximate solution of a linear system on a coarse grid with a V-cycle, with damped Jacobi smoothing.
+        :param level: Index of the grid, 0 is the finest
+        :param matrix: Galerkin operator on the grid
+        :param rhs: Right hand side
+        :return: Solution array
+        """
+        if level == len(self.prolongations):
+            return spsolve(matrix.tocsc(), rhs)
+        diagonal = matrix.diagonal()
+        solution = np.zeros_like(rhs)
+        for _ in range(self.smoothing_steps):
+            solution += 2 / 3 * (rhs - matrix @ solution) / diagonal
+        prolongation = self.prolongations[level]
+        coarse_matrix = self._get_coarse_matrix(matrix, prolongation)
+        solution += prolongation @ self._linear_cycle(level + 1, coarse_matrix,
+                                                      prolongation.T @ (rhs - matrix @ solution))
+        for _ in range(self.smoothing_steps):
+            solution += 2 / 3 * (rhs - matrix @ solution) / diagonal
+        return solution
+
+    @staticmethod
+    def _get_coarse_matrix(matrix, prolongation):
+        """
+        Galerkin operator on the coarser grid. Coarse cells without any free fine cell get an identity row,
+        so that the coarse system stays regular.
+        :param matrix: Sparse matrix on the fine grid
+        :param prolongation: Sparse interpolation matrix from the coarse to the fine grid
+        :return: Sparse matrix on the coarse grid
+        """
+        coarse_matrix = (prolongation.T @ matrix @ prolongation).tocsr()
+        return (coarse_matrix + diags((coarse_matrix.diagonal() == 0).astype(float))).tocsr()
@@ -1,8 +1,11 @@
+import time
+
 import matplotlib
 import numpy as np
 import params
 from lib.micro_macro import comp_dens_velo
-from lib.pressure_computer import compute_pressure
+from macro.density import comp_dens_velo_grid, is_kernel_resolved
+from macro.pressure_solver import PressureSolver
 
 from math_objects import functions as ft
 from math_objects.scalar_field import ScalarField as Field
@@ -33,19 +36,30 @@ class Repel:
         self.params = None
         self.on_step_functions = []
         self.basis_A = self.basis_v_x = self.basis_v_y = None
-        self._last_solution = None
+        # Pressure LCP solver that keeps the matrix pattern and the last solution
+        self.pressure_solver = None
         self.show_plot = False
         self.grid_dimension = self.dx = self.dy = None
 
         # Fields to store the macroscopic quantities in
         self.density_field = self.v_x = self.v_y = self.pressure_field = None
         self.obstacle_field = None
+        # Function that computes the density and velocity fields, see params.density_estimator
+        self.density_estimator = None
+        # Values of the macroscopic fields at the pedestrian positions
+        self.sample_buffer = None
+        # Multi-rate coupling: fields of the previous macro step (for extrapolation) and statistics
+        self.previous_fields = None
+        self.macro_steps = self.micro_steps = 0
+        self.macro_time = self.micro_time = 0.
+        self.field_changes = []
 
-    def prepare(self, params):
+    def prepare(self, params, state=None):
         """
         Called before the simulation starts. Fix all parameters and bootstrap functions.
 
         :params: Parameter object
+        :param state: Dictionary as returned by get_state to resume from
         :return: None
         """
         self.params = params
@@ -59,14 +73,66 @@ class Repel:
         self.v_y = Field(self.grid_dimension, Field.Orientation.center, 'velocity_y',
                          (self.dx, self.dy))  # Todo: We can probably easily stagger this
         self.pressure_field = Field((self.grid_dimension[0] + 2, self.grid_dimension[1] + 2), Field.Orientation.center, 'pressure', (self.dx, self.dy))
+        self.density_estimator = comp_dens_velo
+        if self.params.density_estimator == 'grid':
+            if is_kernel_resolved(self.dx, self.dy, self.params.smoothing_length):
+                self.density_estimator = comp_dens_velo_grid
+            else:
+                ft.warn("Smoothing length %.2f is too small for the grid density estimator on cells of %.2f x %.2f, "
+                        "using the kernel estimator" % (self.params.smoothing_length, self.dx, self.dy))
+        # Shared with the planners, for density dependent potentials
+        self.scene.density_field = self.density_field
         self.on_step_functions.append(self.apply_repulsion)
-        self.obstacle_field = self.scene.get_obstacles(*self.grid_dimension)
+        self.pressure_solver = PressureSolver(*self.grid_dimension, boundary_pressure=self.params.boundary_pressure,
+                                              method=self.params.pressure_solver)
+        if self.params.macro_interval > 1 and self.params.macro_extrapolation:
+            self.previous_fields = [Field(self.grid_dimension, Field.Orientation.center, 'previous_' + field.name,
+                                          (self.dx, self.dy)) for field in (self.v_x, self.v_y, self.density_field)]
+        if state is not None:
+            self.obstacle_field = np.array(state['obstacles'])
+            for field in (self.density_field, self.v_x, self.v_y, self.pressure_field):
+                field.update(np.array(state[field.name]))
+            self.pressure_solver.pressure = np.array(state['solver_pressure'])
+            if self.previous_fields is not None and self.previous_fields[0].name in state:
+                for field in self.previous_fields:
+                    field.update(np.array(state[field.name]))
+        else:
+            self.obstacle_field = self.scene.get_obstacles(*self.grid_dimension)
         if self.show_plot:
             # Plotting hooks
             f, self.graphs = plt.subplots(2, 2)
             plt.show(block=False)
             self.on_step_functions.append(self.plot_grid_values)
 
+    def get_state(self):
+        """
+        The macroscopic fields of the last time step and the obstacles, used for checkpoints.
+        :return: dictionary with arrays
+        """
+        state = {field.name: field.array for field in (self.density_field, self.v_x, self.v_y, self.pressure_field)}
+        state['obstacles'] = self.obstacle_field
+        state['solver_pressure'] = self.pressure_solver.pressure
+        if self.previous_fields is not None:
+            state.update({field.name: field.array for field in self.previous_fields})
+        return state
+
+    def finish(self):
+        """
+        Report the speed and accuracy of the multi-rate coupling: the time of the macro steps and of the
+        projection on the pedestrians, and how much the velocity field changed between macro steps
+        (the error of applying the cached field).
+        :return: None
+        """
+        if self.params.macro_interval > 1 and self.macro_steps:
+            macro_time = self.macro_time / self.macro_steps
+            micro_time = self.micro_time / max(self.micro_steps, 1)
+            ft.log("Repulsion: %d macro steps in %d steps, %.3f seconds per macro step, %.3f seconds per projection, "
+                   "estimated speed-up %.1f" % (self.macro_steps, self.micro_steps, macro_time, micro_time,
+                                                (macro_time + micro_time) / (macro_time / self.params.macro_interval
+                                                                             + micro_time + ft.EPS)))
+            if self.field_changes:
+                ft.log("Repulsion: relative change of the velocity field between macro steps: mean %.3f, max %.3f" % (
+                    np.mean(self.field_changes), np.max(self.field_changes)))
 
     def plot_grid_values(self):
         """
@@ -93,13 +159,15 @@ class Repel:
         """
         Compute the macroscopic (continuum) fields like density and velocity by interpolation of the
         microsopic pedestrian quantities.
+        With params.density_estimator 'grid', the pedestrians are deposited on the grid and convolved with the kernel
+        (if the grid resolves the kernel, see prepare).
         :return:
         """
         n_x, n_y = self.grid_dimension
         dx, dy = self.scene.size.array / self.grid_dimension
-        density_field, v_x, v_y = comp_dens_velo(self.scene.position_array, self.scene.velocity_array,
-                                                 self.scene.active_entries, n_x, n_y, dx, dy,
-                                                 self.params.smoothing_length)
+        density_field, v_x, v_y = self.density_estimator(self.scene.position_array, self.scene.velocity_array,
+                                                         self.scene.active_entries, n_x, n_y, dx, dy,
+                                                         self.params.smoothing_length)
         self.density_field.update(density_field)
         self.v_x.update(v_x)
         self.v_y.update(v_y)
@@ -113,9 +181,10 @@ class Repel:
         so that the gradient is defined for each cell in the scene.
         """
 
-        pressure = compute_pressure(self.density_field.array + 0.1, self.v_x.array, self.v_y.array,
-                                    self.dx, self.dy, self.params.dt, self.params.max_density)
-        dim_p = np.reshape(pressure, (self.grid_dimension[0], self.grid_dimension[1]), order='F')
+        dim_p, iterations, residual = self.pressure_solver.solve(self.density_field.array + 0.1, self.v_x.array,
+                                                                 self.v_y.array, self.dx, self.dy, self.params.dt,
+                                                                 self.params.max_density)
+        ft.debug("Pressure solved in %d iterations, residual %.2e" % (iterations, residual))
         dim_p[self.obstacle_field.astype(bool)] = self.params.boundary_pressure
         # dim_p[self.scene.gutter_cells.astype(bool)] = self.gutter_pressure
         padded_dim_p = np.pad(dim_p, (1, 1), 'constant', constant_values=self.params.boundary_pressure)
@@ -135,24 +204,32 @@ class Repel:
     def put_micro_changes(self):
         """
         Method that reconverts the velocity field to individual pedestrian positions.
-        Input are the velocity x/y fields. We use a bivariate spline interpolation method
-        to interpolate the velocities at the pedestrians position.
+        Input are the velocity x/y fields. We use bilinear interpolation
+        to interpolate the velocities and the density at the pedestrians position.
         These velocities are then weighed to the densities, normalized
         and added to the velocity field.
+        Only the pedestrians that are still in the scene are evaluated.
+        Between macro steps, the fields are extrapolated in time when params.macro_extrapolation is set.
         :return: None
         """
-        v_x_func = self.v_x.get_interpolation_function()
-        v_y_func = self.v_y.get_interpolation_function()
-        dens_func = self.density_field.get_interpolation_function()
-        solved_v_x = v_x_func.ev(self.scene.position_array[:, 0], self.scene.position_array[:, 1])
-        solved_v_y = v_y_func.ev(self.scene.position_array[:, 0], self.scene.position_array[:, 1])
-        local_dens = np.minimum(dens_func.ev(self.scene.position_array[:, 0], self.scene.position_array[:, 1]),
-                                self.params.max_density)
-        solved_velocity = np.hstack((solved_v_x[:, None], solved_v_y[:, None]))
-        self.scene.velocity_array = self.scene.velocity_array + local_dens[:, None] / self.params.max_density * (
-            solved_velocity - self.scene.velocity_array) + ft.EPS
-        self.scene.velocity_array /= \
-            np.linalg.norm(self.scene.velocity_array, axis=1)[:, None] / (self.scene.max_speed_array[:, None] + ft.EPS)
+        active = self.scene.active_entries
+        positions = self.scene.position_array[active]
+        velocities = self.scene.velocity_array[active]
+        fields = [self.v_x, self.v_y, self.density_field]
+        if self.previous_fields is not None:
+            fields += self.previous_fields
+        if self.sample_buffer is None or len(self.sample_buffer) < len(positions):
+            self.sample_buffer = np.empty((len(self.scene.position_array), len(fields)))
+        samples = Field.sample_fields(fields, positions, out=self.sample_buffer[:len(positions)])
+        fraction = self._get_extrapolation_fraction()
+        if fraction:
+            samples = samples[:, :3] + fraction * (samples[:, :3] - samples[:, 3:])
+        solved_velocity = samples[:, :2]
+        local_dens = np.clip(samples[:, 2], 0, self.params.max_density)
+        velocities = velocities + local_dens[:, None] / self.params.max_density * (
+            solved_velocity - velocities) + ft.EPS
+        velocities /= np.linalg.norm(velocities, axis=1)[:, None] / (self.scene.max_speed_array[active, None] + ft.EPS)
+        self.scene.velocity_array[active] = velocities
 
     def step(self):
         """
@@ -168,10 +245,54 @@ class Repel:
     def apply_repulsion(self):
         """
         The full iteration. Interpolate macrofields, solve the PDE,
-        adjust the velocity field, and impose this on the pedestrians
+        adjust the velocity field, and impose this on the pedestrians.
+        The macro fields are only computed every params.macro_interval steps;
+        in between, the last velocity field is imposed on the pedestrians.
         :return:
         """
+        if self.scene.counter % self.params.macro_interval == 0 or self.density_field.time_step == 0:
+            start = time.perf_counter()
+            self.update_macro_fields()
+            self.macro_time += time.perf_counter() - start
+            self.macro_steps += 1
+        start = time.perf_counter()
+        self.put_micro_changes()
+        self.micro_time += time.perf_counter() - start
+        self.micro_steps += 1
+
+    def update_macro_fields(self):
+        """
+        Compute the density, pressure and adjusted velocity fields.
+        With a macro interval, record how much the velocity field differs from the one that would have been applied
+        (the cached or extrapolated field), and keep the old fields for the extrapolation.
+        :return: None
+        """
+        fields = (self.v_x, self.v_y, self.density_field)
+        if self.params.macro_interval == 1 or self.density_field.time_step == 0:
+            old_arrays = None
+        else:
+            old_arrays = [field.array.copy() for field in fields]
         self.get_macro_fields()
         self.compute_pressure()
         self.adjust_velocity()
-        self.put_micro_changes()
+        if old_arrays is None:
+            return
+        predicted = old_arrays[:2]
+        if self.previous_fields is not None and self.previous_fields[0].time_step > 0:
+            predicted = [2 * old - previous.array for old, previous in zip(predicted, self.previous_fields)]
+        new_velocity = np.stack((self.v_x.array, self.v_y.array))
+        self.field_changes.append(np.linalg.norm(new_velocity - np.stack(predicted)) /
+                                  (np.linalg.norm(new_velocity) + ft.EPS))
+        if self.previous_fields is not None:
+            for field, old_array in zip(self.previous_fields, old_arrays):
+                field.update(old_array)
+
+    def _get_extrapolation_fraction(self):
+        """
+        Number of steps since the last macro step, relative to the macro interval.
+        Zero when the fields are not extrapolated.
+        :return: float
+        """
+        if self.previous_fields is None or self.previous_fields[0].time_step == 0:
+            return 0
+        return (self.scene.counter % self.params.macro_interval) / self.params.macro_interval
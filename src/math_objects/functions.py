@@ -1,6 +1,8 @@
 import math
 
 import numpy as np
+from scipy.ndimage import gaussian_filter
+from scipy.signal import fftconvolve
 
 # Numerical tolerance
 EPS = 1e-6
@@ -9,6 +11,8 @@ VERBOSE = False
 HORIZONTAL_DIRECTIONS = ['left', 'right']
 VERTICAL_DIRECTIONS = ['up', 'down']
 DIRECTIONS = {'left': [-1, 0], 'right': [1, 0], 'up': [0, 1], 'down': [0, -1]}
+# Gaussian kernels with a larger radius (in cells) are applied with FFT convolution
+FFT_BLUR_RADIUS = 16
 
 
 def error(msg):
@@ -103,3 +107,25 @@ def increase_array_size(array, increment_factor=2):
     new_array = np.zeros(new_shape,dtype=array.dtype)
     new_array[0:array.shape[0], :] = array
     return new_array
+
+
+def gaussian_blur(field, sigma, truncate=4.0):
+    """
+    Gaussian filter of a 2D array, with the same result as scipy.ndimage.gaussian_filter (reflecting boundaries,
+    kernel truncated at truncate * sigma).
+    The separable filter of scipy takes time proportional to sigma, so large kernels are applied with FFT convolution,
+    of which the cost does not depend on sigma.
+    :param field: 2D array
+    :param sigma: Standard deviation of the kernel in cells
+    :param truncate: Radius of the kernel in standard deviations
+    :return: Filtered array
+    """
+    radius = int(truncate * sigma + 0.5)
+    if radius <= FFT_BLUR_RADIUS or radius >= min(field.shape):
+        return gaussian_filter(field, sigma=sigma, truncate=truncate)
+    offsets = np.arange(-radius, radius + 1)
+    kernel = np.exp(-0.5 * (offsets / sigma) ** 2)
+    kernel /= np.sum(kernel)
+    # 'symmetric' padding of NumPy is 'reflect' in scipy.ndimage
+    padded = np.pad(field, radius, 'symmetric')
+    return fftconvolve(padded, np.outer(kernel, kernel), mode='valid')
@@ -0,0 +1,57 @@
+import zlib
+
+import numpy as np
+
+
+class RandomStreams:
+    """
+    Independent random number generators for the subsystems of a simulation, all derived from one seed.
+    Each stream is identified by a name (like 'placement' or 'inflow'), and is spawned from the seed with a
+    SeedSequence keyed on that name. Streams therefore do not depend on the order in which they are first used,
+    and adding a stream does not change the numbers drawn by the others.
+    """
+
+    def __init__(self, seed=None):
+        """
+        Create the streams.
+
+        :param seed: Integer seed. Leave empty for fresh entropy from the operating system.
+        :return: RandomStreams instance
+        """
+        self.seed_sequence = np.random.SeedSequence(seed)
+        self.entropy = self.seed_sequence.entropy
+        self.generators = {}
+
+    def __getitem__(self, name):
+        """
+        The generator of a subsystem. Created on first use.
+
+        :param name: Name of the subsystem
+        :return: numpy.random.Generator
+        """
+        if name not in self.generators:
+            sequence = np.random.SeedSequence(self.entropy, spawn_key=(zlib.crc32(name.encode()),))
+            self.generators[name] = np.random.Generator(np.random.PCG64(sequence))
+        return self.generators[name]
+
+    def get_state(self):
+        """
+        The state of all the generators that are in use, used for checkpoints.
+
+        :return: JSON serializable dictionary
+        """
+        return {'entropy': self.entropy,
+                'generators': {name: generator.bit_generator.state for name, generator in self.generators.items()}}
+
+    def set_state(self, state):
+        """
+        Restore the generators from a checkpoint. See get_state.
+
+        :param state: Dictionary as returned by get_state
+        :return: None
+        """
+        self.seed_sequence = np.random.SeedSequence(state['entropy'])
+        self.entropy = self.seed_sequence.entropy
+        self.generators = {}
+        for name, generator_state in state['generators'].items():
+            self[name].bit_generator.state = generator_state
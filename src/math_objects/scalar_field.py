@@ -150,3 +150,60 @@ class ScalarField:
 
     def get_interpolation_function(self):
         return Rbs(self.x_range, self.y_range, self.array)
+
+    def get_sample_weights(self, positions):
+        """
+        Bilinear interpolation weights of positions on the grid of this field (given by its orientation).
+        Positions outside of the grid points take the values of the nearest boundary points.
+        The weights can be reused for all fields on the same grid.
+        :param positions: n x 2 array
+        :return: n x 4 array with the flat indices of the surrounding grid points, n x 4 array with their weights
+        """
+        nx, ny = self.array.shape
+        rel_x = (positions[:, 0] - self.x_range[0]) / self.dx
+        rel_y = (positions[:, 1] - self.y_range[0]) / self.dy
+        cell_x = np.clip(np.floor(rel_x).astype(int), 0, max(nx - 2, 0))
+        cell_y = np.clip(np.floor(rel_y).astype(int), 0, max(ny - 2, 0))
+        weight_x = np.clip(rel_x - cell_x, 0, 1)
+        weight_y = np.clip(rel_y - cell_y, 0, 1)
+        next_x = np.minimum(cell_x + 1, nx - 1)
+        next_y = np.minimum(cell_y + 1, ny - 1)
+        indices = np.stack((cell_x * ny + cell_y, cell_x * ny + next_y, next_x * ny + cell_y, next_x * ny + next_y),
+                           axis=1)
+        weights = np.stack(((1 - weight_x) * (1 - weight_y), (1 - weight_x) * weight_y,
+                            weight_x * (1 - weight_y), weight_x * weight_y), axis=1)
+        return indices, weights
+
+    def sample(self, positions, out=None, weights=None):
+        """
+        Bilinear interpolation of the field at positions.
+        Much cheaper than get_interpolation_function, which fits a spline to the whole grid on every call.
+        :param positions: n x 2 array
+        :param out: Optional array of length n to write the values into
+        :param weights: Optional result of get_sample_weights for the positions
+        :return: Array of length n
+        """
+        indices, weights = weights if weights is not None else self.get_sample_weights(positions)
+        return np.einsum('ij,ij->i', self.array.ravel()[indices], weights, out=out)
+
+    @staticmethod
+    def sample_fields(fields, positions, out=None):
+        """
+        Bilinear interpolation of several fields on the same grid at positions, with the weights computed once.
+        :param fields: List of k ScalarFields with the same shape, orientation and cell size
+        :param positions: n x 2 array
+        :param out: Optional n x k array to write the values into
+        :return: n x k array
+        """
+        first = fields[0]
+        for field in fields[1:]:
+            if field.array.shape != first.array.shape or field.orientation != first.orientation \
+                    or (field.dx, field.dy) != (first.dx, first.dy):
+                raise ValueError("Fields %s and %s do not share a grid" % (repr(first), repr(field)))
+        indices, weights = first.get_sample_weights(positions)
+        if out is None:
+            out = np.empty((len(positions), len(fields)))
+        # Gather the values of each field at the positions, without copying the grids
+        for j, field in enumerate(fields):
+            np.einsum('ij,ij->i', field.array.ravel()[indices], weights, out=out[:, j])
+        return out
@@ -1,6 +1,8 @@
 import sys
 
 sys.path.append('src')
+import json
+import time
 from params import Parameters
 import numpy as np
 import scipy.io as sio
@@ -10,8 +12,7 @@ from objects.scene import Scene
 from micro.separate import Separate
 from macro.separate import Repel
 from processing.log_results import PositionLogger
-from visualization.simple import VisualScene
-from visualization.none import NoVisualScene
+from processing.stage_profiler import StageProfiler
 from populations.following import Following
 from populations.knowing import Knowing
 from extensions.fire import Fire
@@ -23,6 +24,7 @@ class Simulation:
     The simulation class controls all the components of the simulation.
     It converts the input flags to configuration options and augments them to the configuration file.
     It initializes the important objects and makes sure that all the event methods (step, on_exit, on_finish) are run.
+    The simulation owns the time loop; a visualization is an optional observer that is drawn after each step.
     """
 
     def __init__(self, scene_file=None, params=None):
@@ -43,10 +45,16 @@ class Simulation:
         if scene_file:
             self.scene_file = scene_file
         self.inflow = False
+        self.inflow_number = 1
         self.store_positions = False
         self.logger = None
+        self.profile_stages = False
+        self.profiler = None
         self.collect_data = None
         self.visual_backend = True
+        self.vis = None
+        self.is_prepared = False
+        self.is_done = False
         functions.EPS = self.params.tolerance # TODO: Remove
         self.scene = Scene()
 
@@ -56,8 +64,10 @@ class Simulation:
         # The order in which the following effects are added is important.
         for population in self.populations:
             self.on_step_functions.append(population.step)
+            self.finish_functions.append(population.finish)
         if 'repulsion' in self.effects:
             self.on_step_functions.append(self.effects['repulsion'].step)
+            self.finish_functions.append(self.effects['repulsion'].finish)
         if 'fire' in self.effects:
             self.on_step_functions.append(self.effects['fire'].step)
         self.on_step_functions.append(self.scene.move)
@@ -65,25 +75,26 @@ class Simulation:
             self.on_step_functions.append(self.effects['separation'].step)
         self.on_step_functions.append(self.scene.correct_for_geometry)
         self.on_step_functions.append(self.scene.find_finished)
+        if self.params.compaction_interval > 0:
+            self.on_step_functions.append(self.scene.compact_sometimes)
         if self.store_positions:
             self.on_step_functions.append(self.logger.step)
-        if self.visual_backend:
-            self.vis = VisualScene(self.scene)
-            self.on_step_functions.append(self.vis.loop)
-        else:
-            self.vis = NoVisualScene(self.scene)
         if self.inflow:
             self.on_step_functions.append(self._add_new_pedestrian_sometimes)
-        self.vis.step_callback = self.step
-        self.vis.finish_callback = self.finish
-        self.scene.on_pedestrian_exit_functions.append(self._check_percentage)
         if self.params.max_time > 0:
-            self.scene.on_pedestrian_exit_functions.append(self._check_max_time)
+            self.on_step_functions.append(self._check_max_time)
+        if self.visual_backend:
+            # Only import the visualization (tkinter, PIL) when it is used
+            from visualization.simple import VisualScene
+            self.vis = VisualScene(self.scene)
+            self.vis.step_callback = self._visual_step
+        self.scene.on_pedestrian_exit_functions.append(self._check_percentage)
 
-    def start(self):
+    def prepare(self, state=None):
         """
-        Start the simulation. When the simulation is finished, self.vis.start() returns,
-        and cleanup is handled through self.finish()
+        Build the step pipeline and prepare all the components of the simulation.
+        Called automatically by start() and run().
+        :param state: Dictionary with the arrays of a checkpoint to resume from. See from_checkpoint.
         :return: None
         """
         if self.params.scene_file:
@@ -94,26 +105,199 @@ class Simulation:
         if self.store_positions:
             self.logger = PositionLogger(self)
         self._prepare()
-        self.scene.prepare(self.params)
+        self.scene.prepare(self.params, self._get_component_state(state, 'scene'))
         for effect in self.effects:
-            self.effects[effect].prepare(self.params)
-        for population in self.populations:
-            population.prepare(self.params)
+            self._prepare_component(self.effects[effect], self._get_component_state(state, effect))
+        for i, population in enumerate(self.populations):
+            population.prepare(self.params, self._get_component_state(state, 'population%d' % i))
         if self.store_positions:
             self.logger.prepare(self.params)
-        self.vis.prepare(self.params)
-        self.vis.start()
+        if self.profile_stages:
+            self.profiler = StageProfiler(self)
+            self.profiler.prepare(self.params)
+            self.finish_functions.append(self.profiler.finish)
+        if self.vis:
+            self.vis.prepare(self.params)
+        self.is_prepared = True
+
+    def _prepare_component(self, component, state):
+        """
+        Prepare a component, resuming from the checkpoint state if the component keeps state.
+        :param component: Effect or population
+        :param state: Dictionary with the arrays of the component, or None
+        :return: None
+        """
+        if state is not None and hasattr(component, 'get_state'):
+            component.prepare(self.params, state)
+        else:
+            component.prepare(self.params)
+
+    @staticmethod
+    def _get_component_state(state, name):
+        """
+        Select the arrays of one component from the checkpoint state.
+        :param state: Dictionary with all the arrays of a checkpoint, or None
+        :param name: Name of the component
+        :return: Dictionary with the arrays of the component, or None
+        """
+        if state is None:
+            return None
+        prefix = name + '/'
+        return {key[len(prefix):]: value for key, value in state.items() if key.startswith(prefix)}
+
+    def save_checkpoint(self, path):
+        """
+        Store the full state of the simulation in a single NPZ file, so that it can be resumed with from_checkpoint.
+        Besides the pedestrians, this includes the expensive fields computed in prepare (potentials, smoke matrix),
+        and the state of the random number generators (see Scene.random).
+        Initial distributions of the populations are not stored; after resuming, new pedestrians are placed uniformly.
+
+        :param path: File name of the checkpoint
+        :return: None
+        """
+        if not self.is_prepared:
+            raise RuntimeError("Only prepared simulations can be stored")
+        state = {}
+        components = [('scene', self.scene)] + list(self.effects.items()) + [
+            ('population%d' % i, population) for i, population in enumerate(self.populations)]
+        for name, component in components:
+            if hasattr(component, 'get_state'):
+                for key, value in component.get_state().items():
+                    state['%s/%s' % (name, key)] = value
+        params = {}
+        for key, value in vars(self.params).items():
+            try:
+                params[key] = json.loads(json.dumps(value))
+            except TypeError:
+                # Objects that are added to the parameters during prepare
+                continue
+        effects = []
+        for name, effect in self.effects.items():
+            if name == 'fire':
+                effects.append([name, {'center': np.array(effect.center, dtype=float).tolist(),
+                                       'radius': effect.radius}])
+            elif name == 'cameras':
+                effects.append([name, {'positions': effect.positions.tolist(), 'angles': effect.angles.tolist()}])
+            else:
+                effects.append([name, {}])
+        meta = {'scene_file': self.scene_file, 'params': params, 'effects': effects,
+                'populations': [[type(population).__name__.lower(), population.number,
+                                 getattr(population, 'goals', [None])] for population in self.populations],
+                'inflow': self.inflow, 'inflow_number': self.inflow_number, 'is_done': self.is_done,
+                'store_positions': self.store_positions, 'visual_backend': self.visual_backend,
+                'profile_stages': self.profile_stages,
+                'rng': self.scene.random.get_state()}
+        state['meta'] = np.array(json.dumps(meta))
+        np.savez(path, **state)
+        functions.log("Stored checkpoint of iteration %d in %s" % (self.scene.counter, path))
+
+    @classmethod
+    def from_checkpoint(cls, path):
+        """
+        Create a prepared simulation from a checkpoint stored with save_checkpoint.
+        The fields are loaded instead of computed, so resuming is fast. Continue with run() or start().
+
+        :param path: File name of the checkpoint
+        :return: Simulation
+        """
+        with np.load(path) as data:
+            state = dict(data)
+        meta = json.loads(str(state.pop('meta')))
+        params = Parameters()
+        vars(params).update(meta['params'])
+        simulation = cls(meta['scene_file'], params)
+        for behaviour, number, goals in meta['populations']:
+            simulation.add_pedestrians(number, behaviour, goals=None if goals == [None] else goals)
+        for name, options in meta['effects']:
+            if name == 'fire':
+                simulation.add_fire(options['center'], options['radius'])
+            elif name == 'cameras':
+                simulation.add_cameras(options['positions'], options['angles'])
+            elif name == 'separation':
+                simulation.add_local(name)
+            else:
+                simulation.add_global(name)
+        simulation.allow_new_pedestrians(meta['inflow'], meta['inflow_number'])
+        simulation.set_store_positions(meta['store_positions'])
+        simulation.set_visualisation(meta['visual_backend'])
+        simulation.set_stage_profiling(meta['profile_stages'])
+        simulation.prepare(state)
+        simulation.is_done = meta['is_done']
+        simulation.scene.random.set_state(meta['rng'])
+        functions.log("Resumed iteration %d from %s" % (simulation.scene.counter, path))
+        return simulation
+
+    def start(self):
+        """
+        Start the simulation. With a visual backend, the window drives the time steps and closes when the simulation
+        is done. Without, the simulation runs in self.run() until the termination criteria are met.
+        Cleanup is handled through self.finish()
+        :return: None
+        """
+        if not self.is_prepared:
+            self.prepare()
+        if self.vis:
+            self.vis.start()
+        else:
+            self.run()
         self.finish()
 
+    def run(self, max_steps=0, max_wall_time=0):
+        """
+        Run the time loop without visualization until the termination criteria are met or a budget is spent.
+        Can be called repeatedly to continue the simulation. Does not call self.finish().
+
+        :param max_steps: maximum number of steps taken in this call. 0 means no limit.
+        :param max_wall_time: maximum number of (wall clock) seconds spent in this call. 0 means no limit.
+        :return: True if the termination criteria are met, False if the simulation stopped because of the budget
+        """
+        if not self.is_prepared:
+            self.prepare()
+        steps = 0
+        deadline = time.time() + max_wall_time
+        try:
+            while not self.is_done:
+                self.step()
+                steps += 1
+                if steps == max_steps or (max_wall_time > 0 and time.time() > deadline):
+                    break
+        except KeyboardInterrupt:
+            functions.log("\nUser interrupted simulation")
+            self.stop()
+        return self.is_done
+
     def step(self):
         """
-        Increase time and
+        Apply the pending changes of the environment (see Scene.change_costs), increase time and
         run all the event listener methods that run on each time step
         :return:
         """
+        self.scene.apply_cost_changes()
         self.scene.time += self.params.dt
         self.scene.counter += 1
-        [step() for step in self.on_step_functions]
+        if self.profiler:
+            self.profiler.step()
+        else:
+            for step in self.on_step_functions:
+                step()
+
+    def stop(self):
+        """
+        Mark the simulation as done. The time loop returns after the current step.
+        :return: None
+        """
+        self.is_done = True
+
+    def _visual_step(self):
+        """
+        Step callback of the visualization: perform a step and redraw, or close the window if we are done.
+        :return: None
+        """
+        self.step()
+        if self.is_done:
+            self.vis.finish()
+        else:
+            self.vis.loop()
 
     def add_local(self, effect):
         effect_name = effect.lower()
@@ -129,16 +313,28 @@ class Simulation:
             repulsion = Repel(self.scene)
             self.effects[effect_name] = repulsion
 
-    def add_pedestrians(self, num, behaviour='knowing'):
+    def add_pedestrians(self, num, behaviour='knowing', distribution=None, goals=None):
+        """
+        Add a population to the simulation.
+
+        :param num: Initial number of pedestrians
+        :param behaviour: 'knowing' or 'following'
+        :param distribution: InitialDistribution of the pedestrians (see objects.initial_distributions).
+        Uniform over the accessible space if left empty.
+        :param goals: Exits of knowing pedestrians: list of exit numbers or tuples of exit numbers
+        (see Scene.exit_labels). Pedestrians walk to the nearest exit if left empty.
+        :return: None
+        """
         if type(num) != int or num < 1:
             raise ValueError("Provide a positive integer as a population number, not %s" % num)
         if behaviour.lower() == 'following':
-            Population = Following
+            if goals:
+                raise ValueError("Following pedestrians have no goals")
+            population = Following(self.scene, num, distribution)
         elif behaviour.lower() == 'knowing':
-            Population = Knowing
+            population = Knowing(self.scene, num, distribution, goals)
         else:
             raise NotImplementedError("Behaviour %s not implemented" % behaviour)
-        population = Population(self.scene, num)
         self.populations.append(population)
 
     def add_fire(self, center, radius):
@@ -159,15 +355,19 @@ class Simulation:
         effect = Cameras(np.array(positions), np.array(angles))
         self.effects['cameras'] = effect
 
-    def allow_new_pedestrians(self, probability):
+    def allow_new_pedestrians(self, probability, number=1):
         """
         -- Beta functionality --
         Add a probability of entering new pedestrians on each time step.
+        On each time step, each of the number candidates enters with the given probability.
+        The number of pedestrians in the scene never exceeds the initial number of pedestrians.
 
         :param probability: number between 0 and 1
+        :param number: maximum number of new pedestrians per time step
         :return: None
         """
         self.inflow = probability
+        self.inflow_number = number
 
     def set_visualisation(self, on):
         self.visual_backend = bool(on)
@@ -175,6 +375,16 @@ class Simulation:
     def set_store_positions(self, on):
         self.store_positions = bool(on)
 
+    def set_stage_profiling(self, on):
+        """
+        Record the wall time of each stage of the step pipeline.
+        A summary is reported on finish and the timings are stored in the result directory.
+
+        :param on: True to enable profiling
+        :return: None
+        """
+        self.profile_stages = bool(on)
+
     def set_data_collector(self, on):
         """
         Not implemented yet
@@ -213,13 +423,13 @@ class Simulation:
         functions.log("Finishing simulation. %d iterations of %.2f seconds" % (self.scene.counter, self.scene.time))
         [finish() for finish in self.finish_functions]
 
-    def on_pedestrian_exit(self, pedestrian):
+    def on_pedestrian_exit(self, indices):
         """
-        Run all methods required when a pedestrian exits.
-        :param pedestrian: Pedestrian that exited the scene.
+        Run all methods required when pedestrians exit.
+        :param indices: Indices of the pedestrians that exited the scene.
         :return:
         """
-        [ped_exit(pedestrian) for ped_exit in self.on_pedestrian_exit_functions]
+        [ped_exit(indices) for ped_exit in self.on_pedestrian_exit_functions]
 
     def store_config(self, file_name):
         """
@@ -234,16 +444,17 @@ class Simulation:
 
     def _check_max_time(self):
         if self.scene.time > self.params.max_time:
-            self.vis.finish()
+            self.stop()
 
     def _check_percentage(self, _=None):
         """
-        Check whether the required percentage of evacs has been reached
-        :param _: Placeholder parameter; ignore
+        Check whether the required percentage of evacs has been reached.
+        Uses the exit counter of the scene, so the cost does not depend on the number of pedestrians.
+        :param _: Indices of the exited pedestrians; ignore
         :return:
         """
-        if 1 - np.sum(self.scene.active_entries) / len(self.scene.active_entries) >= self.params.max_percentage:
-            self.vis.finish()
+        if self.scene.exited_pedestrians / self.scene.spawned_pedestrians >= self.params.max_percentage:
+            self.stop()
 
     def _add_new_pedestrian_sometimes(self):
         """
@@ -252,5 +463,8 @@ class Simulation:
         Not suitable for research purposes yet.
         :return:
         """
-        if np.random.random() < self.inflow and len(self.scene.pedestrian_list) < self.scene.total_pedestrians:
-            self.populations[0].create_new_pedestrian()
+        active_pedestrians = self.scene.spawned_pedestrians - self.scene.exited_pedestrians
+        number = min(self.scene.random['inflow'].binomial(self.inflow_number, self.inflow),
+                     self.scene.total_pedestrians - active_pedestrians)
+        if number > 0:
+            self.populations[0].spawn(number)
@@ -1,105 +1,155 @@
 import numpy as np
-
-from math_objects.geometry import Point
-from objects.scene import Scene, Pedestrian
+from scipy.misc import imread
 
 """
-A list of Scene extensions where the pedestrians have a special initial distribution
+Initial distributions of pedestrians. A distribution samples positions on the cells of the scene
+that are accessible at the start of the simulation (0 < direction field < inf, so no obstacles and exits).
 """
 
 
-class ImpulseScene(Scene):
-    def __init__(self, impulse_location, impulse_size, *args, **kwargs):
+class InitialDistribution:
+    """
+    Distributes pedestrians over the accessible cells of the scene, proportional to a density.
+    The flat indices of the accessible cells and their cumulative densities are computed once,
+    so that all positions are drawn in one vectorized call. Within a cell, positions are uniformly distributed.
+    The cells are recomputed when the direction field of the scene is replaced (e.g. when a fire is added).
+    Override get_density for other distributions.
+    """
+
+    def __init__(self, density=None, region=None):
         """
-        Initializes scene with an initial dense circular pedestrian distribution.
-        :param impulse_location: Center of the pedestrians impulse
-        :param impulse_size: (Ellipse-like) radius of the impulse
-        :return: scene instance.
+        Create a new distribution. Without arguments, pedestrians are uniformly distributed over the scene.
+
+        :param density: Image file or 2D array with the density of the pedestrians.
+        Image files are read like scene files: grey values are relative densities, white is densest and black is empty.
+        Arrays are indexed like the environment field (x, y). Both are resampled to the size of the environment field.
+        :param region: ((x_min, y_min), (x_max, y_max)) relative coordinates of the box that contains the pedestrians
+        :return: InitialDistribution instance
         """
-        self.impulse_location = impulse_location
-        self.impulse_size = impulse_size
-        super().__init__(*args, **kwargs)
-
-    def _init_pedestrians(self, initial_pedestrian_number):
-        center = self.size.array * self.impulse_location
-        self.pedestrian_list = []
-        for counter in range(initial_pedestrian_number):
-            ped_loc = None
-            while not ped_loc:
-                x, y = (np.random.rand(2) * 2 - 1) * self.impulse_size
-                ped_loc = Point(center + np.array([x, y]))
-                if x ** 2 + y ** 2 > self.impulse_size ** 2 or not self.is_accessible(ped_loc):
-                    ped_loc = None
-            self.pedestrian_list.append(Pedestrian(self, counter, self.exit_list, position=ped_loc))
-
-
-class TwoImpulseScene(Scene):
-    def __init__(self, impulse_size, impulse_locations, *args, **kwargs):
+        self.density = density
+        self.region = region
+        self.field = None
+        self.cells = None
+        self.cumulative_density = None
+
+    def prepare(self, scene):
         """
-        Initializes an scene with two initial circles of pedestrians
-        :param impulse_locations: Center of the pedestrians impulses
-        :param impulse_size: (Ellipse-like) radius of the impulses
-        :return: scene instance.
+        Compute the accessible cells and their cumulative density for the current direction field of the scene.
+        Called automatically when sampling.
+        :param scene: Scene to sample positions in
+        :return: None
         """
-        self.impulse_size = impulse_size
-        self.impulse_locations = impulse_locations
-        super().__init__(*args, **kwargs)
-
-    def _init_pedestrians(self, initial_pedestrian_number):
-
-        self.pedestrian_list = []
-        for counter in range(initial_pedestrian_number):
-            if counter < initial_pedestrian_number // 2:
-                center = np.array(self.impulse_locations[0]) * self.size.array
-            else:
-                center = np.array(self.impulse_locations[1]) * self.size.array
-            ped_loc = None
-            while not ped_loc:
-                x, y = (np.random.rand(2) * 2 - 1) * self.impulse_size
-                ped_loc = Point(center + np.array([x, y]))
-                if x ** 2 + y ** 2 > self.impulse_size or not self.is_accessible(ped_loc):
-                    ped_loc = None
-            self.pedestrian_list.append(Pedestrian(self, counter, self.exit_list, position=ped_loc))
-
-
-class LoopScene(Scene):
-    def __init__(self, *args, **kwargs):
+        self.field = scene.direction_field
+        nx, ny = scene.env_field.shape
+        centers = np.stack(np.meshgrid((np.arange(nx) + 0.5) * scene.dx, (np.arange(ny) + 0.5) * scene.dy,
+                                       indexing='ij'), axis=-1)
+        density = self.get_density(scene, centers)
+        if self.region is not None:
+            lower, upper = np.array(self.region) * scene.size.array
+            density = density * np.all((lower <= centers) & (centers <= upper), axis=-1)
+        valid = (0 < self.field) & (self.field < np.inf) & (density > 0)
+        self.cells = np.flatnonzero(valid)
+        self.cumulative_density = np.cumsum(density.ravel()[self.cells])
+        if not len(self.cells):
+            raise ValueError("No accessible cells for the initial distribution of pedestrians")
+
+    def get_density(self, scene, centers):
+        """
+        Relative density of pedestrians on each cell of the scene. Does not need to be normalized.
+        :param scene: Scene to sample positions in
+        :param centers: nx x ny x 2 array with the centers of the cells
+        :return: nx x ny array
+        """
+        if self.density is None:
+            return np.ones(centers.shape[:2])
+        if isinstance(self.density, str):
+            density = np.rot90(imread(self.density, mode='L') / 255., -1)
+        else:
+            density = np.asarray(self.density, dtype=float)
+        # Nearest neighbour resampling to the environment field
+        nx, ny = centers.shape[:2]
+        return density[np.arange(nx) * density.shape[0] // nx][:, np.arange(ny) * density.shape[1] // ny]
+
+    def sample(self, scene, number):
+        """
+        Draw positions for new pedestrians.
+        :param scene: Scene to sample positions in
+        :param number: Number of positions
+        :return: number x 2 array with positions
         """
-        Initializes a scene where pedestrians that leave the scene at one side,
-        return on the other side
-        :return: scene instance.
+        if self.field is not scene.direction_field:
+            self.prepare(scene)
+        generator = scene.random['placement']
+        total = self.cumulative_density[-1]
+        drawn = np.searchsorted(self.cumulative_density, generator.random(number) * total, side='right')
+        cells = self.cells[np.minimum(drawn, len(self.cells) - 1)]
+        cell_x, cell_y = np.unravel_index(cells, scene.env_field.shape)
+        jitter = generator.random((number, 2))
+        return np.stack(((cell_x + jitter[:, 0]) * scene.dx, (cell_y + jitter[:, 1]) * scene.dy), axis=1)
+
+
+class Impulse(InitialDistribution):
+    """
+    Dense circular distribution of pedestrians.
+    """
+
+    def __init__(self, impulse_location, impulse_size, **kwargs):
         """
+        Initializes an initial dense circular pedestrian distribution.
+        :param impulse_location: Relative coordinates of the center of the pedestrians impulse
+        :param impulse_size: Radius of the impulse
+        :return: Impulse instance
+        """
+        super().__init__(**kwargs)
+        self.impulse_location = impulse_location
+        self.impulse_size = impulse_size
+
+    def get_density(self, scene, centers):
+        center = scene.size.array * self.impulse_location
+        in_impulse = np.sum((centers - center) ** 2, axis=-1) <= self.impulse_size ** 2
+        return super().get_density(scene, centers) * in_impulse
+
 
-        super().__init__(*args, **kwargs)
+class TwoImpulse(InitialDistribution):
+    """
+    Two circles of pedestrians, both containing half of the pedestrians.
+    """
 
-    def remove_pedestrian(self, pedestrian):
+    def __init__(self, impulse_size, impulse_locations, **kwargs):
         """
-        Removing a pedestrian now puts him in a new position in the scene
-        :param pedestrian: Unremoved pedestrian
-        :return:
+        Initializes two initial circles of pedestrians
+        :param impulse_size: Radius of the impulses
+        :param impulse_locations: Relative coordinates of the centers of the pedestrians impulses
+        :return: TwoImpulse instance
         """
-        new_point = Point([pedestrian.position.x, self.size.height - 1])
-        pedestrian.position = new_point
+        super().__init__(**kwargs)
+        self.impulses = [Impulse(location, impulse_size, **kwargs) for location in impulse_locations]
 
+    def prepare(self, scene):
+        self.field = scene.direction_field
+        for impulse in self.impulses:
+            impulse.prepare(scene)
 
-class TopScene(Scene):
-    def __init__(self, barrier, *args, **kwargs):
+    def sample(self, scene, number):
+        first = self.impulses[0].sample(scene, number // 2)
+        return np.concatenate((first, self.impulses[1].sample(scene, number - number // 2)))
+
+
+class Top(InitialDistribution):
+    """
+    Initially, pedestrians are only present above a certain barrier
+    """
+
+    def __init__(self, barrier, **kwargs):
         """
-        Initializes a scene where initially pedestrians are only present above a certain barrier
         :param barrier: Relative y coordinate (between 0 and 1) that indicates the lowest pedestrian position
-        :return: scene instance.
+        :return: Top instance
         """
         if not 0 <= barrier < 1:
             raise ValueError("Barrier must be between 0 and 1")
+        super().__init__(**kwargs)
         self.barrier = barrier
-        super().__init__(*args, **kwargs)
-
-    def _init_pedestrians(self, initial_pedestrian_number):
-        self.pedestrian_list = []
-        for counter in range(initial_pedestrian_number):
-            ped_loc = None
-            while not ped_loc:
-                ped_loc = Point(self.size.array * [np.random.rand(), 1 - np.random.rand() * (1 - self.barrier)])
-                if not self.is_accessible(ped_loc, True):
-                    ped_loc = None
-            self.pedestrian_list.append(Pedestrian(self, counter, self.exit_list, position=ped_loc))
+
+    def get_density(self, scene, centers):
+        above = centers[:, :, 1] >= self.barrier * scene.size[1]
+        return super().get_density(scene, centers) * above
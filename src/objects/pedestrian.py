@@ -1,40 +1,26 @@
 import numpy as np
 
-from math_objects import functions as ft
 from math_objects.geometry import Point, Velocity
 
 
 class Pedestrian(object):
     """
-    Class for modeling a pedestrian. Apart from physical properties like position and velocity,
-    this class also contains agent properties like planned path, (NYI:) goal, social forces,
-    and maximum speed.
+    Lightweight view on a single pedestrian in the scene.
+    All the properties (position, velocity, maximum speed, counter, color, ...) are stored
+    in the arrays of the scene; this class only provides convenient access to one row of them.
+    Views are created on demand and are not required to run a simulation.
     """
+    __slots__ = ('scene', 'index')
 
-    def __init__(self, scene, counter, position=Point([0, 0]), index=-1,color = None):
+    def __init__(self, scene, index):
         """
-        Initializes the pedestrian
+        Initializes the pedestrian view
         :param scene: Scene instance for the pedestrian to walk in
-        :param counter: Number of pedestrians spawned before.
-        :param position: Current position of the pedestrian. Position [0,0] will create a randomized position
-        :param index: index in the arrays (index <= counter)
+        :param index: index in the arrays of the scene
         :return: Pedestrian instance
         """
         self.scene = scene
-        self.counter = counter
-        if index < 0:
-            self.index = counter
-        else:
-            self.index = index
-        self.position = position
-        self.color = color
-        if not self.color:
-            self.color = self._get_random_color()
-        while self.position.is_zero() and type(self) == Pedestrian:
-            new_position = scene.size.random_internal_point()
-            if scene.is_accessible(new_position, at_start=True):
-                self.position = new_position
-        self.origin = self.position
+        self.index = index
 
     def __str__(self):
         """
@@ -51,21 +37,15 @@ class Pedestrian(object):
         """
         return "Pedestrian#%d (%d)" % (self.counter, self.index)
 
-    def _get_random_color(self):
-        """
-        Computes a random color
-        :return:
-        """
-        red,green,blue = np.random.randint(0,255,3)
-        return "#%02x%02x%02x" % (red, green, blue)
     def _convert_speed_to_color(self):
         """
         Computes a color between red and blue based on pedestrian max velocity.
         Red is fast, blue is slow.
         :return: tkinter RGB color code string
         """
-        start = np.min(self.scene.max_speed_array)
-        end = np.max(self.scene.max_speed_array)
+        speeds = self.scene.max_speed_array[self.scene.active_entries]
+        start = np.min(speeds)
+        end = np.max(speeds)
         if start == end:
             return 'blue'
         max_val = 255
@@ -75,6 +55,30 @@ class Pedestrian(object):
         blue = int(max_val * (speed - end) / (start - end))
         return "#%02x%02x%02x" % (red, green, blue)
 
+    @property
+    def counter(self):
+        """
+        Unique number of the pedestrian: the number of pedestrians spawned before.
+        :return: integer
+        """
+        return self.scene.counter_array[self.index]
+
+    @property
+    def color(self):
+        """
+        Color of the pedestrian in the visualization
+        :return: tkinter color string
+        """
+        return self.scene.color_list[self.scene.color_array[self.index]]
+
+    @property
+    def origin(self):
+        """
+        Position where the pedestrian was spawned
+        :return: Point
+        """
+        return Point(self.scene.origin_array[self.index])
+
     @property
     def velocity(self):
         """
@@ -91,10 +95,9 @@ class Pedestrian(object):
         :param value: 2D velocity with the correct direction
         :return: None
         """
-        self._velocity = value
         if value:
-            self._velocity.rescale(self.scene.max_speed_array[self.index])
-            self.scene.velocity_array[self.index] = self._velocity.array
+            value.rescale(self.scene.max_speed_array[self.index])
+            self.scene.velocity_array[self.index] = value.array
 
     @property
     def position(self):
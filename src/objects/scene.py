@@ -1,13 +1,29 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
 import numpy as np
-from lib.wdt import map_image_to_costs, get_weighted_distance_transform
+from lib.wdt import map_image_to_costs, get_weighted_distance_transform, get_multiresolution_wdt, \
+    update_weighted_distance_transform, get_exit_labels, DEFAULT_WDT_METHOD, MULTIRESOLUTION_VERSION
+from math_objects import functions as ft
 from math_objects.geometry import Point, Size
+from math_objects.random_streams import RandomStreams
+from objects.initial_distributions import InitialDistribution
+from objects.pedestrian import Pedestrian
+from processing.field_cache import FieldCache
 from scipy.ndimage import zoom
 
 
 class Scene:
     """
     Models a scene. A scene is a rectangular object with obstacles and pedestrians inside.
+    Pedestrians are stored column-wise: every pedestrian property is an array with one entry for each pedestrian index.
     """
+    # Per pedestrian arrays and the value of entries that are not in use
+    pedestrian_arrays = {"position_array": 0, "last_position_array": 0, "velocity_array": 0,
+                         "acceleration_array": 0, "max_speed_array": 0, "active_entries": False,
+                         "counter_array": -1, "population_array": 0, "color_array": 0,
+                         "origin_array": 0, "spawn_time_array": 0, "exit_time_array": np.nan}
 
     def __init__(self):
         """
@@ -17,69 +33,341 @@ class Scene:
         self.time = 0
         self.counter = 0
         self.total_pedestrians = 0
+        self.spawned_pedestrians = 0
+        self.exited_pedestrians = 0
+        self.num_populations = 0
         self.size = None
         self.params = None
+        # Random number generators of all subsystems, seeded with params.seed
+        self.random = None
 
         self.on_step_functions = []
         self.on_pedestrian_exit_functions = []
         self.on_pedestrian_init_functions = []
+        # Called with the new-to-old index mapping when the pedestrian arrays are reordered or resized
+        self.on_remap_functions = []
+        # Called with the previous environment field and the changed cells when the costs of the environment change
+        self.on_cost_change_functions = []
+        # Cost changes (cells, costs) that are applied before the next step
+        self.cost_changes = []
 
         self.fire = None
+        # Density of the crowd on the pressure grid (ScalarField), when the repulsion effect computes it
+        self.density_field = None
         # self.gutter_cells = self.get_obstacle_gutter_cells()
         # Array initialization
         self.position_array = self.last_position_array = self.velocity_array = None
         self.acceleration_array = self.max_speed_array = self.active_entries = None
-        self.pedestrian_list = []
-        self.index_map = {}
+        # Unique pedestrian number, population the pedestrian belongs to and index in self.color_list
+        self.counter_array = self.population_array = self.color_array = None
+        self.origin_array = self.spawn_time_array = self.exit_time_array = None
+        self.color_list = []
+        # Counters and exit times of all pedestrians that left, in order of leaving
+        self.exit_log = []
+        # Stack of entries that are not in use. The first self.num_free entries are valid; the top is allocated first
+        self.free_entries = None
+        self.num_free = 0
+        # Initial distribution of each population, indexed by population id
+        self.initial_distributions = []
+        self.default_distribution = InitialDistribution()
         self.env_field = self.direction_field = None
+        # Number of the exit (connected group of exit cells, starting from 1) of each cell of the environment field
+        self.exit_labels = None
+        self.num_exits = 0
         self.dx = self.dy = None
+        # Cache of fields on disk and hash of the scene image, used as part of the cache keys
+        self.field_cache = None
+        self.image_digest = None
 
-    def prepare(self, params):
+    def prepare(self, params, state=None):
         """
         Method called directly before simulation start. All parameters need to be registered.
         :param params: Parameter object
+        :param state: Dictionary as returned by get_state to resume from, instead of computing the fields
+        and initializing the pedestrian arrays.
         :return: None
         """
         self.params = params
         self.size = Size([self.params.scene_size_x, self.params.scene_size_y])
-        self.env_field = np.rot90(map_image_to_costs(self.params.scene_file), -1)
-        self.direction_field = get_weighted_distance_transform(self.env_field)
+        self.random = RandomStreams(self.params.seed)
+        self.field_cache = FieldCache(self.params.cache_dir)
+        self.image_digest = FieldCache.get_file_digest(self.params.scene_file)
+        if state is not None:
+            self.set_state(state)
+            return
+        fields = self.field_cache.get_fields(self.field_cache.get_key('scene', self.image_digest,
+                                                                      self.get_distance_transform_settings()),
+                                             ('env_field', 'direction_field'), self._compute_fields)
+        self.env_field = fields['env_field']
+        self.direction_field = fields['direction_field']
+        self.exit_labels, self.num_exits = get_exit_labels(self.env_field)
         self.dx = self.size[0] / self.env_field.shape[0]
         self.dy = self.size[1] / self.env_field.shape[1]
         self.position_array = np.zeros([self.total_pedestrians, 2])
         self.last_position_array = np.zeros([self.total_pedestrians, 2])
         self.velocity_array = np.zeros([self.total_pedestrians, 2])
         self.acceleration_array = np.zeros([self.total_pedestrians, 2])
-        self.max_speed_array = np.empty(self.total_pedestrians)
-        self.active_entries = np.ones(self.total_pedestrians, dtype=bool)
+        self.max_speed_array = np.zeros(self.total_pedestrians)
+        self.active_entries = np.zeros(self.total_pedestrians, dtype=bool)
+        self.counter_array = -np.ones(self.total_pedestrians, dtype=int)
+        self.population_array = np.zeros(self.total_pedestrians, dtype=int)
+        self.color_array = np.zeros(self.total_pedestrians, dtype=int)
+        self.origin_array = np.zeros([self.total_pedestrians, 2])
+        self.spawn_time_array = np.zeros(self.total_pedestrians)
+        self.exit_time_array = np.ones(self.total_pedestrians) * np.nan
+
+        self.free_entries = np.arange(self.total_pedestrians)[::-1].copy()
+        self.num_free = self.total_pedestrians
+
+    def _compute_fields(self):
+        """
+        Compute the cost field of the scene image and its weighted distance transform.
+        :return: dictionary with the env_field and direction_field arrays
+        """
+        env_field = np.rot90(map_image_to_costs(self.params.scene_file), -1)
+        return {'env_field': env_field, 'direction_field': self.get_distance_transform(env_field)}
+
+    def get_distance_transform(self, cost_field):
+        """
+        Weighted distance transform of a cost field of the scene.
+        The implementation is selected with params.wdt_method.
+        For large scenes, params.wdt_coarsening > 1 selects the multi-resolution approximation
+        (see lib.wdt.get_multiresolution_wdt).
+        :param cost_field: Cost field with the shape of the environment field
+        :return: array with the weighted distance transform
+        """
+        return self.get_distance_transforms([cost_field])[0]
+
+    def get_distance_transforms(self, cost_fields):
+        """
+        Weighted distance transforms of several cost fields of the scene, like the potentials towards different exits.
+        The distance transforms are computed in parallel, in params.wdt_workers worker processes.
+        See get_distance_transform.
+        :param cost_fields: List of cost fields with the shape of the environment field
+        :return: list with the weighted distance transform of each cost field
+        """
+        start = time.time()
+        compute = partial(compute_distance_transform, method=self.params.wdt_method,
+                          coarsening=self.params.wdt_coarsening, band_width=self.params.wdt_band_width)
+        if len(cost_fields) > 1 and self.params.wdt_workers != 1:
+            with ProcessPoolExecutor(max_workers=self.params.wdt_workers) as executor:
+                wdt_fields = list(executor.map(compute, cost_fields))
+        else:
+            wdt_fields = [compute(cost_field) for cost_field in cost_fields]
+        ft.debug("%d distance transform(s) of %d x %d cells in %.2f seconds" % (
+            (len(cost_fields),) + cost_fields[0].shape + (time.time() - start,)))
+        return wdt_fields
+
+    def submit_distance_transform(self, cost_field):
+        """
+        Start computing a weighted distance transform in a background worker process, see get_distance_transform.
+        :param cost_field: Cost field with the shape of the environment field
+        :return: concurrent.futures.Future with the weighted distance transform
+        """
+        executor = ProcessPoolExecutor(max_workers=1)
+        future = executor.submit(compute_distance_transform, cost_field, self.params.wdt_method,
+                                 self.params.wdt_coarsening, self.params.wdt_band_width)
+        # The worker process stops when the distance transform is finished
+        executor.shutdown(wait=False)
+        return future
+
+    def update_distance_transform(self, wdt_field, cost_field, changed_cells):
+        """
+        Repair a weighted distance transform after the costs of some cells changed.
+        See lib.wdt.update_weighted_distance_transform.
+        :param wdt_field: Weighted distance transform before the change
+        :param cost_field: Cost field after the change
+        :param changed_cells: Boolean array with the cells of which the cost changed
+        :return: array with the repaired weighted distance transform
+        """
+        start = time.time()
+        wdt_field = update_weighted_distance_transform(wdt_field, cost_field, changed_cells)
+        ft.debug("Repaired distance transform for %d changed cells in %.2f seconds" % (np.sum(changed_cells),
+                                                                                      time.time() - start))
+        return wdt_field
+
+    def change_costs(self, cells, costs):
+        """
+        Change the environment during the simulation, like blocking an exit (costs np.inf) or opening a door.
+        The change is applied before the next time step, so that all components switch to the new fields at once.
+        :param cells: Index of the cells of the environment field (boolean array or tuple of index arrays)
+        :param costs: New costs of the cells: np.inf for obstacles, 0 for exits
+        :return: None
+        """
+        self.cost_changes.append((cells, costs))
 
+    def apply_cost_changes(self):
+        """
+        Apply the changes of change_costs to the environment field.
+        The direction field is repaired locally and the listeners in on_cost_change_functions repair their fields.
+        :return: None
+        """
+        if not self.cost_changes:
+            return
+        old_env_field = self.env_field
+        # Copy, because the field may be memory-mapped from the field cache
+        self.env_field = np.array(self.env_field)
+        for cells, costs in self.cost_changes:
+            self.env_field[cells] = costs
+        self.cost_changes = []
+        changed_cells = self.env_field != old_env_field
+        if not np.any(changed_cells):
+            return
+        self.direction_field = self.update_distance_transform(self.direction_field, self.env_field, changed_cells)
+        [cost_change(old_env_field, changed_cells) for cost_change in self.on_cost_change_functions]
+
+    def get_distance_transform_settings(self):
+        """
+        Parameters the distance transforms depend on, to be used in the keys of the field cache.
+        :return: tuple
+        """
+        method = self.params.wdt_method or DEFAULT_WDT_METHOD
+        if self.params.wdt_coarsening > 1:
+            return method, int(self.params.wdt_coarsening), int(self.params.wdt_band_width), MULTIRESOLUTION_VERSION
+        return method, 1
+
+    def get_state(self):
+        """
+        All the data that changes during the simulation or is expensive to compute, used for checkpoints.
+        :return: dictionary with arrays
+        """
+        state = {attr: getattr(self, attr) for attr in self.pedestrian_arrays}
+        exit_counters = [counters for counters, _ in self.exit_log]
+        exit_times = [times for _, times in self.exit_log]
+        state.update({'env_field': self.env_field, 'direction_field': self.direction_field,
+                      'exit_labels': self.exit_labels,
+                      'time': self.time, 'counter': self.counter, 'spawned_pedestrians': self.spawned_pedestrians,
+                      'exited_pedestrians': self.exited_pedestrians, 'color_list': np.array(self.color_list, dtype=str),
+                      'exit_counters': np.concatenate(exit_counters or [np.zeros(0, dtype=int)]),
+                      'exit_times': np.concatenate(exit_times or [np.zeros(0)])})
+        return state
+
+    def set_state(self, state):
+        """
+        Restores the data from a checkpoint. See get_state.
+        :param state: dictionary with arrays
+        :return: None
+        """
+        for attr in self.pedestrian_arrays:
+            setattr(self, attr, np.array(state[attr]))
+        self.env_field = np.array(state['env_field'])
+        self.direction_field = np.array(state['direction_field'])
+        # Exits keep their number when they are closed during the simulation
+        self.exit_labels = np.array(state['exit_labels'])
+        self.num_exits = int(np.max(self.exit_labels))
+        self.dx = self.size[0] / self.env_field.shape[0]
+        self.dy = self.size[1] / self.env_field.shape[1]
+        self.time = float(state['time'])
+        self.counter = int(state['counter'])
+        self.spawned_pedestrians = int(state['spawned_pedestrians'])
+        self.exited_pedestrians = int(state['exited_pedestrians'])
+        self.color_list = [str(color) for color in state['color_list']]
+        self.exit_log = [(np.array(state['exit_counters']), np.array(state['exit_times']))]
+        self._reset_free_entries()
+
+    def _draw_max_speeds(self, number):
+        """
+        Samples maximum speeds for new pedestrians from the distribution in the parameters.
+        :param number: Number of speeds
+        :return: array with the maximum speeds
+        """
+        generator = self.random['speeds']
         if self.params.max_speed_distribution.lower() == 'uniform':
             # in a uniform distribution [a,b], sd = (b-a)/sqrt(12).
             interval_size = self.params.max_speed_sd * np.sqrt(12)
             interval_start = interval_size / 2 + self.params.max_speed_av
-            self.max_speed_array = interval_start + np.random.rand(self.total_pedestrians) * interval_size
+            return interval_start + generator.random(number) * interval_size
         elif self.params.max_speed_distribution.lower() == 'normal':
-            self.max_speed_array = self.params.max_speed_sd * np.abs(
-                np.random.randn(self.total_pedestrians)) + self.params.max_speed_av
+            return self.params.max_speed_sd * np.abs(generator.standard_normal(number)) + self.params.max_speed_av
         else:
             raise NotImplementedError('Distribution %s not yet implemented' % self.params.max_speed_distribution)
 
-    def _expand_arrays(self):
+    def allocate(self, number):
+        """
+        Reserves entries in the pedestrian arrays for new pedestrians.
+        Entries are taken from the free list, so no search through the arrays is needed.
+        If there are not enough free entries, all pedestrian arrays grow geometrically.
+        The entries are not in use until the pedestrians are added with add_pedestrians.
+        :param number: Number of entries
+        :return: array with the indices of the entries
+        """
+        if number > self.num_free:
+            capacity = len(self.active_entries)
+            self._grow(max(2 * capacity, capacity + number - self.num_free))
+        indices = self.free_entries[self.num_free - number:self.num_free][::-1].copy()
+        self.num_free -= number
+        return indices
+
+    def _grow(self, capacity):
+        """
+        Increases the size (first dimension) of all pedestrian arrays to the given capacity.
+        New entries are set to their empty value and added to the free list.
+        :param capacity: New number of entries
+        :return: None
+        """
+        size = len(self.active_entries)
+        self.remap(np.concatenate((np.arange(size), -np.ones(capacity - size, dtype=int))))
+
+    def _reset_free_entries(self):
+        """
+        Rebuilds the free list from the entries that are not in use.
+        Lower indices end up on top of the stack, so pedestrians are packed in the front of the arrays.
+        :return: None
+        """
+        free = np.where(~self.active_entries)[0][::-1]
+        # The free list can hold every entry, so pushing never reallocates
+        self.free_entries = np.zeros(len(self.active_entries), dtype=int)
+        self.free_entries[:len(free)] = free
+        self.num_free = len(free)
+
+    def compact(self):
+        """
+        Packs the active pedestrians into the first entries of the pedestrian arrays and drops the inactive entries.
+        After compaction, all vectorized operations only involve pedestrians that are still in the scene.
+        Pedestrians keep their unique counter (counter_array), so they can still be identified.
+        :return: None
+        """
+        live = np.where(self.active_entries)[0]
+        if len(live) < len(self.active_entries):
+            self.remap(live)
+
+    def compact_sometimes(self):
         """
-        Doubles the size (first dimension) of a numpy array with the given factor.
-        This method is only required in case the number of pedestrians is growing.
-        Missing entries are set to zero
+        Step function for the compaction mode: compacts every params.compaction_interval steps.
+        :return: None
+        """
+        if self.counter % self.params.compaction_interval == 0:
+            self.compact()
+
+    def remap(self, mapping):
+        """
+        Reorders and resizes all pedestrian arrays.
+        Entry i of the new arrays is entry mapping[i] of the old arrays, or an empty entry if mapping[i] is -1.
+        Other objects that keep per pedestrian arrays are notified through self.on_remap_functions.
+        :param mapping: integer array with the old index for each new index
         :return: None
         """
         # I don't like [gs]etattr, but this is pretty explicit
-        attr_list = ["position_array", "last_position_array", "velocity_array",
-                     "max_speed_array", "active_entries", "aware_pedestrians",
-                     "acceleration_array"]
-        for attr in attr_list:
-            array = getattr(self, attr)
-            addition = np.zeros(array.shape, dtype=array.dtype)
-            setattr(self, attr, np.concatenate((array, addition), axis=0))
-        self.index_map.update({len(self.index_map) + i: None for i in range(len(self.index_map))})
+        for attr, empty_value in self.pedestrian_arrays.items():
+            setattr(self, attr, Scene.remap_array(getattr(self, attr), mapping, empty_value))
+        self._reset_free_entries()
+        for func in self.on_remap_functions:
+            func(mapping)
+
+    @staticmethod
+    def remap_array(array, mapping, empty_value=0):
+        """
+        Reorder and resize the first dimension of an array. See Scene.remap.
+        :param array: numpy array indexed by pedestrian index
+        :param mapping: integer array with the old index for each new index, -1 for new entries
+        :param empty_value: value of the new entries
+        :return: new array with len(mapping) entries
+        """
+        new_array = np.empty((len(mapping),) + array.shape[1:], dtype=array.dtype)
+        new_array[:] = empty_value
+        existing = mapping >= 0
+        new_array[existing] = array[mapping[existing]]
+        return new_array
 
     def move(self):
         """
@@ -154,44 +442,125 @@ class Scene:
         If there is a cap on the number of pedestrians allowed to exit,
         we randomly sample that number of pedestrians and leave the rest in the exit.
         If any pedestrians are unable to exit, we set the exit to inaccessible.
-        The pedestrians that leave are processed and removed from the scene
+        The pedestrians that leave are processed and removed from the scene in one batch
         :return: None
         """
         cells = (self.position_array // (self.dx, self.dy)).astype(int) % self.env_field.shape
         in_goal = self.env_field[cells[:, 0], cells[:, 1]] == 0
         finished = np.logical_and(in_goal, self.active_entries)
         index_list = np.where(finished)[0]  # possible extension: Goal cap
-        for index in index_list:
-            finished_pedestrian = self.index_map[index]
-            self.remove_pedestrian(finished_pedestrian)
+        if len(index_list):
+            self.remove_pedestrians(index_list)
 
-    def remove_pedestrian(self, pedestrian):
+    def remove_pedestrians(self, indices):
         """
-        Removes a pedestrian from the scene and performs cleanup.
-        :param pedestrian: The pedestrian instance to be removed.
+        Removes a batch of pedestrians from the scene and performs cleanup.
+        The exit listeners are called once with all the indices.
+        :param indices: Array with the indices of the pedestrians to be removed.
 
         :return: None
         """
-        index = pedestrian.index
-        self.index_map[index] = None
-        self.pedestrian_list.remove(pedestrian)
-        self.active_entries[index] = False
+        self.active_entries[indices] = False
+        self.exit_time_array[indices] = self.time
+        self.free_entries[self.num_free:self.num_free + len(indices)] = indices[::-1]
+        self.num_free += len(indices)
+        self.exited_pedestrians += len(indices)
+        self.exit_log.append((self.counter_array[indices], self.exit_time_array[indices]))
         for func in self.on_pedestrian_exit_functions:
-            func(pedestrian)
+            func(indices)
+
+    def remove_pedestrian(self, index):
+        """
+        Removes a single pedestrian from the scene. See remove_pedestrians.
+        :param index: The index of the pedestrian to be removed.
+
+        :return: None
+        """
+        self.remove_pedestrians(np.array([index]))
 
-    def add_pedestrian(self, pedestrian):
+    def add_pedestrians(self, indices, population_id, color=None):
         """
-        Adds a new pedestrian to the scene
-        :param pedestrian: The pedestrian to be added
+        Adds new pedestrians to the scene on random accessible positions, drawn from the initial distribution
+        of the population.
+        :param indices: Array indices of the new pedestrians, as obtained from self.allocate.
+        :param population_id: Number of the population the pedestrians belong to
+        :param color: Color of the pedestrians. Random colors are chosen if left empty.
 
         :return: None
         """
-        index = pedestrian.index
-        self.index_map[index] = pedestrian
-        self.pedestrian_list.append(pedestrian)
-        self.active_entries[index] = True
+        indices = np.asarray(indices, dtype=int)
+        number = len(indices)
+        self.counter_array[indices] = self.spawned_pedestrians + np.arange(number)
+        self.spawned_pedestrians += number
+        self.population_array[indices] = population_id
+        self.color_array[indices] = self._get_color_indices(color, number)
+        self.max_speed_array[indices] = self._draw_max_speeds(number)
+        self.position_array[indices] = self.get_initial_distribution(population_id).sample(self, number)
+        self.origin_array[indices] = self.position_array[indices]
+        self.spawn_time_array[indices] = self.time
+        self.exit_time_array[indices] = np.nan
+        self.active_entries[indices] = True
         for func in self.on_pedestrian_init_functions:
-            func(pedestrian)
+            func(indices)
+
+    def get_initial_distribution(self, population_id):
+        """
+        The distribution used to place new pedestrians of a population.
+        :param population_id: Number of the population
+        :return: InitialDistribution instance
+        """
+        if population_id < len(self.initial_distributions) and self.initial_distributions[population_id]:
+            return self.initial_distributions[population_id]
+        return self.default_distribution
+
+    def correct_initial_positions(self):
+        """
+        Moves the pedestrians that are on cells that are not accessible at the start (anymore) to new positions.
+        Used when the direction field changes after the pedestrians were placed, e.g. by a fire.
+        :return: None
+        """
+        cells = (self.position_array // (self.dx, self.dy)).astype(int) % self.env_field.shape
+        field = self.direction_field[cells[:, 0], cells[:, 1]]
+        misplaced = self.active_entries & ~((0 < field) & (field < np.inf))
+        for population_id in np.unique(self.population_array[misplaced]):
+            indices = np.where(misplaced & (self.population_array == population_id))[0]
+            distribution = self.get_initial_distribution(population_id)
+            self.position_array[indices] = distribution.sample(self, len(indices))
+            self.origin_array[indices] = self.position_array[indices]
+
+    def _get_color_indices(self, color, number):
+        """
+        Find (or register) the color in the color list.
+        :param color: tkinter color string, or None for a random color for each pedestrian
+        :param number: Number of pedestrians that get this color
+        :return: array with indices in self.color_list
+        """
+        if color is None:
+            first = len(self.color_list)
+            rgb = self.random['colors'].integers(0, 255, (number, 3))
+            self.color_list += ["#%02x%02x%02x" % tuple(rgb_row) for rgb_row in rgb]
+            return np.arange(first, first + number)
+        if color not in self.color_list:
+            self.color_list.append(color)
+        return np.ones(number, dtype=int) * self.color_list.index(color)
+
+    def get_exit_times(self):
+        """
+        Exit times of all pedestrians that have been in the scene, also those whose entries have been compacted or reused.
+        :return: array indexed by pedestrian counter, NaN for pedestrians still in the scene
+        """
+        exit_times = np.ones(self.spawned_pedestrians) * np.nan
+        for counters, times in self.exit_log:
+            exit_times[counters] = times
+        return exit_times
+
+    def get_pedestrian(self, index):
+        """
+        Get a pedestrian view object for the pedestrian with this index.
+        :param index: index in the arrays
+        :return: Pedestrian instance
+        """
+        return Pedestrian(self, index)
 
     def get_obstacles(self, nx, ny):
         """
@@ -205,3 +574,18 @@ class Scene:
         obstacle_field = (self.env_field == np.inf).astype(int)
         resized_obstacle_field = zoom(obstacle_field, (nx / obstacle_field.shape[0], ny / obstacle_field.shape[1]))
         return resized_obstacle_field
+
+
+def compute_distance_transform(cost_field, method=None, coarsening=1, band_width=8):
+    """
+    Weighted distance transform with the settings of Scene.get_distance_transform.
+    Module level function so that it can be sent to a worker process.
+    :param cost_field: Cost field
+    :param method: params.wdt_method
+    :param coarsening: params.wdt_coarsening
+    :param band_width: params.wdt_band_width
+    :return: array with the weighted distance transform
+    """
+    if coarsening > 1:
+        return get_multiresolution_wdt(cost_field, coarsening, band_width, method=method)
+    return get_weighted_distance_transform(cost_field, method)
@@ -19,18 +19,54 @@ class Parameters:
         self.minimal_distance = 1
         self.max_time = 0
         self.max_percentage = 1
+        self.compaction_interval = 0  # Pack active pedestrians every this many steps. 0 disables compaction
+        self.cache_dir = None  # Directory to cache expensive fields (distance transforms) in. None disables caching
+        self.seed = None  # Seed of all random number generators. None for a different simulation on each run
 
         # Environment
         self.obstacle_clearance = 4
+        # Distance transform implementation: 'fortran', 'sweeping' (NumPy) or 'marching' (slow Python).
+        # None uses the Fortran module if it is compiled, and sweeping otherwise
+        self.wdt_method = None
+        # Distance transforms of large scenes: solve on a field coarser by this factor (1 solves on the full field),
+        # solve a band of this many cells around obstacles and exits again on the full field, and refine the rest
+        self.wdt_coarsening = 1
+        self.wdt_band_width = 8
+        # Worker processes for the distance transforms of the exits of knowing populations with goals.
+        # None uses all cores, 1 computes them in the simulation process
+        self.wdt_workers = None
+        # Walking directions of knowing pedestrians: 'spline' (most accurate), 'bilinear' or 'nearest' (fast lookups)
+        self.navigation = 'spline'
+        # Dynamic potential of knowing pedestrians: the costs increase with the density of the crowd (Hughes model).
+        # Needs the 'repulsion' effect. Solved on the pressure grid every this many steps (0 disables),
+        # or earlier when the density changes by more than the threshold (a fraction of max_density)
+        self.dynamic_potential_interval = 0
+        self.dynamic_potential_threshold = 0.2
+        # Weight of the density in the costs: 0 gives the static potential, 1 the Hughes cost 1 / (1 - density / max)
+        self.dynamic_potential_weight = 1
 
         # pressure
         self.pressure_dx = 2
         self.pressure_dy = 2
         self.smoothing_length = 1
+        # Density and velocity fields: 'kernel' evaluates the kernel for each pedestrian and cell in range,
+        # 'grid' deposits the pedestrians on the grid and convolves (faster for very large crowds).
+        # 'grid' needs a kernel support (2 * smoothing_length) of at least 2 pressure cells (pressure_dx, pressure_dy),
+        # otherwise the kernel estimator is used: with the defaults, set smoothing_length to 2 or more
+        self.density_estimator = 'kernel'
         self.packing_factor = 0.8
         self.min_density = 2
         self.max_density = 8
         self.boundary_pressure = 1
+        # Pressure LCP solver: 'pgs' (projected Gauss-Seidel) or 'multigrid' (projected multigrid cycles).
+        # Projected Gauss-Seidel does not converge within its iterations on fine grids (like 200 x 200 cells),
+        # not even from the previous solution. Grids of at most 256 cells (PressureSolver.coarsest_size) are too small
+        # for multigrid cycles and are solved with projected Gauss-Seidel
+        self.pressure_solver = 'multigrid'
+        # Multi-rate coupling: the density and pressure are computed every this many steps,
+        # the last velocity field is imposed on the pedestrians in between (optionally extrapolated in time)
+        self.macro_interval = 1
+        self.macro_extrapolation = False
         # Todo: Get verified parameter value/relation to scene. Factors: discr size, num_ped, min_dist
 
         # visual
@@ -42,6 +78,9 @@ class Parameters:
         # Can probably be improved.
         # Fire
         self.fire_intensity = 0.0001
+        # Compute the navigation field around the fire in a background process while the simulation starts.
+        # Pedestrians who see the fire before it is ready keep their route, so disable for reproducible runs
+        self.background_fire_field = True
         # smoke
         self.smoke = False
         self.smoke_dx = 2
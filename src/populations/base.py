@@ -1,5 +1,4 @@
 import numpy as np
-from objects.pedestrian import Pedestrian
 
 
 class Population:
@@ -9,47 +8,99 @@ class Population:
     Can be overridden with populations following different rules
     """
 
-    def __init__(self, scene, number):
+    def __init__(self, scene, number, distribution=None):
+        """
+        Register a new population in the scene.
+
+        :param scene: Simulation scene
+        :param number: Initial number of people
+        :param distribution: InitialDistribution for placing new pedestrians. Uniform over the scene if left empty.
+        :return: Population instance
+        """
         self.scene = scene
         self.params = None
         self.number = number
         self.indices = None
         self.color = None
+        self.id = self.scene.num_populations
+        self.scene.num_populations += 1
+        self.scene.initial_distributions.append(distribution)
         self.scene.total_pedestrians += self.number
 
-    def prepare(self, params):
+    def prepare(self, params, state=None):
         """
         Called before the simulation starts. Fix all parameters and bootstrap functions.
 
         :params: Parameter object
+        :param state: Dictionary as returned by get_state to resume from, instead of initializing the pedestrians
         :return: None
         """
         self.params = params
-        self.indices = np.zeros(self.scene.total_pedestrians, dtype=bool)
-        self._init_pedestrians()
+        self.scene.on_pedestrian_init_functions.append(self._update_membership)
+        self.scene.on_remap_functions.append(self._remap)
+        if state is not None:
+            self.indices = np.array(state['indices'])
+        else:
+            self.indices = np.zeros(len(self.scene.active_entries), dtype=bool)
+            self._init_pedestrians()
+
+    def finish(self):
+        """
+        Called when the simulation finishes. Populations can override this to report statistics.
+        :return: None
+        """
+        pass
+
+    def get_state(self):
+        """
+        The per pedestrian data of the population, used for checkpoints.
+        Populations that keep more data should extend this method and prepare.
+        :return: dictionary with arrays
+        """
+        return {'indices': self.indices}
 
     def _init_pedestrians(self):
         """
         Initializes the populations. Can be overridden for a different initial distribution
         or for different properties.
 
-        Concatenates this population with the previous ones in the scene and computes the indices
-         that correspond to this population.
+        The indices that correspond to this population are set in self._update_membership.
         :return:
         """
-        old_len = len(self.scene.pedestrian_list)
-        for i in range(self.number):
-            pedestrian = Pedestrian(self.scene, old_len + i, color=self.color)
-            self.indices[old_len + i] = 1
-            self.scene.pedestrian_list.append(pedestrian)
-            self.scene.index_map[old_len + i] = pedestrian
+        self.spawn(self.number)
+
+    def _update_membership(self, indices):
+        """
+        Called when pedestrians are added to the scene. Entries that are reused by another population
+        are no longer part of this population.
+        :param indices: Array indices of the new pedestrians
+        :return: None
+        """
+        self.indices[indices] = self.scene.population_array[indices] == self.id
+
+    def _remap(self, mapping):
+        """
+        Called when the pedestrian arrays of the scene are reordered or resized. See Scene.remap.
+        Populations that keep more per pedestrian arrays should extend this method.
+        :param mapping: integer array with the old index for each new index
+        :return: None
+        """
+        self.indices = self.scene.remap_array(self.indices, mapping, False)
+
+    def spawn(self, number):
+        """
+        Add a batch of new pedestrians of this population somewhere in the scene.
+        Entries are taken from the free list of the scene, which grows if required.
+        :param number: Number of new pedestrians
+        :return: array with the indices of the new pedestrians
+        """
+        indices = self.scene.allocate(number)
+        self.scene.add_pedestrians(indices, self.id, self.color)
+        return indices
 
     def create_new_pedestrian(self):
         """
         Create a new pedestrian and add it somewhere in the scene.
         :return: None
         """
-        index = np.where(self.scene.active_entries == 0)[0][0]
-        new_pedestrian = Pedestrian(self.scene, counter=self.scene.total_pedestrians, index=index)
-        self.scene.add_pedestrian(new_pedestrian)
-        self.indices[index] = 1
+        self.spawn(1)
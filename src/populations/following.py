@@ -15,38 +15,63 @@ class Following(Population):
     Also the maximum speed can be reduced due to the stress of the smoke
     """
 
-    def __init__(self, scene, number):
+    def __init__(self, scene, number, distribution=None):
         """
         Initializes a following behaviour for the given population.
 
         :param scene: Simulation scene
         :param number: Initial number of people
+        :param distribution: InitialDistribution of the pedestrians. Uniform if left empty.
         :return: Scripted pedestrian group
         """
         # Todo: Add the graphing of the necessary plots as on_step_functions
-        super().__init__(scene, number)
+        super().__init__(scene, number, distribution)
         self.waypoints = []
         # self.waypoint_positions = self.waypoint_velocities = None
         self.follow_radii = self.speed_ref = None
+        # Reused buffer for the random force of each step
+        self.random_force = np.zeros([0, 2])
         self.color = 'blue'
         self.on_step_functions = []
 
-    def prepare(self, params):
+    def prepare(self, params, state=None):
         """
         Called before the simulation starts. Fix all parameters and bootstrap functions.
 
+        :param state: Dictionary as returned by get_state to resume from
         :return: None
         """
-        super().prepare(params)
-        # The size of the radius the pedestrian uses to follow others.
-        self.follow_radii = np.ones(self.number) * self.params.follow_radius
-        # A reference to the original maximum speed of the pedestrians
-        self.speed_ref = np.array(self.scene.max_speed_array)
+        super().prepare(params, state)
+        if state is not None:
+            self.follow_radii = np.array(state['follow_radii'])
+            self.speed_ref = np.array(state['speed_ref'])
+        else:
+            # The size of the radius the pedestrian uses to follow others, for each entry in the scene arrays.
+            self.follow_radii = np.ones(len(self.scene.active_entries)) * self.params.follow_radius
+            # A reference to the original maximum speed of the pedestrians
+            self.speed_ref = np.array(self.scene.max_speed_array)
         if self.params.smoke:
             self.on_step_functions.append(self._reduce_sight_by_smoke)
             self.on_step_functions.append(self._modify_speed_by_smoke)
         self.on_step_functions.append(self.assign_velocities)
 
+    def get_state(self):
+        state = super().get_state()
+        state.update({'follow_radii': self.follow_radii, 'speed_ref': self.speed_ref})
+        return state
+
+    def _update_membership(self, indices):
+        super()._update_membership(indices)
+        if self.speed_ref is not None:
+            # New pedestrians (inflow) have their own maximum speed and an unobstructed sight
+            self.speed_ref[indices] = self.scene.max_speed_array[indices]
+            self.follow_radii[indices] = self.params.follow_radius
+
+    def _remap(self, mapping):
+        super()._remap(mapping)
+        self.speed_ref = self.scene.remap_array(self.speed_ref, mapping)
+        self.follow_radii = self.scene.remap_array(self.follow_radii, mapping, self.params.follow_radius)
+
     def _load_waypoints(self, file_name="None"):
         """
         Not yet used, not yet implemented. Future research
@@ -74,21 +99,18 @@ class Following(Population):
         Compute how much the smoke influences the sight radius (self.follow_radii)
         :return:
         """
-        smoke_on_positions = self.params.smoke_field.get_interpolation_function().ev(
-            self.scene.position_array[self.indices, 0],
-            self.scene.position_array[self.indices, 1])
-        self.follow_radii = self.params.follow_radius * (1 - (1 - self.params.minimal_follow_radius) * np.minimum(
-            np.maximum(smoke_on_positions, 0) / self.params.smoke_limit, 1))
-        print(np.mean(self.follow_radii))
+        smoke_on_positions = self.params.smoke_field.sample(self.scene.position_array[self.indices])
+        self.follow_radii[self.indices] = self.params.follow_radius * (
+            1 - (1 - self.params.minimal_follow_radius) * np.minimum(
+                np.maximum(smoke_on_positions, 0) / self.params.smoke_limit, 1))
+        print(np.mean(self.follow_radii[self.indices]))
 
     def _modify_speed_by_smoke(self):
         """
         Choosing velocity parameters as given by the Japanese paper.
         :return:
         """
-        smoke_function = self.params.smoke_field.get_interpolation_function()
-        smoke_on_positions = smoke_function.ev(self.scene.position_array[self.indices, 0],
-                                               self.scene.position_array[self.indices, 1])
+        smoke_on_positions = self.params.smoke_field.sample(self.scene.position_array[self.indices])
         velo_modifier = np.clip(smoke_on_positions / self.params.max_smoke_level, 0, 1 - self.params.min_speed_ratio)
         self.scene.max_speed_array[self.indices] = self.speed_ref[self.indices] * (1 - velo_modifier)
 
@@ -107,10 +129,15 @@ class Following(Population):
             velocities = self.scene.velocity_array
             actives = self.scene.active_entries
         swarm_force = get_swarm_force(positions, velocities, self.scene.size[0],
-                                      self.scene.size[1], actives, self.follow_radii) * self.params.swarm_force
+                                      self.scene.size[1], actives, self.follow_radii[self.indices]) * self.params.swarm_force
         print("swarm force", np.linalg.norm(swarm_force))
 
-        random_force = np.random.randn(np.sum(self.indices), 2) * self.params.random_force
+        number = np.sum(self.indices)
+        if len(self.random_force) < number:
+            self.random_force = np.empty([len(self.scene.active_entries), 2])
+        random_force = self.random_force[:number]
+        self.scene.random['population%d' % self.id].standard_normal(out=random_force)
+        random_force *= self.params.random_force
         print("random force", np.linalg.norm(random_force))
         # fire_rep_x = self.fire_force_field_x.ev(self.scene.position_array[:, 0], self.scene.position_array[:, 1])
         # fire_rep_y = self.fire_force_field_y.ev(self.scene.position_array[:, 0], self.scene.position_array[:, 1])
@@ -1,9 +1,11 @@
+import time
+
 import numpy as np
 from populations.base import Population
+from populations.navigation import Navigator
 from math_objects import functions as ft
-from scipy.ndimage import gaussian_filter
 from math_objects.scalar_field import ScalarField as Field
-from lib.wdt import get_weighted_distance_transform, plot
+from lib.wdt import plot, coarsen_cost_field, get_weighted_distance_transform
 
 
 class Knowing(Population):
@@ -12,92 +14,482 @@ class Knowing(Population):
     of the scene and uses the steepest gradient to move the pedestrians towards their goal.
     Combine with a macroscopic planner for interaction (repulsion)
     """
+    # Arrays that describe a potential, stored in the field cache and in checkpoints
+    potential_names = ('potential', 'pot_grad_x', 'pot_grad_y')
 
-    def __init__(self, scene, number):
+    def __init__(self, scene, number, distribution=None, goals=None):
         """
         Initializes a following behaviour for the given population.
 
         :param scene: Simulation scene
         :param number: Initial number of people
+        :param distribution: InitialDistribution of the pedestrians. Uniform if left empty.
+        :param goals: Exits the pedestrians walk to: a list of exit numbers (see Scene.exit_labels),
+        or tuples of exit numbers for groups of exits. Each pedestrian gets one of the goals at random.
+        If left empty, pedestrians walk to the nearest exit.
         :return: Scripted pedestrian group
         """
-        super().__init__(scene, number)
+        super().__init__(scene, number, distribution)
         self.fire_aware_indices = []
         self.on_step_functions = []
         self.on_step_functions.append(self.assign_velocities)
         self.dx = self.dy = None
         self.potential_field = None  # Todo: These three do not need to be on class level
         self.pot_grad_x = self.pot_grad_y = None
-        self.grad_x_func = self.grad_y_func = None
+        # Exit numbers of each goal, None for all exits
+        self.goals = [tuple(np.atleast_1d(goal).tolist()) for goal in goals] if goals else [None]
+        # Index in self.goals of each pedestrian
+        self.goal_array = None
+        # Walking directions without and with the fire as obstacle
+        self.navigator = self.fire_navigator = None
         self.seen_fire = None
+        # Cells of the environment field from where the fire is seen
+        self.fire_sight_cells = None
+        # Potential and gradient arrays (see potential_names) of each goal without the fire, and with the fire
+        self.plain_fields = self.fire_fields = None
+        # Distance transform with the fire that is computed in the background, and its key in the field cache
+        self.fire_future = self.fire_key = None
+        # Dynamic potential on the pressure grid: costs and static and dynamic potentials of each goal,
+        # the density dependent cost multiplier and the density it was computed from
+        self.coarse_costs = self.coarse_static_potentials = self.coarse_potentials = None
+        self.cost_multiplier = self.update_density = None
+        self.steps_since_update = 0
+        # Correction of the walking directions of each goal by the dynamic potential, on the pressure grid:
+        # the gradient of the difference between the dynamic and static potential and the static costs
+        self.dynamic_corrections = None
+        # Number of updates of the dynamic potential and the total time they took
+        self.dynamic_updates = 0
+        self.dynamic_update_time = 0.
         self.color = 'green'
         # self.potential_field_with_fire = None
         # self.pot_grad_fire_x = self.pot_grad_fire_y = None
-        self.grad_x_fire_func = self.grad_y_fire_func = None
 
-    def prepare(self, params):
+    def prepare(self, params, state=None):
         """
         Called before the simulation starts. Fix all parameters and bootstrap functions.
+        The potentials are loaded from the field cache of the scene when available.
 
+        :param state: Dictionary as returned by get_state to resume from, instead of computing the potentials
         :return: None
         """
-        super().prepare(params)
-        # I also want one that contains the fire as an obstacle, inserted here
-        cost_field = self._add_obstacle_discomfort(radius=self.params.obstacle_clearance)
-        self.grad_x_func, self.grad_y_func = self._get_potential_planner(cost_field)
+        for goal in self.goals:
+            if goal is not None and not all(1 <= exit_number <= self.scene.num_exits for exit_number in goal):
+                raise ValueError("Goal %s is not one of the %d exits of the scene" % (goal, self.scene.num_exits))
+        if state is None:
+            # Before the pedestrians are initialized, so that they are assigned a goal
+            self.goal_array = np.zeros(len(self.scene.active_entries), dtype=np.intp)
+        super().prepare(params, state)
+        cache = self.scene.field_cache
+        if state is not None:
+            self.goal_array = np.array(state['goal_array'], dtype=np.intp)
+            self.plain_fields = [{name: state[name][i] for name in self.potential_names}
+                                 for i in range(len(self.goals))]
+        else:
+            keys = [cache.get_key('knowing', self.scene.image_digest, self.params.obstacle_clearance,
+                                  tuple(self.scene.size.array), self.scene.get_distance_transform_settings(),
+                                  *([] if goal is None else [goal])) for goal in self.goals]
+            self.plain_fields = [cache.load(key, self.potential_names) for key in keys]
+            missing = [i for i, fields in enumerate(self.plain_fields) if fields is None]
+            if missing:
+                # The potentials of all goals that are not in the cache are computed in parallel
+                computed = self._compute_potentials([self._get_goal_cost_field(self.scene.env_field, self.goals[i])
+                                                     for i in missing])
+                for i, fields in zip(missing, computed):
+                    self.plain_fields[i] = cache.store(keys[i], fields)
+        self.navigator = self._get_potential_planner(self.plain_fields)
+        self.scene.on_cost_change_functions.append(self.replan)
+        if self.params.dynamic_potential_interval > 0:
+            if self.scene.density_field is None:
+                raise ValueError("The dynamic potential needs the density of the crowd. Add the 'repulsion' effect")
+            self._prepare_dynamic_potential()
+            if state is not None:
+                self.coarse_potentials = list(state['coarse_potentials'])
+                self.cost_multiplier = np.array(state['cost_multiplier'])
+                self.update_density = np.array(state['update_density'])
+                self.steps_since_update = int(state['steps_since_update'])
+                self.dynamic_corrections = self._get_dynamic_corrections()
+            self.on_step_functions.insert(0, self.update_dynamic_potential)
         if hasattr(self.params, 'fire'):
-            fire = self.params.fire.get_fire_intensity(*self.scene.env_field.shape)
-            fire_threshold = 0.01
-            fire[fire > fire_threshold] = np.inf
-            fire[fire <= fire_threshold] = 0
-
-            fire_cost_field = self._add_obstacle_discomfort(radius=self.params.obstacle_clearance,
-                                                            cost_field=(fire + self.scene.env_field))
-            self.seen_fire = np.zeros(self.scene.total_pedestrians, dtype=bool)
-            self.grad_x_fire_func, self.grad_y_fire_func = self._get_potential_planner(fire_cost_field)
+            if state is not None:
+                self.seen_fire = np.array(state['seen_fire'])
+                self.fire_fields = {name: state['fire_' + name] for name in self.potential_names}
+            else:
+                fire = self.params.fire
+                self.fire_key = cache.get_key('knowing-fire', self.scene.image_digest, self.params.obstacle_clearance,
+                                              tuple(self.scene.size.array), tuple(np.array(fire.center, dtype=float)),
+                                              float(fire.radius), self.scene.get_distance_transform_settings())
+                self.fire_fields = cache.load(self.fire_key, self.potential_names)
+                if self.fire_fields is None:
+                    if self.params.background_fire_field:
+                        # Nobody has seen the fire yet: compute it while the simulation runs.
+                        # Populations share the computation.
+                        self.fire_future = cache.get_future(self.fire_key, lambda: self.scene.submit_distance_transform(
+                            self._get_fire_cost_field(self.scene.env_field)))
+                    else:
+                        cost_field = self._get_fire_cost_field(self.scene.env_field)
+                        self.fire_fields = cache.store(self.fire_key, self._compute_potentials([cost_field])[0])
+                self.seen_fire = np.zeros(len(self.scene.active_entries), dtype=bool)
+            if self.fire_fields is not None:
+                self.fire_navigator = self._get_potential_planner([self.fire_fields])
+            fire_thres = 0.001  # Assert that is this low enough so that pedestrians don't get caught in a fire zone
+            # The intensity decays exponentially, so the fire is only seen within a cut-off radius
+            self.fire_sight_cells = self.params.fire.get_fire_intensity(*self.scene.env_field.shape) > fire_thres
             self.on_step_functions.insert(0, self.set_fire_knowledge)
-            self.on_step_functions.append(self.assign_post_fire_velocities)
-            # Overwrite accessibility: no pedestrians should be initiated in the fire
-            self.scene.direction_field = self.potential_field.array
-            self._correct_pedestrian_initial_positions()
+            if state is None:
+                # Overwrite accessibility: no pedestrians should be initiated in the fire
+                self._exclude_fire_cells()
+                self._correct_pedestrian_initial_positions()
+
+    def get_state(self):
+        state = super().get_state()
+        state['goal_array'] = self.goal_array
+        state.update({name: np.stack([fields[name] for fields in self.plain_fields])
+                      for name in self.potential_names})
+        if self.coarse_costs is not None:
+            state.update({'coarse_potentials': np.stack(self.coarse_potentials),
+                          'cost_multiplier': self.cost_multiplier, 'update_density': self.update_density,
+                          'steps_since_update': self.steps_since_update})
+        if self.seen_fire is not None:
+            self._collect_fire_potential(wait=True)
+            state['seen_fire'] = self.seen_fire
+            state.update({'fire_' + name: field for name, field in self.fire_fields.items()})
+        return state
 
     def _correct_pedestrian_initial_positions(self):
         """
         Not particularly proud of this hack, but I need a way to get the initialized pedestrians out of any fire zones.
         :return:
         """
-        for pedestrian in self.scene.pedestrian_list:
-            while not self.scene.is_accessible(pedestrian.position, at_start=True):
-                pedestrian.position = self.scene.size.random_internal_point()
+        self.scene.correct_initial_positions()
+
+    def _collect_fire_potential(self, wait=False):
+        """
+        Create the navigator with the fire as an obstacle when its distance transform is computed in the background.
+        Pedestrians who saw the fire walk to the nearest exit, whatever their goal.
+        :param wait: Wait for the distance transform if it is not finished
+        :return: None
+        """
+        if self.fire_future is None or not (wait or self.fire_future.done()):
+            return
+        potential = self.fire_future.result()
+        self.fire_future = None
+        cache = self.scene.field_cache
+        # Another population may have collected the shared distance transform already
+        self.fire_fields = cache.load(self.fire_key, self.potential_names)
+        if self.fire_fields is not None:
+            self.fire_navigator = self._get_potential_planner([self.fire_fields])
+        else:
+            self.fire_navigator = self._get_potential_planner([{'potential': potential}])
+            self.fire_fields = cache.store(self.fire_key, {
+                'potential': self.potential_field.array, 'pot_grad_x': self.pot_grad_x.array,
+                'pot_grad_y': self.pot_grad_y.array})
+        ft.debug("Switched to the navigation field with the fire")
+
+    def _exclude_fire_cells(self):
+        """
+        Make the cells in the fire inaccessible in the direction field of the scene,
+        so that no pedestrians are placed in the fire.
+        :return: None
+        """
+        self.scene.direction_field = np.where(self._get_fire_cells(self.scene.env_field.shape), np.inf,
+                                              self.scene.direction_field)
+
+    def _get_goal_cost_field(self, env_field, goal, store=True):
+        """
+        Cost field of the environment towards a goal, with a layer of discomfort around the obstacles.
+        The exits that are not part of the goal are obstacles.
+        :param env_field: Environment field of the scene
+        :param goal: Exit numbers of the goal (see self.goals), None for all exits
+        :param store: Store the cost field in the field cache, see _add_obstacle_discomfort
+        :return: cost field
+        """
+        if goal is not None:
+            env_field = np.array(env_field)
+            env_field[np.logical_and(self.scene.exit_labels > 0, ~np.isin(self.scene.exit_labels, goal))] = np.inf
+        return self._add_obstacle_discomfort(radius=self.params.obstacle_clearance, cost_field=env_field, store=store)
+
+    def _get_fire_cost_field(self, env_field, store=True):
+        """
+        Cost field of the environment with the fire as an obstacle and a layer of discomfort around the obstacles.
+        :param env_field: Environment field of the scene
+        :param store: Store the cost field in the field cache, see _add_obstacle_discomfort
+        :return: cost field
+        """
+        fire = np.where(self._get_fire_cells(env_field.shape), np.inf, 0)
+        return self._add_obstacle_discomfort(radius=self.params.obstacle_clearance, cost_field=(fire + env_field),
+                                             store=store)
+
+    def _get_fire_cells(self, shape):
+        """
+        Cells that are obstacles because of the fire.
+        :param shape: Shape of the field
+        :return: Boolean array
+        """
+        fire_threshold = 0.01
+        return self.params.fire.get_fire_intensity(*shape) > fire_threshold
+
+    def replan(self, old_env_field, changed_cells):
+        """
+        Repair the potentials after the environment of the scene changed (see Scene.change_costs).
+        Only the region of the potentials that depends on the changed costs is computed again,
+        and the gradient only where the potential changed. Called before a time step, so the new fields are
+        used for the whole step.
+        :param old_env_field: Environment field before the change
+        :param changed_cells: Boolean array with the changed cells of the environment field
+        :return: None
+        """
+        # The cost fields of a changed environment are only used once: do not fill the field cache with them
+        self.plain_fields = [self._repair_fields(fields, self._get_goal_cost_field(old_env_field, goal, store=False),
+                                                 self._get_goal_cost_field(self.scene.env_field, goal, store=False))
+                             for fields, goal in zip(self.plain_fields, self.goals)]
+        self.navigator = self._get_potential_planner(self.plain_fields)
+        if self.seen_fire is not None:
+            self._collect_fire_potential(wait=True)
+            self.fire_fields = self._repair_fields(self.fire_fields,
+                                                   self._get_fire_cost_field(old_env_field, store=False),
+                                                   self._get_fire_cost_field(self.scene.env_field, store=False))
+            self.fire_navigator = self._get_potential_planner([self.fire_fields])
+            # Like in prepare: no pedestrians should be initiated in the fire
+            self._exclude_fire_cells()
+        if self.coarse_costs is not None:
+            # Solve the dynamic potential again at the next step
+            self._prepare_dynamic_potential(store=False)
+
+    def _prepare_dynamic_potential(self, store=True):
+        """
+        Compute the costs and static potentials of all goals on the pressure grid, as a reference for the dynamic
+        potential. The dynamic potential is solved at the next call of update_dynamic_potential.
+        :param store: Store the cost fields in the field cache, see _add_obstacle_discomfort
+        :return: None
+        """
+        shape = self.scene.density_field.array.shape
+        self.coarse_costs = [coarsen_cost_field(self._get_goal_cost_field(self.scene.env_field, goal, store), shape)
+                             for goal in self.goals]
+        self.coarse_static_potentials = self._get_coarse_potentials(self.coarse_costs)
+        self.coarse_potentials = list(self.coarse_static_potentials)
+        self.cost_multiplier = np.ones(shape)
+        self.update_density = np.zeros(shape)
+        self.steps_since_update = self.params.dynamic_potential_interval
+        self.dynamic_corrections = None
+
+    def update_dynamic_potential(self):
+        """
+        Increase the costs of the potentials where the crowd is dense, so that pedestrians spread over the exits
+        and routes. Only every params.dynamic_potential_interval steps, or when the density changed by more than
+        params.dynamic_potential_threshold since the last update.
+        The potentials are solved again on the pressure grid, which is small, with the compiled distance transform.
+        The gradient of the difference with the static potential corrects the walking directions of the static
+        navigator (see _correct_directions), so that they keep the detail around obstacles and the navigator of the
+        full resolution potentials is not built again.
+        :return: None
+        """
+        self.steps_since_update += 1
+        density = self.scene.density_field.array
+        density_change = np.max(np.abs(density - self.update_density)) / self.params.max_density
+        if self.steps_since_update < self.params.dynamic_potential_interval and \
+                not 0 < self.params.dynamic_potential_threshold < density_change:
+            return
+        start = time.time()
+        self.steps_since_update = 0
+        self.update_density = np.array(density)
+        # Hughes model: the walking speed decreases linearly with the density
+        relative_density = np.clip(density / self.params.max_density, 0, 0.9)
+        multiplier = 1 + self.params.dynamic_potential_weight * (1 / (1 - relative_density) - 1)
+        changed_cells = np.abs(multiplier - self.cost_multiplier) > 1e-3
+        if not np.any(changed_cells):
+            return
+        self.cost_multiplier[changed_cells] = multiplier[changed_cells]
+        self.coarse_potentials = self._get_coarse_potentials([coarse_cost * self.cost_multiplier
+                                                              for coarse_cost in self.coarse_costs])
+        self.dynamic_corrections = self._get_dynamic_corrections()
+        self.dynamic_updates += 1
+        self.dynamic_update_time += time.time() - start
+        ft.debug("Dynamic potential update %d: %d cells changed, %.3f seconds" % (
+            self.dynamic_updates, np.sum(changed_cells), time.time() - start))
+
+    def _get_coarse_potentials(self, cost_fields):
+        """
+        Weighted distance transforms on the pressure grid.
+        The grid is already coarse and small, so they are solved in this process and without multi-resolution.
+        :param cost_fields: List of cost fields on the pressure grid
+        :return: list of arrays
+        """
+        return [get_weighted_distance_transform(cost_field, self.params.wdt_method) for cost_field in cost_fields]
 
-    def _get_potential_planner(self, cost_field):
-        wdt = get_weighted_distance_transform(cost_field)
-        self.dx, self.dy = self.scene.size.array / wdt.shape
-        self.potential_field = Field(wdt.shape, Field.Orientation.center, 'potential', (self.dx, self.dy))
-        self.potential_field.array = wdt
-        self.pot_grad_x = Field(wdt.shape, Field.Orientation.vertical_face, 'pot_grad_x', (self.dx, self.dy))
+    def _get_dynamic_corrections(self):
+        """
+        Fields on the pressure grid to correct the walking directions of each goal with the dynamic potential:
+        the gradient of the difference between the dynamic and static potential, and the norm of the gradient of the
+        static potential (its costs).
+        The potentials on the pressure grid are measured in its cells, so along each axis, the difference between
+        neighbouring cells is the gradient in the units of the costs, whatever the cell size along that axis.
+        :return: list with three ScalarFields (gradient in x and y direction, static costs) for each goal
+        """
+        shape = self.scene.density_field.array.shape
+        cell_size = (self.scene.density_field.dx, self.scene.density_field.dy)
+        corrections = []
+        for potential, static_potential, cost in zip(self.coarse_potentials, self.coarse_static_potentials,
+                                                     self.coarse_costs):
+            with np.errstate(invalid='ignore'):
+                correction = potential - static_potential
+            correction[~np.isfinite(correction)] = 0
+            fields = [Field(shape, Field.Orientation.center, name, cell_size)
+                      for name in ('correction_grad_x', 'correction_grad_y', 'static_cost')]
+            fields[0].update(np.gradient(correction, axis=0) if shape[0] > 1 else np.zeros(shape))
+            fields[1].update(np.gradient(correction, axis=1) if shape[1] > 1 else np.zeros(shape))
+            fields[2].update(np.where(np.isfinite(cost), cost, 0))
+            corrections.append(fields)
+        return corrections
+
+    def _correct_directions(self, directions, positions, goals):
+        """
+        Walking directions along the dynamic potential: the steepest descent of the static potential plus the
+        correction of update_dynamic_potential. The static gradient is the walking direction of the static navigator,
+        scaled by the costs (the norm of the gradient of a distance transform).
+        :param directions: n x 2 array with the unit walking directions of the static navigator
+        :param positions: n x 2 array
+        :param goals: integer array with the goal of each position
+        :return: n x 2 array with unit directions
+        """
+        for goal, fields in enumerate(self.dynamic_corrections):
+            on_goal = np.flatnonzero(goals == goal)
+            if not on_goal.size:
+                continue
+            samples = Field.sample_fields(fields, positions[on_goal])
+            gradient = directions[on_goal] * samples[:, 2:] - samples[:, :2]
+            # The costs are small numbers: normalize without ft.EPS, and keep the direction where the gradient vanishes
+            norm = np.linalg.norm(gradient, axis=1)
+            nonzero = norm > 0
+            directions[on_goal[nonzero]] = gradient[nonzero] / norm[nonzero, None]
+        return directions
+
+    def finish(self):
+        """
+        Report how often the dynamic potential was updated and how long it took.
+        :return: None
+        """
+        if self.coarse_costs is not None:
+            ft.log("Dynamic potential: %d updates in %d steps, %.3f seconds per update" % (
+                self.dynamic_updates, self.scene.counter, self.dynamic_update_time / max(self.dynamic_updates, 1)))
+
+    def _repair_fields(self, fields, old_cost_field, cost_field):
+        """
+        Repair a potential and its gradient after the cost field changed.
+        :param fields: dictionary with arrays for self.potential_names of the old cost field
+        :param old_cost_field: Cost field before the change
+        :param cost_field: Cost field after the change
+        :return: dictionary with arrays for self.potential_names of the new cost field
+        """
+        # The discomfort layer spreads a change of the environment over the neighbouring cells
+        changed_costs = old_cost_field != cost_field
+        if not np.any(changed_costs):
+            return fields
+        potential = self.scene.update_distance_transform(fields['potential'], cost_field, changed_costs)
+        changed_x, changed_y = np.nonzero(~(potential == fields['potential']))
+        if not changed_x.size:
+            return fields
+        # Gradient on the faces next to the changed cells, like in compute_potential_gradient
+        rows = slice(changed_x.min(), changed_x.max() + 1)
+        columns = slice(changed_y.min(), changed_y.max() + 1)
+        faces_x = slice(max(rows.start - 1, 0), rows.stop)
+        faces_y = slice(max(columns.start - 1, 0), columns.stop)
+        with np.errstate(invalid='ignore'):
+            window_grad_x = np.diff(potential[faces_x.start:faces_x.stop + 1, columns], axis=0) / self.dx
+            window_grad_y = np.diff(potential[rows, faces_y.start:faces_y.stop + 1], axis=1) / self.dy
+        window_grad_x[~np.isfinite(window_grad_x)] = 0
+        window_grad_y[~np.isfinite(window_grad_y)] = 0
+        grad_x = np.array(fields['pot_grad_x'])
+        grad_x[faces_x, columns] = window_grad_x
+        grad_y = np.array(fields['pot_grad_y'])
+        grad_y[rows, faces_y] = window_grad_y
+        return {'potential': potential, 'pot_grad_x': grad_x, 'pot_grad_y': grad_y}
+
+    def _compute_potentials(self, cost_fields):
+        """
+        Compute the potentials (weighted distance transforms) of cost fields and their gradients.
+        The distance transforms are computed in parallel, see Scene.get_distance_transforms.
+        :param cost_fields: List of cost fields to compute the potential of
+        :return: list with a dictionary with arrays for self.potential_names for each cost field
+        """
+        potentials = []
+        for potential in self.scene.get_distance_transforms(cost_fields):
+            self._set_potential(potential)
+            potentials.append({'potential': self.potential_field.array, 'pot_grad_x': self.pot_grad_x.array,
+                               'pot_grad_y': self.pot_grad_y.array})
+        return potentials
+
+    def _set_potential(self, potential, pot_grad_x=None, pot_grad_y=None):
+        """
+        Store the potential and its gradient in fields. The gradient is computed if it is not given.
+        :param potential: Weighted distance transform
+        :param pot_grad_x: Precomputed x component of the gradient
+        :param pot_grad_y: Precomputed y component of the gradient
+        :return: None
+        """
+        potential = np.asarray(potential)
+        self.dx, self.dy = self.scene.size.array / potential.shape
+        self.potential_field = Field(potential.shape, Field.Orientation.center, 'potential', (self.dx, self.dy))
+        self.potential_field.array = potential
+        self.pot_grad_x = Field(potential.shape, Field.Orientation.vertical_face, 'pot_grad_x', (self.dx, self.dy))
         np.seterr(invalid='ignore')
-        self.pot_grad_y = Field(wdt.shape, Field.Orientation.horizontal_face, 'pot_grad_y', (self.dx, self.dy))
-        self.compute_potential_gradient()
-        grad_x_func = self.pot_grad_x.get_interpolation_function()
-        grad_y_func = self.pot_grad_y.get_interpolation_function()
-        return grad_x_func, grad_y_func
+        self.pot_grad_y = Field(potential.shape, Field.Orientation.horizontal_face, 'pot_grad_y', (self.dx, self.dy))
+        if pot_grad_x is None or pot_grad_y is None:
+            self.compute_potential_gradient()
+        else:
+            self.pot_grad_x.update(np.asarray(pot_grad_x))
+            self.pot_grad_y.update(np.asarray(pot_grad_y))
+
+    def _get_potential_planner(self, fields):
+        """
+        Store the potentials and create a navigator for their gradients, with the method in params.navigation.
+        :param fields: List with a dictionary with arrays for self.potential_names for each goal.
+        The gradient is computed if it is not given.
+        :return: Navigator that provides the walking directions
+        """
+        grad_x_fields, grad_y_fields = [], []
+        for goal_fields in fields:
+            self._set_potential(**goal_fields)
+            grad_x_fields.append(self.pot_grad_x)
+            grad_y_fields.append(self.pot_grad_y)
+        return Navigator(grad_x_fields, grad_y_fields, self.params.navigation)
 
-    def _add_obstacle_discomfort(self, radius, cost_field=None):
+    def _add_obstacle_discomfort(self, radius, cost_field=None, store=True):
         """
         Use a gaussian filter (image blurring) to obtain a layer of discomfort around the obstacles
         The radius specifies how far the discomfort reaches. This radius is related to pedestrian size but can vary
         among different scenarios
+        The result is stored in the field cache of the scene by the contents of the cost field, so populations
+        with the same cost field share it. Cost fields of an environment that changed during the simulation
+        are only looked up, because every change would add a field to the cache that is never used again.
 
         :param radius: SD of gaussian filter. Higher means lower values but longer range.
+        :param cost_field: Cost field, the environment field of the scene if None
+        :param store: Store the result in the field cache if it is not there yet
         :return: An adjusted cost field
         """
         if cost_field is None:
-            cost_field = self.scene.env_field.copy()
-        new_cost_field = cost_field.copy()
+            cost_field = self.scene.env_field
+        cache = self.scene.field_cache
+        key = cache.get_key('discomfort', cache.get_array_digest(cost_field), float(radius))
+        if not store:
+            fields = cache.load(key, ('cost_field',))
+            return self._compute_obstacle_discomfort(radius, cost_field) if fields is None else fields['cost_field']
+        return cache.get_fields(key, ('cost_field',), lambda: {
+            'cost_field': self._compute_obstacle_discomfort(radius, cost_field)})['cost_field']
+
+    @staticmethod
+    def _compute_obstacle_discomfort(radius, cost_field):
+        """
+        See _add_obstacle_discomfort.
+
+        :param radius: SD of gaussian filter
+        :param cost_field: Cost field
+        :return: An adjusted cost field
+        """
+        new_cost_field = np.array(cost_field)
         new_cost_field[new_cost_field == np.inf] = 0
         new_cost_field[cost_field == np.inf] = np.max(new_cost_field) * 3
-        new_cost_field = gaussian_filter(new_cost_field, sigma=radius)
+        new_cost_field = ft.gaussian_blur(new_cost_field, sigma=radius)
         new_cost_field[cost_field == np.inf] = np.inf
         new_cost_field[cost_field == 0] = 0
         return new_cost_field
@@ -119,40 +511,54 @@ class Knowing(Population):
         self.pot_grad_y.update((up_field - down_field) / self.dy)
         self.pot_grad_y.array[np.logical_not(np.isfinite(self.pot_grad_y.array))] = 0
 
+    def _update_membership(self, indices):
+        super()._update_membership(indices)
+        if self.goal_array is not None:
+            new_indices = indices[self.indices[indices]]
+            self.goal_array[new_indices] = self.scene.random['goals'].integers(len(self.goals), size=len(new_indices))
+        if self.seen_fire is not None:
+            # Entries can be reused by new pedestrians, who have not seen the fire yet
+            self.seen_fire[indices] = False
+
+    def _remap(self, mapping):
+        super()._remap(mapping)
+        self.goal_array = self.scene.remap_array(self.goal_array, mapping, 0)
+        if self.seen_fire is not None:
+            self.seen_fire = self.scene.remap_array(self.seen_fire, mapping, False)
+
     def set_fire_knowledge(self):
-        fire_thres = 0.001  # Assert that is this low enough so that pedestrians don't get caught in a fire zone
-        sees_fire = np.where(
-            np.logical_and(self.params.fire.get_fire_intensity_at(self.scene.position_array) > fire_thres,
-                           self.indices))
-        self.seen_fire[sees_fire] = True
+        """
+        Mark the pedestrians who see the fire. Only pedestrians who have not seen it yet are checked,
+        by looking up their cell in the precomputed sight cells.
+        :return: None
+        """
+        unaware = np.flatnonzero(np.logical_and(self.indices, ~self.seen_fire))
+        cells = (self.scene.position_array[unaware] // (self.scene.dx, self.scene.dy)).astype(int) % \
+            self.fire_sight_cells.shape
+        self.seen_fire[unaware[self.fire_sight_cells[cells[:, 0], cells[:, 1]]]] = True
+        self._collect_fire_potential()
 
     def assign_velocities(self):
         """
-        Interpolates the potential gradients for this time step and computes the velocities.
-        Afterwards, overwrites the velocities for people who saw the fire
+        Computes the velocities from the walking directions at the positions of the pedestrians.
+        People who saw the fire take the routing around the fire, the others the routing to their goal.
+        The pedestrians are split once, so that each field is only evaluated for its own pedestrians.
+        Until the navigation field with the fire is computed, everybody walks along the field without the fire.
         :return: None
-        """  # Todo: Remove chained indexing
-        path_dir_x = self.grad_x_func.ev(self.scene.position_array[:, 0][self.indices],
-                                         self.scene.position_array[:, 1][self.indices])
-        path_dir_y = self.grad_y_func.ev(self.scene.position_array[:, 0][self.indices],
-                                         self.scene.position_array[:, 1][self.indices])
-        path_dir = np.hstack([path_dir_x[:, None], path_dir_y[:, None]])
-        self.scene.velocity_array[self.indices] = - self.scene.max_speed_array[:, None][
-            self.indices] * path_dir / np.linalg.norm(path_dir + ft.EPS, axis=1)[:, None]
-
-    def assign_post_fire_velocities(self):
-        """
-        Take the routing for the people who know where the fire is.
-        :return:
         """
-        post_fire_path_x = self.grad_x_fire_func.ev(self.scene.position_array[:, 0][self.seen_fire],
-                                                    self.scene.position_array[:, 1][self.seen_fire])
-        post_fire_path_y = self.grad_y_fire_func.ev(self.scene.position_array[:, 0][self.seen_fire],
-                                                    self.scene.position_array[:, 1][self.seen_fire])
-        post_fire_path = np.hstack([post_fire_path_x[:, None], post_fire_path_y[:, None]])
-        self.scene.velocity_array[self.seen_fire] = - self.scene.max_speed_array[:, None][
-            self.seen_fire] * post_fire_path / np.linalg.norm(post_fire_path + ft.EPS, axis=1)[:, None]
-
+        if self.fire_navigator is None:
+            unaware, aware = np.flatnonzero(self.indices), None
+        else:
+            unaware = np.flatnonzero(np.logical_and(self.indices, ~self.seen_fire))
+            aware = np.flatnonzero(np.logical_and(self.indices, self.seen_fire))
+        directions = self.navigator.get_directions(self.scene.position_array[unaware], self.goal_array[unaware])
+        if self.dynamic_corrections is not None:
+            directions = self._correct_directions(directions, self.scene.position_array[unaware],
+                                                  self.goal_array[unaware])
+        self.scene.velocity_array[unaware] = self.scene.max_speed_array[unaware, None] * directions
+        if aware is not None and aware.size:
+            directions = self.fire_navigator.get_directions(self.scene.position_array[aware])
+            self.scene.velocity_array[aware] = self.scene.max_speed_array[aware, None] * directions
 
     def step(self):
         """
@@ -0,0 +1,102 @@
+import numpy as np
+
+from math_objects import functions as ft
+
+
+class Navigator:
+    """
+    Provides the walking direction (steepest descent of a potential) at pedestrian positions.
+    Three methods are available:
+    'spline': evaluates bivariate splines of both gradient components and normalizes. Most accurate, but slowest.
+    'bilinear': bilinear interpolation in a table of unit directions on the cell centers of the potential grid.
+    'nearest': the unit direction of the cell that contains the position.
+    The lookup tables are computed once; per time step, the cell indices are computed once for both components.
+    A navigator can hold the gradients of several potentials (one for each goal). The tables of all goals are stacked,
+    so that the directions of pedestrians with different goals are looked up at once.
+    """
+    methods = ('spline', 'bilinear', 'nearest')
+
+    def __init__(self, pot_grad_x, pot_grad_y, method='spline'):
+        """
+        Create a navigator for the gradient of a potential, or of the potentials of several goals.
+
+        :param pot_grad_x: ScalarField with the x component of the gradient, on the vertical faces,
+        or a list with one for each goal
+        :param pot_grad_y: ScalarField with the y component of the gradient, on the horizontal faces,
+        or a list with one for each goal
+        :param method: 'spline', 'bilinear' or 'nearest'
+        :return: Navigator instance
+        """
+        if method not in self.methods:
+            raise NotImplementedError("Navigation method %s not implemented" % method)
+        if not isinstance(pot_grad_x, (list, tuple)):
+            pot_grad_x, pot_grad_y = [pot_grad_x], [pot_grad_y]
+        self.method = method
+        self.num_goals = len(pot_grad_x)
+        self.dx, self.dy = pot_grad_x[0].dx, pot_grad_x[0].dy
+        self.shape = (pot_grad_y[0].array.shape[0], pot_grad_x[0].array.shape[1])
+        self.grad_x_funcs = self.grad_y_funcs = None
+        self.directions = None
+        if method == 'spline':
+            self.grad_x_funcs = [field.get_interpolation_function() for field in pot_grad_x]
+            self.grad_y_funcs = [field.get_interpolation_function() for field in pot_grad_y]
+        else:
+            self.directions = np.concatenate([self._get_direction_table(grad_x.array, grad_y.array)
+                                              for grad_x, grad_y in zip(pot_grad_x, pot_grad_y)])
+
+    @staticmethod
+    def _get_direction_table(grad_x, grad_y):
+        """
+        Averages the face gradients to the cell centers and normalizes them.
+        :param grad_x: (nx - 1) x ny array with the x component of the gradient
+        :param grad_y: nx x (ny - 1) array with the y component of the gradient
+        :return: (nx * ny) x 2 array with unit directions (zero where the gradient vanishes), raveled in C order
+        """
+        padded_x = np.pad(grad_x, ((1, 1), (0, 0)), 'edge')
+        padded_y = np.pad(grad_y, ((0, 0), (1, 1)), 'edge')
+        center_gradient = np.stack(((padded_x[:-1] + padded_x[1:]) / 2, (padded_y[:, :-1] + padded_y[:, 1:]) / 2),
+                                   axis=-1).reshape(-1, 2)
+        norm = np.linalg.norm(center_gradient, axis=1)
+        directions = np.zeros_like(center_gradient)
+        nonzero = norm > 0
+        directions[nonzero] = -center_gradient[nonzero] / norm[nonzero, None]
+        return directions
+
+    def get_directions(self, positions, goals=None):
+        """
+        Unit walking directions at the positions.
+        :param positions: n x 2 array
+        :param goals: integer array with the goal of each position. Can be left empty with a single goal.
+        :return: n x 2 array
+        """
+        if goals is None:
+            goals = np.zeros(len(positions), dtype=int)
+        if self.method == 'spline':
+            path_dir = np.zeros_like(positions, dtype=float)
+            for goal in range(self.num_goals):
+                on_goal = goals == goal
+                if not np.any(on_goal):
+                    continue
+                x, y = positions[on_goal, 0], positions[on_goal, 1]
+                path_dir[on_goal] = np.stack((self.grad_x_funcs[goal].ev(x, y), self.grad_y_funcs[goal].ev(x, y)),
+                                             axis=1)
+            return -path_dir / np.linalg.norm(path_dir + ft.EPS, axis=1)[:, None]
+        nx, ny = self.shape
+        # Offset of the table of each goal. Cast first: goal arrays may be small integers and overflow
+        offsets = np.asarray(goals).astype(np.intp) * (nx * ny)
+        if self.method == 'nearest':
+            cell_x = np.clip((positions[:, 0] / self.dx).astype(int), 0, nx - 1)
+            cell_y = np.clip((positions[:, 1] / self.dy).astype(int), 0, ny - 1)
+            return self.directions[offsets + cell_x * ny + cell_y]
+        # Bilinear: weights of the four surrounding cell centers
+        rel_x = positions[:, 0] / self.dx - 0.5
+        rel_y = positions[:, 1] / self.dy - 0.5
+        cell_x = np.clip(np.floor(rel_x).astype(int), 0, nx - 2)
+        cell_y = np.clip(np.floor(rel_y).astype(int), 0, ny - 2)
+        weight_x = np.clip(rel_x - cell_x, 0, 1)[:, None]
+        weight_y = np.clip(rel_y - cell_y, 0, 1)[:, None]
+        index = offsets + cell_x * ny + cell_y
+        directions = (1 - weight_x) * ((1 - weight_y) * self.directions[index] +
+                                       weight_y * self.directions[index + 1]) + \
+            weight_x * ((1 - weight_y) * self.directions[index + ny] + weight_y * self.directions[index + ny + 1])
+        return directions / (np.linalg.norm(directions, axis=1)[:, None] + ft.EPS)
@@ -0,0 +1,143 @@
+import hashlib
+import os
+
+import numpy as np
+
+from math_objects import functions as ft
+
+
+class FieldCache:
+    """
+    Content-addressed cache on disk for fields that are expensive to compute, like weighted distance transforms.
+    Fields are grouped by a key, a hash of everything the fields depend on (scene image bytes, parameters, ...).
+    Each field is stored as a .npy file in a directory per key and is memory-mapped (copy-on-write) when loaded.
+    Without a cache directory, fields are not stored on disk.
+    In both cases, fields are kept in memory, so that all components of a simulation share them.
+    Fields that are computed in the background are shared while they are computed too, see get_future.
+    """
+
+    def __init__(self, cache_dir=None):
+        """
+        Create a new cache.
+
+        :param cache_dir: Directory to store the fields in. None disables the cache.
+        :return: FieldCache instance
+        """
+        self.cache_dir = cache_dir
+        # Fields that were loaded or computed in this process, by key
+        self.fields = {}
+        # Background computations of fields that are not finished or not stored yet, by key
+        self.futures = {}
+        if self.cache_dir and not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    @staticmethod
+    def get_file_digest(file_name):
+        """
+        Hash of the contents of a file, so that renamed or copied scene images share their cached fields.
+        :param file_name: Path of the file
+        :return: hexadecimal string
+        """
+        with open(file_name, 'rb') as data_file:
+            return hashlib.sha1(data_file.read()).hexdigest()
+
+    @staticmethod
+    def get_array_digest(array):
+        """
+        Hash of the contents of an array, for fields that depend on computed arrays.
+        :param array: numpy array
+        :return: hexadecimal string
+        """
+        array = np.ascontiguousarray(array)
+        digest = hashlib.sha1(repr((array.shape, array.dtype.str)).encode())
+        digest.update(array.data)
+        return digest.hexdigest()
+
+    @staticmethod
+    def get_key(*parts):
+        """
+        Key for a group of fields.
+        :param parts: Strings and numbers (or tuples of them) the fields depend on
+        :return: hexadecimal string
+        """
+        return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+    def get_fields(self, key, names, compute):
+        """
+        Load the fields from the cache, or compute and store them if they are not all present.
+
+        :param key: Key as obtained from get_key
+        :param names: Names of the fields in the group
+        :param compute: Function without arguments that returns a dictionary with an array for each name
+        :return: dictionary with an array for each name
+        """
+        fields = self.load(key, names)
+        if fields is None:
+            fields = self.store(key, compute())
+        return fields
+
+    def get_future(self, key, submit):
+        """
+        Start the background computation of a group of fields, or join the one that was already started.
+
+        :param key: Key as obtained from get_key
+        :param submit: Function without arguments that starts the computation and returns a concurrent.futures.Future
+        :return: the Future shared by all callers with this key, until the fields are stored
+        """
+        if key not in self.futures:
+            self.futures[key] = submit()
+        return self.futures[key]
+
+    def load(self, key, names):
+        """
+        Load a group of fields from the cache.
+
+        :param key: Key as obtained from get_key
+        :param names: Names of the fields in the group
+        :return: dictionary with an array for each name, or None if the fields are not all present
+        """
+        if key in self.fields and all(name in self.fields[key] for name in names):
+            return {name: self.fields[key][name] for name in names}
+        if not self.cache_dir:
+            return None
+        paths = self._get_paths(key, names)
+        if not all(os.path.exists(path) for path in paths.values()):
+            return None
+        ft.debug("Loading cached fields %s" % key)
+        fields = {name: np.load(path, mmap_mode='c') for name, path in paths.items()}
+        self.fields[key] = fields
+        return fields
+
+    def store(self, key, fields):
+        """
+        Store a group of fields in the cache. Only in memory if there is no cache directory.
+
+        :param key: Key as obtained from get_key
+        :param fields: dictionary with an array for each name
+        :return: the fields
+        """
+        self.fields[key] = fields
+        self.futures.pop(key, None)
+        if not self.cache_dir:
+            return fields
+        directory = os.path.join(self.cache_dir, key)
+        if not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        for name, path in self._get_paths(key, fields).items():
+            # Write to a temporary file first, so that concurrent simulations never load half written fields
+            temporary_path = "%s.%d.tmp" % (path, os.getpid())
+            with open(temporary_path, 'wb') as field_file:
+                np.save(field_file, fields[name])
+            os.replace(temporary_path, path)
+        return fields
+
+    def _get_paths(self, key, names):
+        """
+        Files of a group of fields.
+
+        :param key: Key as obtained from get_key
+        :param names: Names of the fields in the group
+        :return: dictionary with the path of each name
+        """
+        directory = os.path.join(self.cache_dir, key)
+        return {name: os.path.join(directory, name + '.npy') for name in names}
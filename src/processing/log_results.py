@@ -91,14 +91,10 @@ class PositionLogger:
 
     def _get_index_array(self):
         """
-        Convert the index map of the pedestrians to an numpy array.
-        Each index (each row) contains the unique pedestrian counter.
-        Empty arrays correspond to -1, so that index_array > 0 == active_array
+        Map each index of the pedestrian arrays to the unique pedestrian counter.
+        Empty entries correspond to -1, so that index_array >= 0 == active_array
 
         :return: a numpy array, shape of active_array with pedestrian counters
         """
-        index_array = np.zeros_like(self.simulation.scene.active_entries) - 1
-        for key, val in self.simulation.scene.index_map.items():
-            if val:
-                index_array[key] = val.counter
-        return index_array
+        scene = self.simulation.scene
+        return np.where(scene.active_entries, scene.counter_array, -1)
@@ -28,7 +28,7 @@ class Result:
         self.planner = planner
 
         ft.log("Simulations results are processed and stored in folder '%s'" % self.result_dir)
-        if not hasattr(scene.pedestrian_list[0], "line"):
+        if not hasattr(scene.get_pedestrian(0), "line"):
             self.no_paths = True
             ft.log("Storing results for Dynamic planner")
         else:
@@ -37,7 +37,7 @@ class Result:
         self.position_list = []
 
         # Microscopic measures
-        init_number = len(self.scene.pedestrian_list)
+        init_number = np.sum(self.scene.active_entries)
         self.time_spent = np.zeros(init_number)
         self.mean_speed = np.zeros(init_number)
         self.max_speed = np.zeros(init_number)
@@ -74,9 +74,9 @@ class Result:
         All pre-processing and calls that should be executed before the simulation starts.
         :return: None
         """
-        for pedestrian in self.scene.pedestrian_list:
-            self.on_pedestrian_entrance(pedestrian)
-        self.density = len(self.scene.pedestrian_list) / np.prod(self.scene.size.array)
+        for index in np.where(self.scene.active_entries)[0]:
+            self.on_pedestrian_entrance(self.scene.get_pedestrian(index))
+        self.density = np.sum(self.scene.active_entries) / np.prod(self.scene.size.array)
         self.max_speed = self.scene.max_speed_array
 
     def on_step(self):
@@ -88,7 +88,7 @@ class Result:
         :return: None
         """
         distance = np.linalg.norm(self.scene.position_array - self.scene.last_position_array, axis=1)
-        index_list = [self.scene.index_map[index].counter for index in np.where(self.scene.active_entries)[0]]
+        index_list = self.scene.counter_array[self.scene.active_entries]
         self.pressure_sum += self.planner.macro.pressure_field.array
         # for pedestrian in self.scene.pedestrian_list:
         #     if self.scene.active_entries[pedestrian.index]:
@@ -129,8 +129,7 @@ class Result:
         :return: None
         """
         ft.log("Starting post-processing results")
-        unfinished_counters = [self.scene.index_map[index].counter for index in
-                               np.where(self.scene.active_entries)[0]]
+        unfinished_counters = self.scene.counter_array[self.scene.active_entries]
         for ped_index in unfinished_counters:
             self.time_spent[ped_index] = self.scene.time
         # self.paths_list = np.array(self.paths_list)
@@ -0,0 +1,118 @@
+import os
+import re
+import time
+
+import numpy as np
+
+from math_objects import functions as ft
+
+
+class StageProfiler:
+    """
+    Opt-in profiler that measures the wall time of every stage in the step pipeline of the simulation.
+    Timings are stored in a preallocated (steps x stages) array, summarized on finish and stored on disk.
+    """
+
+    def __init__(self, simulation, initial_steps=1024):
+        """
+        Create a new profiler for the simulation.
+
+        :param simulation: Simulation whose step functions are timed
+        :param initial_steps: number of steps to allocate the timing array for. The array doubles when full.
+        """
+        self.simulation = simulation
+        self.params = None
+        self.stages = []
+        self.stage_names = []
+        self.timings = np.zeros([initial_steps, 0])
+        self.num_steps = 0
+
+    def prepare(self, params):
+        """
+        Called before the simulation starts, after the step pipeline has been built.
+        Registers the stages and allocates the timing array.
+
+        :params: Parameter object
+        :return: None
+        """
+        self.params = params
+        self.stages = list(self.simulation.on_step_functions)
+        self.stage_names = []
+        occurrences = {}
+        for stage in self.stages:
+            name = self.get_stage_name(stage)
+            occurrences[name] = occurrences.get(name, 0) + 1
+            if occurrences[name] > 1:
+                # Several populations of the same type
+                name = "%s#%d" % (name, occurrences[name])
+            self.stage_names.append(name)
+        self.timings = np.zeros([self.timings.shape[0], len(self.stages)])
+
+    @staticmethod
+    def get_stage_name(stage):
+        """
+        Human readable name of a step function, like 'Scene.move'.
+        :param stage: (bound) method
+        :return: name string
+        """
+        if hasattr(stage, '__self__'):
+            return "%s.%s" % (type(stage.__self__).__name__, stage.__name__)
+        return stage.__name__
+
+    def step(self):
+        """
+        Run all the registered stages in order and record their wall times for this step.
+        :return: None
+        """
+        if self.num_steps == self.timings.shape[0]:
+            self.timings = np.concatenate((self.timings, np.zeros(self.timings.shape)), axis=0)
+        row = self.timings[self.num_steps]
+        for i, stage in enumerate(self.stages):
+            start = time.perf_counter()
+            stage()
+            row[i] = time.perf_counter() - start
+        self.num_steps += 1
+
+    def get_summary(self):
+        """
+        Compute statistics of the recorded timings.
+        :return: dictionary with per stage arrays (in seconds) for keys 'mean', 'p95' and 'max'
+        """
+        timings = self.timings[:self.num_steps]
+        if not self.num_steps:
+            timings = np.zeros([1, len(self.stages)])
+        return {'mean': np.mean(timings, axis=0), 'p95': np.percentile(timings, 95, axis=0),
+                'max': np.max(timings, axis=0)}
+
+    def finish(self):
+        """
+        Report the summary of the timings and store the summary (CSV) and the raw timings (NPZ) on disk.
+        :return: None
+        """
+        summary = self.get_summary()
+        total = np.sum(summary['mean'])
+        ft.log("Stage timings over %d steps (mean/p95/max in ms):" % self.num_steps)
+        for i, name in enumerate(self.stage_names):
+            ft.log("%-36s %9.3f %9.3f %9.3f  (%4.1f%%)" % (
+                name, summary['mean'][i] * 1e3, summary['p95'][i] * 1e3, summary['max'][i] * 1e3,
+                100 * summary['mean'][i] / (total + ft.EPS)))
+        base_name = self._get_base_name()
+        with open(base_name + '.csv', 'w') as csv_file:
+            csv_file.write("stage,mean,p95,max\n")
+            for i, name in enumerate(self.stage_names):
+                csv_file.write("%s,%.6e,%.6e,%.6e\n" % (name, summary['mean'][i], summary['p95'][i],
+                                                      summary['max'][i]))
+        np.savez(base_name + '.npz', timings=self.timings[:self.num_steps], stages=np.array(self.stage_names))
+        ft.log("Stored stage timings in %s.csv/.npz" % base_name)
+
+    def _get_base_name(self):
+        """
+        File name (without extension) for the timing files, based on the scene file and the time.
+        :return: path string
+        """
+        results_folder = self.params.result_dir
+        if not os.path.exists(results_folder):
+            os.makedirs(results_folder)
+        match = re.search(r'([^/]+)\.(png|jpe?g)$', self.params.scene_file)
+        scene_name = match.group(1) if match else 'scene'
+        return os.path.join(results_folder, "profile-%s-%d" % (scene_name, time.time()))
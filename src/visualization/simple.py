@@ -129,8 +129,8 @@ class VisualScene:
         x, y = (event.x / self.size[0], 1 - event.y / self.size[1])
         scene_point = Point([x * self.scene.size[0], y * self.scene.size[1]])
         ft.log("Mouse location: %s" % scene_point)
-        for pedestrian in self.scene.pedestrian_list:
-            print(pedestrian)
+        for index in np.where(self.scene.active_entries)[0]:
+            print(self.scene.get_pedestrian(index))
         for obstacle in self.scene.obstacle_list:
             print(obstacle)
 
@@ -178,11 +178,10 @@ class VisualScene:
         :return: None
         """
         start_pos_array, end_pos_array = self.get_visual_pedestrian_coordinates()
-        for pedestrian in self.scene.pedestrian_list:
-            index = pedestrian.index
+        for index in np.where(self.scene.active_entries)[0]:
             self.canvas.create_oval(start_pos_array[index, 0], start_pos_array[index, 1],
                                     end_pos_array[index, 0], end_pos_array[index, 1],
-                                    fill=pedestrian.color)
+                                    fill=self.scene.color_list[self.scene.color_array[index]])
 
     def get_visual_pedestrian_coordinates(self):
         """
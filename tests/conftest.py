@@ -0,0 +1,25 @@
+"""
+Shared setup of the pytest checks: the modules are imported like the simulation scripts do,
+from the root of the repository (lib, src) and from src (objects, populations, ...).
+"""
+import os
+import sys
+
+import numpy as np
+import scipy.misc
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+sys.path.insert(0, ROOT)
+
+# Scene images are read with scipy.misc.imread, which was removed from newer SciPy versions
+if not hasattr(scipy.misc, 'imread'):
+    from PIL import Image
+
+    def _imread(image, mode=None):
+        image = Image.open(image)
+        return np.array(image.convert(mode) if mode else image)
+
+    scipy.misc.imread = _imread
+if not hasattr(np, 'bool'):
+    np.bool = bool
@@ -0,0 +1,38 @@
+import numpy as np
+
+from src.mercurial import Simulation
+from src.params import Parameters
+
+
+def create_simulation():
+    params = Parameters()
+    params.seed = 0
+    params.dynamic_potential_interval = 5
+    params.dynamic_potential_threshold = 0
+    simulation = Simulation('scenes/test.png', params)
+    simulation.add_pedestrians(200, 'knowing', goals=[1, 3])
+    simulation.add_global('repulsion')
+    simulation.set_visualisation(False)
+    return simulation
+
+
+def test_checkpoint_of_dynamic_potential(tmp_path):
+    path = str(tmp_path / 'checkpoint.npz')
+    simulation = create_simulation()
+    simulation.prepare()
+    for _ in range(7):
+        simulation.step()
+    simulation.save_checkpoint(path)
+    steps_since_update = simulation.populations[0].steps_since_update
+    cost_multiplier = simulation.populations[0].cost_multiplier.copy()
+    for _ in range(8):
+        simulation.step()
+    resumed = Simulation.from_checkpoint(path)
+    population = resumed.populations[0]
+    assert population.steps_since_update == steps_since_update
+    assert np.any(cost_multiplier > 1)
+    np.testing.assert_array_equal(population.cost_multiplier, cost_multiplier)
+    for _ in range(8):
+        resumed.step()
+    np.testing.assert_array_equal(resumed.scene.active_entries, simulation.scene.active_entries)
+    np.testing.assert_array_equal(resumed.scene.position_array, simulation.scene.position_array)
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from lib.micro_macro import comp_dens_velo
+from macro.density import comp_dens_velo_grid
+from src.mercurial import Simulation
+from src.params import Parameters
+
+
+def get_crowd(number, size, margin):
+    generator = np.random.default_rng(0)
+    positions = generator.uniform(margin, np.subtract(size, margin), (number, 2))
+    velocities = generator.normal(0, 1, (number, 2))
+    return positions, velocities, np.ones(number, dtype=int)
+
+
+@pytest.mark.parametrize('dx, dy, h', [(2, 2, 1), (2, 2, 2), (1, 2, 2.5), (0.5, 0.5, 1)])
+def test_grid_density_conserves_mass(dx, dy, h):
+    n_x, n_y = 100, 80
+    # Away from the boundaries, so that no mass is convolved out of the grid
+    positions, velocities, active = get_crowd(5000, (n_x * dx, n_y * dy), 4 * h)
+    if 2 * h < 2 * max(dx, dy):
+        with pytest.raises(ValueError):
+            comp_dens_velo_grid(positions, velocities, active, n_x, n_y, dx, dy, h)
+        return
+    density, _, _ = comp_dens_velo_grid(positions, velocities, active, n_x, n_y, dx, dy, h)
+    assert np.sum(density) * dx * dy == pytest.approx(len(positions), rel=1e-9)
+
+
+def test_grid_density_matches_kernel():
+    n_x = n_y = 100
+    dx = dy = 2
+    positions, velocities, active = get_crowd(20000, (n_x * dx, n_y * dy), 0)
+    kernel_density, kernel_v_x, _ = comp_dens_velo(positions, velocities, active, n_x, n_y, dx, dy, 4)
+    density, v_x, _ = comp_dens_velo_grid(positions, velocities, active, n_x, n_y, dx, dy, 4)
+    assert np.linalg.norm(density - kernel_density) / np.linalg.norm(kernel_density) < 0.05
+    assert np.linalg.norm(v_x - kernel_v_x) / np.linalg.norm(kernel_v_x) < 0.15
+
+
+@pytest.mark.parametrize('smoothing_length, estimator', [(1, comp_dens_velo), (2, comp_dens_velo_grid)])
+def test_grid_density_falls_back_to_kernel(smoothing_length, estimator):
+    params = Parameters()
+    params.density_estimator = 'grid'
+    params.smoothing_length = smoothing_length
+    simulation = Simulation('scenes/test.png', params)
+    simulation.add_pedestrians(50, 'knowing')
+    simulation.add_global('repulsion')
+    simulation.set_visualisation(False)
+    simulation.prepare()
+    assert simulation.effects['repulsion'].density_estimator is estimator
+    simulation.step()
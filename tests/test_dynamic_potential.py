@@ -0,0 +1,34 @@
+import numpy as np
+
+from src.mercurial import Simulation
+from src.params import Parameters
+
+
+def test_dynamic_potential_corrects_static_navigator():
+    params = Parameters()
+    params.seed = 0
+    params.dynamic_potential_interval = 5
+    simulation = Simulation('scenes/test.png', params)
+    simulation.add_pedestrians(300, 'knowing', goals=[1, 3])
+    simulation.add_global('repulsion')
+    simulation.set_visualisation(False)
+    simulation.prepare()
+    population = simulation.populations[0]
+    navigator = population.navigator
+    for _ in range(11):
+        simulation.step()
+    assert population.dynamic_updates >= 2
+    # Only the fields on the pressure grid are updated
+    assert population.navigator is navigator
+    assert all(field.array.shape == simulation.scene.density_field.array.shape
+               for fields in population.dynamic_corrections for field in fields)
+    indices = np.flatnonzero(population.indices)
+    positions = simulation.scene.position_array[indices]
+    goals = population.goal_array[indices]
+    static = navigator.get_directions(positions, goals)
+    corrected = population._correct_directions(static.copy(), positions, goals)
+    np.testing.assert_allclose(np.linalg.norm(corrected, axis=1), 1, atol=1e-3)
+    # The crowd changes the directions, but pedestrians still head roughly to the same exits
+    cosine = np.sum(static * corrected, axis=1)
+    assert np.any(cosine < 0.999)
+    assert np.mean(cosine) > 0.8
@@ -0,0 +1,28 @@
+import numpy as np
+
+from src.ensemble import Ensemble, EnsembleResult
+
+
+def get_summary(seed, exit_times, active):
+    return {'seed': seed, 'counter': 10, 'time': 1., 'exit_times': np.array(exit_times, dtype=float),
+            'final_positions': np.zeros((len(active), 2)), 'active': np.array(active)}
+
+
+def test_evacuation_time_of_stopped_replicas():
+    result = EnsembleResult([get_summary(0, [3, 5, 4], [False, False, False]),
+                             get_summary(1, [2, np.nan, np.nan, np.nan], [False, True, True, True]),
+                             get_summary(2, [np.nan, np.nan], [True, True])])
+    np.testing.assert_array_equal(result.get_evacuated_fraction(), [1, 0.25, 0])
+    np.testing.assert_array_equal(result.get_evacuation_times(), [5, np.inf, np.inf])
+    np.testing.assert_array_equal(result.get_last_exit_times(), [5, 2, np.nan])
+    assert 'mean evacuated fraction 0.417' in repr(result)
+    assert '1 replicas evacuated in a mean time of 5.00' in repr(result)
+
+
+def test_replicas_that_did_not_finish():
+    ensemble = Ensemble('scenes/test.png', populations=[(50, 'knowing')], replicas=2, seed=0, max_steps=20)
+    result = ensemble.run(workers=1)
+    fraction = result.get_evacuated_fraction()
+    assert np.all(fraction < 1)
+    assert np.all(np.isinf(result.get_evacuation_times()))
+    assert np.all(np.isnan(result.get_last_exit_times()) | (result.get_last_exit_times() <= result.times))
@@ -0,0 +1,70 @@
+import os
+
+import numpy as np
+
+from processing.field_cache import FieldCache
+from src.mercurial import Simulation
+from src.params import Parameters
+
+
+def count_files(directory):
+    return sum(len(files) for _, _, files in os.walk(directory))
+
+
+def test_cost_changes_are_not_cached(tmp_path):
+    params = Parameters()
+    params.seed = 0
+    params.cache_dir = str(tmp_path)
+    simulation = Simulation('scenes/test.png', params)
+    simulation.add_pedestrians(20, 'knowing')
+    simulation.set_visualisation(False)
+    simulation.prepare()
+    scene = simulation.scene
+    simulation.step()
+    cached_fields, cached_files = len(scene.field_cache.fields), count_files(tmp_path)
+    cells = (slice(200, 220), slice(300, 320))
+    for costs in (np.inf, 1, np.inf, 1):
+        scene.change_costs(cells, costs)
+        simulation.step()
+    assert np.isinf(scene.env_field[cells]).sum() == 0
+    assert len(scene.field_cache.fields) == cached_fields
+    assert count_files(tmp_path) == cached_files
+
+
+def test_fields_are_loaded_from_disk(tmp_path):
+    computed = []
+
+    def compute():
+        computed.append(True)
+        return {'potential': np.arange(12.).reshape(3, 4), 'gradient': np.ones((2, 4))}
+
+    cache = FieldCache(str(tmp_path))
+    key = cache.get_key('test', cache.get_array_digest(np.zeros(3)), 1.5)
+    assert key == FieldCache.get_key('test', FieldCache.get_array_digest(np.zeros(3)), 1.5)
+    assert key != FieldCache.get_key('test', FieldCache.get_array_digest(np.zeros(4)), 1.5)
+    fields = cache.get_fields(key, ('potential', 'gradient'), compute)
+    assert cache.get_fields(key, ('potential', 'gradient'), compute)['potential'] is fields['potential']
+    # Another process (a new cache) loads the stored fields, memory-mapped copy-on-write
+    loaded = FieldCache(str(tmp_path)).get_fields(key, ('potential', 'gradient'), compute)
+    assert len(computed) == 1
+    assert isinstance(loaded['potential'], np.memmap)
+    np.testing.assert_array_equal(loaded['potential'], fields['potential'])
+    loaded['potential'][0, 0] = -1
+    np.testing.assert_array_equal(np.load(os.path.join(str(tmp_path), key, 'potential.npy')), fields['potential'])
+    assert not [name for name in os.listdir(os.path.join(str(tmp_path), key)) if name.endswith('.tmp')]
+
+
+def test_simulation_loads_cached_fields(tmp_path):
+    directions = []
+    for _ in range(2):
+        params = Parameters()
+        params.seed = 0
+        params.cache_dir = str(tmp_path)
+        simulation = Simulation('scenes/test.png', params)
+        simulation.add_pedestrians(20, 'knowing')
+        simulation.set_visualisation(False)
+        simulation.prepare()
+        directions.append(simulation.scene.direction_field)
+    assert not isinstance(directions[0], np.memmap)
+    assert isinstance(directions[1], np.memmap)
+    np.testing.assert_array_equal(*directions)
@@ -0,0 +1,32 @@
+import numpy as np
+
+from src.mercurial import Simulation
+from src.params import Parameters
+
+
+def test_populations_share_background_fire_field():
+    params = Parameters()
+    params.seed = 0
+    params.background_fire_field = True
+    simulation = Simulation('scenes/test.png', params)
+    simulation.add_pedestrians(20, 'knowing')
+    simulation.add_pedestrians(20, 'knowing')
+    simulation.add_fire([30, 40], 5)
+    simulation.set_visualisation(False)
+    submitted = []
+    submit = simulation.scene.submit_distance_transform
+
+    def count_submit(cost_field):
+        submitted.append(cost_field)
+        return submit(cost_field)
+
+    simulation.scene.submit_distance_transform = count_submit
+    simulation.prepare()
+    first, second = simulation.populations
+    assert len(submitted) == 1
+    assert first.fire_future is second.fire_future
+    first._collect_fire_potential(wait=True)
+    second._collect_fire_potential(wait=True)
+    assert second.fire_fields['potential'] is first.fire_fields['potential']
+    assert np.isfinite(first.fire_fields['potential']).any()
+    assert not simulation.scene.field_cache.futures
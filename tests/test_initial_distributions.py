@@ -0,0 +1,46 @@
+import numpy as np
+
+from objects.initial_distributions import InitialDistribution, Impulse
+from src.mercurial import Simulation
+from src.params import Parameters
+
+
+def get_scene(number, distribution=None):
+    params = Parameters()
+    params.seed = 0
+    simulation = Simulation('scenes/test.png', params)
+    simulation.add_pedestrians(number, 'knowing', distribution=distribution)
+    simulation.set_visualisation(False)
+    simulation.prepare()
+    return simulation.scene
+
+
+def get_cells(scene):
+    cells = (scene.position_array[scene.active_entries] // (scene.dx, scene.dy)).astype(int)
+    return cells[:, 0], cells[:, 1]
+
+
+def test_pedestrians_start_on_accessible_cells():
+    scene = get_scene(2000)
+    field = scene.direction_field[get_cells(scene)]
+    assert np.all((0 < field) & (field < np.inf))
+
+
+def test_density_and_region():
+    shape = (8, 6)
+    density = np.zeros(shape)
+    density[:4] = 1
+    density[4:] = 3
+    scene = get_scene(3000, InitialDistribution(density=density, region=((0, 0), (1, 0.5))))
+    positions = scene.position_array[scene.active_entries]
+    assert np.all(positions[:, 1] <= 0.5 * scene.size[1] + scene.dy)
+    # Three times as dense on the right half (up to the accessible area of each half)
+    right = np.mean(positions[:, 0] >= scene.size[0] / 2)
+    assert 0.6 < right < 0.9
+
+
+def test_impulse():
+    scene = get_scene(500, Impulse((0.3, 0.4), 10))
+    positions = scene.position_array[scene.active_entries]
+    distance = np.linalg.norm(positions - scene.size.array * (0.3, 0.4), axis=1)
+    assert np.all(distance <= 10 + np.hypot(scene.dx, scene.dy))
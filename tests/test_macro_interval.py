@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+from src.mercurial import Simulation
+from src.params import Parameters
+
+
+@pytest.mark.parametrize('extrapolation', (False, True))
+def test_macro_fields_every_interval(extrapolation):
+    params = Parameters()
+    params.seed = 0
+    params.macro_interval = 3
+    params.macro_extrapolation = extrapolation
+    simulation = Simulation('scenes/test.png', params)
+    simulation.add_pedestrians(200, 'knowing')
+    simulation.add_global('repulsion')
+    simulation.set_visualisation(False)
+    simulation.prepare()
+    repulsion = simulation.effects['repulsion']
+    macro_counters = []
+    update_macro_fields = repulsion.update_macro_fields
+
+    def record_macro_step():
+        macro_counters.append(simulation.scene.counter)
+        update_macro_fields()
+
+    repulsion.update_macro_fields = record_macro_step
+    densities = []
+    for _ in range(10):
+        simulation.step()
+        densities.append(repulsion.density_field.array.copy())
+    assert len(macro_counters) == repulsion.macro_steps
+    assert repulsion.micro_steps == 10
+    # The first step computes the fields, then every step of which the counter is a multiple of the interval
+    assert macro_counters == [1, 3, 6, 9]
+    # In between macro steps, the fields are not computed again
+    changed = [not np.array_equal(new, old) for old, new in zip(densities, densities[1:])]
+    assert sum(changed) <= len(macro_counters) - 1
+    assert len(repulsion.field_changes) == len(macro_counters) - 1
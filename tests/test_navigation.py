@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+
+from math_objects.scalar_field import ScalarField as Field
+from populations.navigation import Navigator
+from src.mercurial import Simulation
+from lib.wdt import get_exit_labels
+from src.params import Parameters
+
+
+def get_gradient_fields(shape, gradient):
+    """
+    Gradient fields of a potential with a constant gradient.
+    :param shape: Shape of the grid
+    :param gradient: (x, y) gradient
+    :return: gradient fields on the vertical and horizontal faces
+    """
+    grad_x = Field(shape, Field.Orientation.vertical_face, 'grad_x')
+    grad_y = Field(shape, Field.Orientation.horizontal_face, 'grad_y')
+    grad_x.update(np.full(grad_x.array.shape, float(gradient[0])))
+    grad_y.update(np.full(grad_y.array.shape, float(gradient[1])))
+    return grad_x, grad_y
+
+
+@pytest.mark.parametrize('method', Navigator.methods)
+def test_goal_tables_of_large_grids(method):
+    # More cells than an int16 goal offset can address
+    shape = (300, 200)
+    fields = [get_gradient_fields(shape, gradient) for gradient in ((-1, 0), (0, -1), (1, 0))]
+    navigator = Navigator([grad_x for grad_x, _ in fields], [grad_y for _, grad_y in fields], method)
+    positions = np.random.default_rng(0).uniform((1, 1), (299, 199), (100, 2))
+    goals = np.arange(100, dtype=np.int16) % 3
+    directions = navigator.get_directions(positions, goals)
+    expected = np.array([(1, 0), (0, 1), (-1, 0)])[goals]
+    # The directions are normalized with functions.EPS, which a Simulation sets to params.tolerance
+    assert np.allclose(directions, expected, atol=1e-3)
+
+
+@pytest.mark.parametrize('method', ('bilinear', 'nearest'))
+def test_simulation_with_lookup_navigation(method):
+    params = Parameters()
+    params.seed = 0
+    params.navigation = method
+    simulation = Simulation('scenes/test.png', params)
+    simulation.add_pedestrians(50, 'knowing', goals=[1, 3])
+    simulation.set_visualisation(False)
+    simulation.prepare()
+    population = simulation.populations[0]
+    assert simulation.scene.env_field.size > np.iinfo(np.int16).max
+    for _ in range(5):
+        simulation.step()
+    # Every pedestrian walks down the potential of its own goal
+    indices = np.flatnonzero(population.indices & simulation.scene.active_entries)
+    positions = simulation.scene.position_array[indices]
+    directions = population.navigator.get_directions(positions, population.goal_array[indices])
+    params.navigation = 'spline'
+    expected = population._get_potential_planner(population.plain_fields).get_directions(
+        positions, population.goal_array[indices])
+    assert np.mean(np.sum(directions * expected, axis=1)) > 0.9
+
+
+def test_exit_labels():
+    cost_field = np.ones((20, 10))
+    cost_field[0, 2:5] = 0
+    cost_field[19, 2:5] = 0
+    cost_field[19, 7] = 0
+    labels, number = get_exit_labels(cost_field)
+    assert number == 3
+    assert len(np.unique(labels[0, 2:5])) == 1 and labels[0, 2] > 0
+    assert labels[19, 2] != labels[19, 7]
+    assert np.all(labels[cost_field > 0] == 0)
+
+
+def test_goal_potentials():
+    params = Parameters()
+    params.seed = 0
+    simulation = Simulation('scenes/test.png', params)
+    simulation.add_pedestrians(200, 'knowing', goals=[1, 3])
+    simulation.set_visualisation(False)
+    simulation.prepare()
+    scene = simulation.scene
+    population = simulation.populations[0]
+    assert population.goals == [(1,), (3,)]
+    goals = population.goal_array[population.indices & scene.active_entries]
+    assert set(np.unique(goals)) == {0, 1}
+    for fields, goal in zip(population.plain_fields, population.goals):
+        # The potential of a goal is zero in its exit only; the other exits are obstacles
+        potential = fields['potential']
+        in_goal = np.isin(scene.exit_labels, goal)
+        np.testing.assert_array_equal(potential[in_goal], 0)
+        other_exits = (scene.exit_labels > 0) & ~in_goal
+        assert np.all(potential[other_exits] > 0)
+    with pytest.raises(ValueError):
+        simulation = Simulation('scenes/test.png', Parameters())
+        simulation.add_pedestrians(10, 'knowing', goals=[scene.num_exits + 1])
+        simulation.set_visualisation(False)
+        simulation.prepare()
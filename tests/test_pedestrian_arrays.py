@@ -0,0 +1,110 @@
+import numpy as np
+
+from math_objects.geometry import Point
+from src.mercurial import Simulation
+from src.params import Parameters
+
+
+def get_simulation(number=100, **options):
+    params = Parameters()
+    params.seed = 0
+    vars(params).update(options)
+    simulation = Simulation('scenes/test.png', params)
+    simulation.add_pedestrians(number, 'knowing')
+    simulation.set_visualisation(False)
+    simulation.prepare()
+    return simulation
+
+
+def test_pedestrians_are_rows_of_the_arrays():
+    scene = get_simulation().scene
+    capacity = len(scene.active_entries)
+    for attr in scene.pedestrian_arrays:
+        assert len(getattr(scene, attr)) == capacity
+    indices = np.flatnonzero(scene.active_entries)
+    assert len(indices) == 100
+    assert sorted(scene.counter_array[indices]) == list(range(100))
+    pedestrian = scene.get_pedestrian(indices[7])
+    assert pedestrian.counter == scene.counter_array[indices[7]]
+    pedestrian.position = Point([12.5, 30.25])
+    np.testing.assert_array_equal(scene.position_array[indices[7]], [12.5, 30.25])
+    np.testing.assert_array_equal(pedestrian.position.array, [12.5, 30.25])
+
+
+def test_finished_pedestrians_leave_in_one_batch():
+    simulation = get_simulation()
+    scene = simulation.scene
+    indices = np.flatnonzero(scene.active_entries)
+    exit_cells = np.argwhere(scene.env_field == 0)
+    leaving = indices[:10]
+    scene.position_array[leaving] = (exit_cells[:10] + 0.5) * (scene.dx, scene.dy)
+    calls = []
+    scene.on_pedestrian_exit_functions.append(lambda exited: calls.append(np.array(exited)))
+    num_free = scene.num_free
+    scene.time = 4.5
+    scene.find_finished()
+    assert len(calls) == 1
+    np.testing.assert_array_equal(np.sort(calls[0]), leaving)
+    assert not np.any(scene.active_entries[leaving])
+    assert np.all(scene.active_entries[indices[10:]])
+    assert scene.exited_pedestrians == 10
+    assert scene.num_free == num_free + 10
+    exit_times = scene.get_exit_times()
+    np.testing.assert_array_equal(exit_times[scene.counter_array[leaving]], 4.5)
+    assert np.sum(np.isfinite(exit_times)) == 10
+
+
+def test_compaction_keeps_identities():
+    params = Parameters()
+    params.seed = 0
+    simulation = Simulation('scenes/test.png', params)
+    simulation.add_pedestrians(60, 'knowing', goals=[1, 3])
+    simulation.add_pedestrians(40, 'knowing', goals=[3])
+    simulation.set_visualisation(False)
+    simulation.prepare()
+    scene = simulation.scene
+    scene.remove_pedestrians(np.flatnonzero(scene.active_entries)[::3])
+
+    def get_identities():
+        identities = {}
+        for population in simulation.populations:
+            for index in np.flatnonzero(population.indices & scene.active_entries):
+                identities[scene.counter_array[index]] = (
+                    population.id, population.goals[population.goal_array[index]],
+                    tuple(scene.position_array[index]), scene.max_speed_array[index], scene.color_array[index])
+        return identities
+
+    identities = get_identities()
+    assert len(identities) == np.sum(scene.active_entries)
+    scene.compact()
+    assert len(scene.active_entries) == len(identities)
+    assert np.all(scene.active_entries)
+    assert get_identities() == identities
+    # The populations and their goal arrays were remapped too: the simulation continues
+    for _ in range(3):
+        simulation.step()
+    assert np.all(np.isfinite(scene.position_array[scene.active_entries]))
+
+
+def test_free_entries_are_reused():
+    simulation = get_simulation()
+    scene = simulation.scene
+    population = simulation.populations[0]
+    capacity = len(scene.active_entries)
+    removed = np.flatnonzero(scene.active_entries)[10:30]
+    scene.remove_pedestrians(removed)
+    positions = scene.position_array.copy()
+    # Freed entries are allocated again before the arrays grow
+    indices = scene.allocate(20)
+    np.testing.assert_array_equal(np.sort(indices), removed)
+    scene.add_pedestrians(indices, population.id)
+    assert len(scene.active_entries) == capacity
+    assert np.all(population.indices[indices])
+    # More pedestrians than free entries: the arrays grow and keep their contents
+    indices = scene.allocate(scene.num_free + 5)
+    scene.add_pedestrians(indices, population.id)
+    assert len(scene.active_entries) >= 2 * capacity
+    kept = np.setdiff1d(np.arange(capacity), np.concatenate((removed, indices)))
+    np.testing.assert_array_equal(scene.position_array[kept], positions[kept])
+    counters = scene.counter_array[scene.active_entries]
+    assert len(np.unique(counters)) == len(counters) == scene.spawned_pedestrians - 20
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from macro.pressure_solver import PressureSolver
+
+
+def get_congested_fields(nx, ny):
+    """
+    Crowd that is denser than the maximum density in a blob and walks towards its center.
+    """
+    x, y = np.meshgrid(np.linspace(-1, 1, nx), np.linspace(-1, 1, ny), indexing='ij')
+    density = 1 + 6 * np.exp(-(x ** 2 + y ** 2) / 0.1)
+    return density, -x, -y
+
+
+def solve(method, nx, ny, tolerance):
+    density, velo_x, velo_y = get_congested_fields(nx, ny)
+    solver = PressureSolver(nx, ny, tolerance=tolerance, max_iterations=20000, method=method)
+    pressure, iterations, residual = solver.solve(density, velo_x, velo_y, 1., 1., 0.1, 4.)
+    overshoot = solver.matrix @ pressure.ravel(order='F') + solver.q
+    return pressure, iterations, residual, overshoot
+
+
+@pytest.mark.parametrize('method', PressureSolver.methods)
+def test_pressure_solver_satisfies_tolerance(method):
+    tolerance = 1e-6
+    pressure, iterations, residual, overshoot = solve(method, 48, 40, tolerance)
+    assert residual <= tolerance
+    assert iterations < 20000
+    assert np.all(pressure >= 0)
+    assert np.max(pressure) > 0
+    assert np.min(overshoot) >= -tolerance
+    assert abs(np.dot(overshoot, pressure.ravel(order='F'))) <= tolerance
+
+
+def test_pressure_solvers_agree():
+    pgs_pressure, pgs_iterations, _, _ = solve('pgs', 64, 48, 1e-8)
+    multigrid_pressure, multigrid_iterations, _, _ = solve('multigrid', 64, 48, 1e-8)
+    assert np.max(np.abs(multigrid_pressure - pgs_pressure)) <= 1e-4 * np.max(pgs_pressure)
+    assert multigrid_iterations < pgs_iterations
+
+
+def test_multigrid_on_small_grids(capsys):
+    small = PressureSolver(16, 16, method='multigrid')
+    assert not small.prolongations
+    assert 'projected Gauss-Seidel' in capsys.readouterr().out
+    assert PressureSolver(17, 16, method='multigrid').prolongations
+    pressure, _, residual, _ = solve('multigrid', 16, 16, 1e-6)
+    assert residual <= 1e-6
+    np.testing.assert_array_equal(pressure, solve('pgs', 16, 16, 1e-6)[0])
+
+
+def test_warm_start_reuses_pattern():
+    density, velo_x, velo_y = get_congested_fields(48, 40)
+    solver = PressureSolver(48, 40, tolerance=1e-6, max_iterations=20000)
+    solver.solve(density, velo_x, velo_y, 1., 1., 0.1, 4.)
+    matrix = solver.matrix
+    cold_iterations = solver.iterations
+    changed_density = density * 1.01
+    pressure, iterations, residual = solver.solve(changed_density, velo_x, velo_y, 1., 1., 0.1, 4.)
+    assert solver.matrix is matrix
+    assert iterations < cold_iterations
+    fresh = PressureSolver(48, 40, tolerance=1e-6, max_iterations=20000)
+    fresh_pressure, _, _ = fresh.solve(changed_density, velo_x, velo_y, 1., 1., 0.1, 4.)
+    assert (solver.matrix != fresh.matrix).nnz == 0
+    np.testing.assert_allclose(pressure, fresh_pressure, atol=1e-3 * np.max(fresh_pressure))
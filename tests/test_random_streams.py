@@ -0,0 +1,41 @@
+import json
+
+import numpy as np
+
+from math_objects.random_streams import RandomStreams
+from src.mercurial import Simulation
+from src.params import Parameters
+
+
+def test_named_stream_is_reproducible_from_seed():
+    first, second = RandomStreams(42), RandomStreams(42)
+    # Streams do not depend on the order in which they are used, or on the other streams
+    second['colors'].random(100)
+    np.testing.assert_array_equal(first['placement'].random(10), second['placement'].random(10))
+    assert not np.array_equal(RandomStreams(42)['placement'].random(10), RandomStreams(42)['inflow'].random(10))
+    assert not np.array_equal(RandomStreams(42)['placement'].random(10), RandomStreams(43)['placement'].random(10))
+
+
+def test_stream_state_round_trip():
+    streams = RandomStreams(7)
+    streams['speeds'].random(5)
+    state = json.loads(json.dumps(streams.get_state()))
+    restored = RandomStreams()
+    restored.set_state(state)
+    np.testing.assert_array_equal(restored['speeds'].random(5), streams['speeds'].random(5))
+    np.testing.assert_array_equal(restored['other'].random(5), streams['other'].random(5))
+
+
+def test_seeded_simulations_are_identical():
+    positions = []
+    for _ in range(2):
+        params = Parameters()
+        params.seed = 3
+        simulation = Simulation('scenes/test.png', params)
+        simulation.add_pedestrians(50, 'knowing')
+        simulation.set_visualisation(False)
+        simulation.prepare()
+        for _ in range(5):
+            simulation.step()
+        positions.append(simulation.scene.position_array.copy())
+    np.testing.assert_array_equal(*positions)
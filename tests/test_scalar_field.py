@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+
+from math_objects.scalar_field import ScalarField as Field
+
+
+def get_fields(shape, orientation, number):
+    generator = np.random.default_rng(0)
+    fields = [Field(shape, orientation, 'field%d' % i, (0.5, 2)) for i in range(number)]
+    for field in fields:
+        field.update(generator.normal(size=field.array.shape))
+    return fields
+
+
+@pytest.mark.parametrize('orientation', list(Field.Orientation))
+def test_sample_fields_matches_sample(orientation):
+    fields = get_fields((40, 30), orientation, 3)
+    positions = np.random.default_rng(1).uniform((-1, -1), (21, 61), (500, 2))
+    out = np.full((600, 3), np.nan)
+    samples = Field.sample_fields(fields, positions, out=out[:len(positions)])
+    assert np.shares_memory(samples, out)
+    for j, field in enumerate(fields):
+        np.testing.assert_allclose(samples[:, j], field.sample(positions))
+    np.testing.assert_allclose(Field.sample_fields(fields, positions), samples)
+
+
+def test_sample_linear_field():
+    field = Field((40, 30), Field.Orientation.center, 'linear', (0.5, 2))
+    x, y = np.meshgrid(field.x_range, field.y_range, indexing='ij')
+    field.update(3 * x - 2 * y)
+    positions = np.random.default_rng(1).uniform((0.25, 1), (19.75, 59), (200, 2))
+    np.testing.assert_allclose(Field.sample_fields([field], positions)[:, 0], 3 * positions[:, 0] - 2 * positions[:, 1])
@@ -0,0 +1,60 @@
+import os
+
+import numpy as np
+
+from processing.stage_profiler import StageProfiler
+from src.mercurial import Simulation
+from src.params import Parameters
+
+
+class Stage:
+    def __init__(self):
+        self.calls = 0
+
+    def run(self):
+        self.calls += 1
+
+
+class Pipeline:
+    def __init__(self, stages):
+        self.on_step_functions = [stage.run for stage in stages]
+
+
+def test_profiler_times_every_stage(tmp_path):
+    stages = [Stage(), Stage()]
+    params = Parameters()
+    params.result_dir = str(tmp_path)
+    params.scene_file = 'scenes/test.png'
+    profiler = StageProfiler(Pipeline(stages), initial_steps=2)
+    profiler.prepare(params)
+    assert profiler.stage_names == ['Stage.run', 'Stage.run#2']
+    for _ in range(5):
+        profiler.step()
+    assert [stage.calls for stage in stages] == [5, 5]
+    assert profiler.num_steps == 5
+    assert profiler.timings.shape == (8, 2)
+    summary = profiler.get_summary()
+    assert np.all(summary['max'] >= summary['p95']) and np.all(summary['p95'] >= 0)
+    profiler.finish()
+    files = sorted(os.listdir(str(tmp_path)))
+    assert [os.path.splitext(name)[1] for name in files] == ['.csv', '.npz']
+    assert files[0].startswith('profile-test-')
+    with np.load(os.path.join(str(tmp_path), files[1])) as data:
+        assert data['timings'].shape == (5, 2)
+
+
+def test_simulation_with_stage_profiling(tmp_path):
+    params = Parameters()
+    params.seed = 0
+    params.result_dir = str(tmp_path)
+    simulation = Simulation('scenes/test.png', params)
+    simulation.add_pedestrians(20, 'knowing')
+    simulation.set_visualisation(False)
+    simulation.set_stage_profiling(True)
+    simulation.prepare()
+    for _ in range(3):
+        simulation.step()
+    profiler = simulation.profiler
+    assert profiler.num_steps == 3
+    assert 'Scene.move' in profiler.stage_names
+    assert np.all(profiler.timings[:3] > 0)
@@ -0,0 +1,55 @@
+import numpy as np
+
+import pytest
+
+from lib.wdt import get_weighted_distance_transform, get_multiresolution_wdt, update_weighted_distance_transform
+
+
+def get_cost_field():
+    """
+    Room with a pillar, a wall with a door and an exit in the right wall.
+    """
+    cost_field = np.ones((240, 200))
+    cost_field[[0, -1], :] = np.inf
+    cost_field[:, [0, -1]] = np.inf
+    cost_field[60:100, 80:130] = np.inf
+    cost_field[150:154, :] = np.inf
+    cost_field[150:154, 20:40] = 1
+    cost_field[-1, 90:110] = 0
+    return cost_field
+
+
+def test_multiresolution_wdt_gradient():
+    cost_field = get_cost_field()
+    reference = get_weighted_distance_transform(cost_field)
+    accessible = np.isfinite(reference) & (cost_field > 0)
+    for coarsening in (2, 4, 8):
+        wdt_field = get_multiresolution_wdt(cost_field, coarsening)
+        assert np.array_equal(np.isfinite(wdt_field), np.isfinite(reference))
+        error = np.abs(wdt_field[accessible] - reference[accessible]) / reference[accessible]
+        assert np.mean(error) < 0.01
+        # The potential decreases towards a neighbour from every cell: no flat cells and no local minima
+        padded = np.pad(wdt_field, 1, 'constant', constant_values=np.inf)
+        lowest_neighbour = np.min([padded[:-2, 1:-1], padded[2:, 1:-1], padded[1:-1, :-2], padded[1:-1, 2:]], axis=0)
+        assert np.all(lowest_neighbour[accessible] < wdt_field[accessible])
+
+
+@pytest.mark.parametrize('cells, costs, tolerance', [
+    ((slice(150, 154), slice(20, 40)), np.inf, 1e-9),  # Close the door
+    ((slice(150, 154), slice(150, 170)), 1, 1e-9),  # Open a second door
+    ((slice(0, 1), slice(40, 60)), 0, 1e-9),  # New exit
+    ((slice(239, 240), slice(90, 100)), np.inf, 1e-9),  # Block half of the exit
+    # Where the face costs jump, the upwind update depends on the order of the updates
+    ((slice(100, 140), slice(20, 180)), 3, 1e-3),  # Slower region
+])
+def test_repaired_wdt_matches_full_solve(cells, costs, tolerance):
+    cost_field = get_cost_field()
+    wdt_field = get_weighted_distance_transform(cost_field, 'sweeping')
+    new_cost_field = np.array(cost_field)
+    new_cost_field[cells] = costs
+    repaired = update_weighted_distance_transform(wdt_field, new_cost_field, new_cost_field != cost_field)
+    # The repair sweeps the invalidated cells: compare with sweeping on the full field
+    reference = get_weighted_distance_transform(new_cost_field, 'sweeping')
+    assert np.array_equal(np.isfinite(repaired), np.isfinite(reference))
+    finite = np.isfinite(reference)
+    np.testing.assert_allclose(repaired[finite], reference[finite], rtol=tolerance, atol=1e-9)